@@ -2,21 +2,26 @@
 import os
 
 import boto3
+from botocore.exceptions import ClientError  # Every S3 error, including "304 Not Modified" of conditional GET
 
 from config_class import API_PROFILES
 
 
 class AWS_S3(object):
     '''Minimal Amazon AWS class to communicate with S3 data storage service.
-       Currently supports only download and upload commands.
-       In context of Telegram bot used to store crypto_info.pickle online, which is a dict with Coinmarketcap coin meta infos.
+       Supports download/upload of files and of in-memory objects with metadata, including conditional download by ETag.
+       In context of Telegram bot used to store crypto_info.db online, a store with Coinmarketcap coin meta infos.
+       "s3_client" replaces the boto3 client, e.g. with a local S3 stand-in (see benchmarks/fake_s3.py).
     '''
     AWS_BUCKET_NAME = API_PROFILES['AWS_BUCKET_NAME']
     AWS_ACCESS_KEY_ID = API_PROFILES['AWS_ACCESS_KEY_ID']
     AWS_SERVER_SECRET_KEY = API_PROFILES['AWS_SERVER_SECRET_KEY']
     REGION = API_PROFILES['REGION']
 
-    def __init__(self):
+    def __init__(self, s3_client=None):
+        if s3_client is not None:
+            self.S3_CLIENT = s3_client
+            return
         self.SESSION = boto3.Session(
             aws_access_key_id=self.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=self.AWS_SERVER_SECRET_KEY,
@@ -34,6 +39,36 @@ class AWS_S3(object):
                                    Bucket=self.AWS_BUCKET_NAME,
                                    Key=aws_filename)
 
+    def put_object(self, aws_filename: str, body: bytes, metadata: dict = None) -> str:
+        '''Uploads "body" as object "aws_filename" with optional user metadata. Returns ETag of the new object.'''
+        reply = self.S3_CLIENT.put_object(Bucket=self.AWS_BUCKET_NAME, Key=aws_filename, Body=body, Metadata=metadata or {})
+        return reply['ETag']
+
+    def get_object_if_changed(self, aws_filename: str, etag: str = None) -> tuple:
+        ''' Conditional download: returns (body, etag, metadata) of object "aws_filename", or (None, etag, None) if it still has
+            given "etag" (S3 answers "304 Not Modified" without sending the body). Raises ClientError if object doesn't exist.
+        '''
+        params = {'Bucket': self.AWS_BUCKET_NAME, 'Key': aws_filename}
+        if etag is not None:
+            params['IfNoneMatch'] = etag
+        try:
+            reply = self.S3_CLIENT.get_object(**params)
+        except ClientError as e:
+            if self.is_not_modified(e):
+                return None, etag, None
+            raise
+        return reply['Body'].read(), reply['ETag'], reply.get('Metadata', {})
+
+    @staticmethod
+    def is_not_modified(error: ClientError) -> bool:
+        return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304 or \
+            error.response.get('Error', {}).get('Code') in ('304', 'NotModified')
+
+    @staticmethod
+    def is_missing(error: ClientError) -> bool:
+        return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 404 or \
+            error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey')
+
 
 # Example. NOTE: download_file() raises no errors. If 'PICKLE_NAME' is uploaded to AWS S3, it will download it.
 if __name__ == '__main__':
@@ -0,0 +1,79 @@
+''' Load test: thread-based CMC lookups (what run_async handlers did) vs the asyncio pipeline, against a local fake CMC server.
+    A burst of N lookups arrives at once. Thread path runs them on a fixed worker pool with the blocking coinmarketcapapi client
+    (python-telegram-bot Dispatcher has 4 workers by default). Async path sends them all through one pooled AsyncCMCClient.
+    Every lookup asks for a different token, so nothing is coalesced or cached -> pure transport comparison.
+    Run: python benchmarks/bench_async_pipeline.py [n_lookups] [latency_seconds]
+'''
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from coinmarketcapapi import CoinMarketCapAPI  # noqa: E402
+from cmc_async import AsyncCMCClient  # noqa: E402
+from fake_cmc import FakeCMCServer  # noqa: E402
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(name: str, latencies: list, total: float) -> None:
+    print('{0:<22} {1:>9.0f} lookups/s   p50 {2:>8.1f} ms   p99 {3:>8.1f} ms'.format(
+        name, len(latencies) / total, percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3))
+
+
+def thread_path(server: FakeCMCServer, ids: list, workers: int) -> None:
+    local = threading.local()
+
+    def lookup(cmc_id, submitted):
+        if not hasattr(local, 'client'):
+            local.client = CoinMarketCapAPI('bench-key')
+            local.client._CoinMarketCapAPI__base_url = server.url + '/'  # Wrapper has no public option for the API host
+        local.client.cryptocurrency_quotes_latest(id=cmc_id, convert='USD')
+        return time.monotonic() - submitted
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(lookup, cmc_id, time.monotonic()) for cmc_id in ids]
+        latencies = [future.result() for future in futures]
+    report('threads ({})'.format(workers), latencies, time.monotonic() - started)
+
+
+def async_path(server: FakeCMCServer, ids: list, pool_size: int) -> None:
+    async def run():
+        client = AsyncCMCClient(server.url, pool_size=pool_size)
+
+        async def lookup(cmc_id, submitted):
+            await client.request('cryptocurrency_quotes_latest', 'bench-key', id=cmc_id, convert='USD')
+            return time.monotonic() - submitted
+
+        started = time.monotonic()
+        latencies = await asyncio.gather(*[lookup(cmc_id, time.monotonic()) for cmc_id in ids])
+        total = time.monotonic() - started
+        report('asyncio (pool {})'.format(pool_size), latencies, total)
+        await client.close()
+
+    asyncio.run(run())
+
+
+def main() -> None:
+    n_lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    server = FakeCMCServer(n_tokens=max(n_lookups, 10000), latency=latency).start()
+    ids = [token['id'] for token in server.tokens[:n_lookups]]
+    print('{0} simultaneous lookups, fake CMC latency {1:.0f} ms'.format(n_lookups, latency * 1e3))
+    thread_path(server, ids, workers=4)
+    thread_path(server, ids, workers=32)
+    async_path(server, ids, pool_size=100)
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+''' End-to-end load test of the whole bot without any live service: fake CoinMarketCap API (fake_cmc.py) and fake Telegram Bot API
+    (fake_telegram.py) run in their own processes, the bot runs in this one with its real handlers from main.py, registered by
+    main.add_handlers() on a python-telegram-bot Dispatcher. Updates are put into the dispatcher's update queue, the same way webhook
+    mode does it, at a fixed rate (open loop: a slow bot doesn't slow the senders down). Replies go over HTTP to fake Telegram.
+    Latency of an update = time from when it was due to be sent until its reply (sendMessage, answerInlineQuery, editMessageText)
+    was accepted by fake Telegram.
+    Workload is generated from fixed seeds: chat lookups of popular tokens ("BTC", "eth eur", typos), inline queries typed
+    keystroke by keystroke, /crypto, its page buttons and /fiat. Same arguments -> same updates -> results comparable across commits.
+    Add --json FILE to append results (with git commit) as one JSON line per run.
+    Run: python benchmarks/bench_e2e.py [--rate 100] [--messages 2000] [--mix chat=70,inline=15,page=8,crypto=4,fiat=3] ...
+'''
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Bot, Update  # noqa: E402
+from telegram.ext import Dispatcher  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+from fake_cmc import FIATS, FakeCMCServer, make_universe  # noqa: E402
+from fake_telegram import FakeTelegramServer  # noqa: E402
+
+DEFAULT_MIX = 'chat=70,inline=15,page=8,crypto=4,fiat=3'  # Weights of user actions. One inline action is up to 6 updates (keystrokes).
+REPLY_METHODS = {'chat': 'sendMessage', 'crypto': 'sendMessage', 'fiat': 'sendMessage', 'inline': 'answerInlineQuery',
+                 'page': 'editMessageText'}  # Bot API call that answers an update of each kind
+CHAT_ID_BASE = 10 ** 6  # Every update comes from its own chat -> replies are matched to updates by chat id
+REPLY_TIMEOUT = 30  # seconds to wait for the last replies after everything was sent. Updates without reply by then count as lost.
+DISPATCHER_WORKERS = 4  # Same as telegram.ext.Updater default
+BOT_TOKEN = '123456:fake-telegram-token'  # Only fake Telegram ever sees it
+
+
+# ----- fake services in their own processes, so they don't share the bot's GIL -----
+def _serve(factory, kwargs: dict, connection) -> None:
+    server = factory(**kwargs).start()
+    connection.send(server.url)
+    while True:
+        command = connection.recv()
+        if command == 'stats':
+            connection.send({'calls': dict(server.calls), 'credits': getattr(server, 'credits', 0)})
+        elif command == 'stop':
+            server.stop()
+            connection.send(None)
+            return
+
+
+class ServiceProcess(object):
+    '''Runs a fake server (FakeCMCServer, FakeTelegramServer) in a child process. stats() -> its call counters.'''
+
+    def __init__(self, factory, **kwargs):
+        context = multiprocessing.get_context('spawn')  # No fork: the bot process runs threads
+        self._connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_serve, args=(factory, kwargs, child_connection), daemon=True)
+        self.process.start()
+        self.url = self._connection.recv()
+
+    def stats(self) -> dict:
+        self._connection.send('stats')
+        return self._connection.recv()
+
+    def stop(self) -> None:
+        self._connection.send('stop')
+        self._connection.recv()
+        self.process.join(5)
+
+
+# ----- reply tracking -----
+class RecordingRequest(Request):
+    '''python-telegram-bot HTTP layer that reports every finished Bot API call as (method, chat or inline query id, time).'''
+    __slots__ = ('on_reply',)
+
+    def __init__(self, on_reply, **kwargs):
+        super().__init__(**kwargs)
+        self.on_reply = on_reply
+
+    def post(self, url: str, data: dict, timeout: float = None):
+        data = data or {}
+        key = str(data.get('inline_query_id') or data.get('chat_id') or '')
+        result = super().post(url, data, timeout)
+        self.on_reply(url.rsplit('/', 1)[1], key, time.monotonic())
+        return result
+
+
+class ReplyRecorder(object):
+    '''Matches Bot API calls to the updates they answer.'''
+
+    def __init__(self):
+        self.expected = {}  # (method, key) -> update index
+        self.replied_at = {}  # update index -> time of its reply
+        self.calls = Counter()
+        self.all_replied = threading.Event()
+        self._lock = threading.Lock()
+
+    def expect(self, index: int, method: str, key: str) -> None:
+        self.expected[(method, key)] = index
+
+    def __call__(self, method: str, key: str, at: float) -> None:
+        with self._lock:
+            self.calls[method] += 1
+            index = self.expected.pop((method, key), None)
+            if index is not None:
+                self.replied_at[index] = at
+                if len(self.expected) == 0:
+                    self.all_replied.set()
+
+
+# ----- workload -----
+def typo(word: str, rnd: random.Random) -> str:
+    letters = list(word)
+    i = rnd.randrange(len(letters))
+    letters[i] = rnd.choice(string.ascii_lowercase)
+    return ''.join(letters)
+
+
+def popular(tokens: list, rnd: random.Random) -> dict:
+    '''Token picked like users pick them: a handful of top coins most of the time, a long tail of everything else.'''
+    return tokens[min(len(tokens) - 1, int(rnd.paretovariate(0.8)) - 1)]
+
+
+def make_workload(tokens: list, n_messages: int, mix: dict, seed: int, first_update_id: int) -> list:
+    ''' [(kind, update dict, reply key)] of "n_messages" Telegram updates. "mix" is kind -> weight.
+        Inline queries come in bursts of keystrokes: "e", "et", "eth" ... like Telegram sends them while the user types.
+    '''
+    rnd = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    currencies = [symbol for _, symbol, _ in FIATS if symbol != 'USD']
+    user = {'id': 777, 'is_bot': False, 'first_name': 'Load', 'last_name': 'Test'}
+    workload = []
+    while len(workload) < n_messages:
+        kind = rnd.choices(kinds, weights)[0]
+        texts = [None]
+        if kind == 'chat':
+            token = popular(tokens, rnd)
+            text = rnd.choice([token['symbol'], token['symbol'].lower(), token['name']])
+            if rnd.random() < 0.2:
+                text += ' ' + rnd.choice(currencies)
+            if rnd.random() < 0.05:
+                text = typo(text, rnd)
+            texts = [text]
+        elif kind == 'inline':
+            token = popular(tokens, rnd)
+            word = rnd.choice([token['symbol'], token['name']]).lower()
+            texts = [word[:length] for length in range(1, min(len(word), 6) + 1)]
+        elif kind in ('crypto', 'fiat'):
+            texts = ['/' + kind]
+        for text in texts:
+            update_id = first_update_id + len(workload)
+            chat = {'id': CHAT_ID_BASE + update_id, 'type': 'private', 'first_name': 'Load', 'last_name': 'Test'}
+            message = {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+            if kind in ('crypto', 'fiat'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+            if kind == 'inline':
+                update = {'update_id': update_id, 'inline_query': {'id': str(update_id), 'from': user, 'query': text, 'offset': ''}}
+                key = str(update_id)
+            elif kind == 'page':
+                message['text'] = 'Crypto tokens on CoinMarketCap'
+                update = {'update_id': update_id, 'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': '1',
+                                                                    'message': message, 'data': 'crypto_page:{}'.format(rnd.randint(1, 150))}}
+                key = str(chat['id'])
+            else:
+                update = {'update_id': update_id, 'message': message}
+                key = str(chat['id'])
+            workload.append((kind, update, key))
+    return workload[:n_messages]
+
+
+# ----- measurement -----
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] if ordered else float('nan')
+
+
+def rss_mb() -> float:
+    '''Current resident memory of this process, MB (Linux).'''
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def drive(dispatcher: Dispatcher, recorder: ReplyRecorder, workload: list, rate: float) -> dict:
+    '''Sends the workload at "rate" updates per second and waits for replies. Returns measurements.'''
+    bot = dispatcher.bot
+    updates = []
+    for index, (kind, update, key) in enumerate(workload):
+        recorder.expect(index, REPLY_METHODS[kind], key)
+        updates.append(Update.de_json(update, bot))
+    recorder.all_replied.clear()
+    due = []
+    started = time.monotonic()
+    for index, update in enumerate(updates):
+        due_at = started + index / rate
+        delay = due_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        due.append(due_at)
+        dispatcher.update_queue.put(update)
+    sent = time.monotonic()
+    recorder.all_replied.wait(REPLY_TIMEOUT)
+    latencies = defaultdict(list)
+    for index, (kind, _, _) in enumerate(workload):
+        replied_at = recorder.replied_at.get(index)
+        if replied_at is not None:
+            latencies[kind].append(replied_at - due[index])
+    last_reply = max(recorder.replied_at.values(), default=sent)
+    recorder.expected.clear()
+    recorder.replied_at.clear()
+    return {'latencies': latencies, 'send_seconds': sent - started, 'seconds': last_reply - started}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(','):
+        kind, weight = part.split('=')
+        if kind not in REPLY_METHODS:
+            raise argparse.ArgumentTypeError('Unknown update kind "{0}", use some of: {1}'.format(kind, ', '.join(REPLY_METHODS)))
+        mix[kind] = float(weight)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rate', type=float, default=100, help='updates per second')
+    parser.add_argument('--messages', type=int, default=2000, help='updates measured')
+    parser.add_argument('--warm-up', type=int, default=300, help='updates sent before measuring, not counted')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help='user actions and their weights')
+    parser.add_argument('--tokens', type=int, default=10000, help='tokens in fake CMC map')
+    parser.add_argument('--cmc-latency', type=float, default=0.05, help='seconds per fake CMC reply')
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help='seconds per fake Telegram reply')
+    parser.add_argument('--telegram-limits', action='store_true', help='fake Telegram answers 429 over 30 msgs/s or 1 msg/s per chat')
+    parser.add_argument('--sync', action='store_true', help='lookups on dispatcher threads (main.USE_ASYNC_PIPELINE = False)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='append results to this file as one JSON line')
+    args = parser.parse_args()
+
+    cmc = ServiceProcess(FakeCMCServer, n_tokens=args.tokens, latency=args.cmc_latency)
+    telegram_api = ServiceProcess(FakeTelegramServer, latency=args.telegram_latency, flood_limits=args.telegram_limits)
+    rss_before_bot = rss_mb()
+
+    # Bot modules read CMC address and file locations when they are imported -> patch first. Fresh directory: maps come from CMC.
+    import coinmarketcap
+    directory = tempfile.mkdtemp()
+    CMCPrices = coinmarketcap.CMCPrices
+    CMCPrices.CMC_API_BASE_URL = cmc.url
+    CMCPrices.DIR_PATH = directory
+    CMCPrices.CRYPTO_INFO_PICKLE_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_PICKLE_NAME)
+    CMCPrices.CRYPTO_INFO_DB_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_DB_NAME)
+    logging.getLogger('apscheduler').setLevel(logging.WARNING)
+    import main as bot_main
+    from media_cache import MediaCache
+    logging.getLogger().setLevel(logging.WARNING)
+    bot_main.MEDIA = MediaCache(os.path.join(directory, 'media_file_ids.json'))
+    bot_main.USE_ASYNC_PIPELINE = not args.sync
+    CP = bot_main.CP
+    CP.READY.wait()
+    CP.api_key_scheduled_check()  # Fake CMC limits instead of free plan defaults, like the first reconciliation after a start
+
+    recorder = ReplyRecorder()
+    request = RecordingRequest(recorder, con_pool_size=DISPATCHER_WORKERS + 4)  # Same pool size as telegram.ext.Updater
+    bot = Bot(BOT_TOKEN, base_url=telegram_api.url + '/bot', request=request)
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=DISPATCHER_WORKERS, use_context=True)
+    bot_main.add_handlers(dispatcher)
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+
+    tokens = make_universe(args.tokens)
+    if args.warm_up > 0:
+        drive(dispatcher, recorder, make_workload(tokens, args.warm_up, args.mix, args.seed + 1, 1), args.rate)
+    cmc_before, telegram_calls_before = cmc.stats(), Counter(recorder.calls)
+    flood_waits_before = telegram_api.stats()['calls'].get('429', 0)
+    workload = make_workload(tokens, args.messages, args.mix, args.seed, args.warm_up + 1)
+    result = drive(dispatcher, recorder, workload, args.rate)
+    cmc_after = cmc.stats()
+    flood_waits = telegram_api.stats()['calls'].get('429', 0) - flood_waits_before
+
+    dispatcher.stop()
+    telegram_api.stop()
+    cmc.stop()
+
+    latencies = result['latencies']
+    every = [latency for kind_latencies in latencies.values() for latency in kind_latencies]
+    answered, kinds = len(every), Counter(kind for kind, _, _ in workload)
+    cmc_calls = Counter(cmc_after['calls'])
+    cmc_calls.subtract(cmc_before['calls'])
+    telegram_calls = recorder.calls - telegram_calls_before
+    cache = CP.QUOTE_CACHE.stats()
+    summary = {
+        'commit': git_commit(), 'date': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+        'args': {name: value for name, value in vars(args).items() if name != 'json'},
+        'updates': len(workload), 'answered': answered, 'lost': len(workload) - answered,
+        'msgs_per_s': answered / result['seconds'] if result['seconds'] > 0 else 0.0,
+        'p50_ms': percentile(every, 50) * 1e3, 'p95_ms': percentile(every, 95) * 1e3, 'p99_ms': percentile(every, 99) * 1e3,
+        'max_ms': max(every, default=float('nan')) * 1e3,
+        'per_kind': {kind: {'updates': kinds[kind], 'p50_ms': percentile(values, 50) * 1e3, 'p99_ms': percentile(values, 99) * 1e3}
+                     for kind, values in sorted(latencies.items())},
+        'cmc_calls_per_msg': sum(cmc_calls.values()) / len(workload),
+        'cmc_calls': {path: calls for path, calls in sorted(cmc_calls.items()) if calls > 0},
+        'cmc_credits': cmc_after['credits'] - cmc_before['credits'],
+        'telegram_calls': dict(sorted(telegram_calls.items())), 'telegram_429': flood_waits,
+        'quote_cache_hit_ratio': cache['hit_ratio'],
+        'rss_mb': rss_mb(), 'bot_rss_mb': rss_mb() - rss_before_bot,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+    print('\ncommit {0}, {1} updates at {2:.0f}/s ({3}), {4} tokens, CMC latency {5:.0f} ms, Telegram latency {6:.0f} ms{7}'.format(
+        summary['commit'] or '?', len(workload), args.rate, ', '.join('{0} {1}'.format(k, kinds[k]) for k in sorted(kinds)),
+        args.tokens, args.cmc_latency * 1e3, args.telegram_latency * 1e3, ', sync handlers' if args.sync else ''))
+    print('throughput {0:8.1f} msgs/s   answered {1}/{2}   p50 {3:.1f} ms   p95 {4:.1f} ms   p99 {5:.1f} ms   max {6:.1f} ms'.format(
+        summary['msgs_per_s'], answered, len(workload), summary['p50_ms'], summary['p95_ms'], summary['p99_ms'], summary['max_ms']))
+    for kind, stats in summary['per_kind'].items():
+        print('  {0:<7} {1:>6} updates   p50 {2:8.1f} ms   p99 {3:8.1f} ms'.format(kind, stats['updates'], stats['p50_ms'], stats['p99_ms']))
+    print('CMC calls per message {0:.3f} ({1}), {2} credits'.format(
+        summary['cmc_calls_per_msg'], ', '.join('{0} {1}'.format(path, calls) for path, calls in summary['cmc_calls'].items()) or 'none',
+        summary['cmc_credits']))
+    print('Telegram calls: {0}, 429 replies {1}'.format(
+        ', '.join('{0} {1}'.format(method, calls) for method, calls in summary['telegram_calls'].items()), flood_waits))
+    print('quote cache hit ratio {0:.0%}   memory: RSS {1:.0f} MB (bot {2:.0f} MB), peak {3:.0f} MB'.format(
+        summary['quote_cache_hit_ratio'], summary['rss_mb'], summary['bot_rss_mb'], summary['peak_rss_mb']))
+    if args.json:
+        with open(args.json, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+    os._exit(0)  # Bot threads (scheduler, asyncio loop, send pool) are not meant to be stopped
+
+
+if __name__ == '__main__':
+    main()
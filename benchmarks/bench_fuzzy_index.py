@@ -0,0 +1,95 @@
+''' Micro-benchmark: resolving typos and full names ("bitcion", "ethereum") to tokens over the whole CMC universe.
+    "before" is the obvious way without an index: difflib.get_close_matches() against every symbol, name and slug.
+    "after" is FuzzyIndex.search(). Queries are names and symbols with one random typo (swapped, replaced, missing or extra
+    letter), plus full names typed right. Recall = the token the typo came from is among the first 3 results.
+    The generated universe is harder than the real one: every name ends with one of 4 words ("Coin", "Token", ...).
+    Run: python benchmarks/bench_fuzzy_index.py [n_tokens]
+'''
+import difflib
+import os
+import random
+import string
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_cmc import make_universe  # noqa: E402
+from fuzzy_index import FuzzyIndex, normalize  # noqa: E402
+from symbol_index import CryptoEntry  # noqa: E402
+
+N_TOKENS = 10000
+N_QUERIES = 2000
+N_BEFORE_QUERIES = 30  # difflib is slow, a few queries are enough to see it
+LIMIT = 3
+
+
+def typo(word: str, rnd: random.Random) -> str:
+    letters = list(word)
+    i = rnd.randrange(len(letters))
+    kind = rnd.choice(['swap', 'replace', 'delete', 'insert'])
+    if kind == 'swap' and len(letters) > 1:
+        i = min(i, len(letters) - 2)
+        letters[i], letters[i + 1] = letters[i + 1], letters[i]
+    elif kind == 'replace':
+        letters[i] = rnd.choice(string.ascii_lowercase)
+    elif kind == 'delete' and len(letters) > 1:
+        del letters[i]
+    else:
+        letters.insert(i, rnd.choice(string.ascii_lowercase))
+    return ''.join(letters)
+
+
+def before(query: str, keys: dict) -> list:
+    return [keys[key] for key in difflib.get_close_matches(normalize(query), keys, n=LIMIT)]
+
+
+def percentile(samples: list, pct: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main() -> None:
+    n_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else N_TOKENS
+    entries = [CryptoEntry(t['id'], t['symbol'], t['name'], t['slug'], t['rank']) for t in make_universe(n_tokens)]
+
+    tracemalloc.start()
+    index = FuzzyIndex(entries)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    build_time = min(timeit.repeat(lambda: FuzzyIndex(entries), number=1, repeat=3))
+
+    rnd = random.Random(7)
+    queries = []  # (query, entry it should find)
+    for entry in rnd.sample(entries, N_QUERIES):
+        word = rnd.choice([entry.symbol, entry.name])
+        if len(normalize(word)) > 3:  # Shorter ones are never guessed on purpose, see FuzzyIndex.max_edits()
+            queries.append((typo(word, rnd), entry))
+    queries += [(entry.name, entry) for entry in rnd.sample(entries, N_QUERIES // 10)]
+
+    samples, found = [], 0
+    for query, entry in queries:
+        started = timeit.default_timer()
+        results = index.search(query, LIMIT)
+        samples.append(timeit.default_timer() - started)
+        found += any(result.id == entry.id for result, _ in results)
+
+    keys = {}
+    for entry in reversed(entries):  # Best ranked entry wins when several share a key
+        for text in (entry.symbol, entry.name, entry.slug):
+            keys[normalize(text)] = entry
+    t_before = min(timeit.repeat(lambda: [before(q, keys) for q, _ in queries[:N_BEFORE_QUERIES]], number=1, repeat=2)) / N_BEFORE_QUERIES
+    found_before = sum(any(result.id == entry.id for result in before(q, keys)) for q, entry in queries[:N_BEFORE_QUERIES])
+    found_after = sum(any(result.id == entry.id for result, _ in index.search(q, LIMIT)) for q, entry in queries[:N_BEFORE_QUERIES])
+
+    print('Universe: {0} tokens, {1} keys'.format(len(entries), len(index)))
+    print('FuzzyIndex build (once per map load): {0:.0f} ms, {1:.1f} MB'.format(build_time * 1e3, memory / 2 ** 20))
+    print('before (difflib):     {0:10.0f} us/query, recall {1}/{2}'.format(t_before * 1e6, found_before, N_BEFORE_QUERIES))
+    print('after  (FuzzyIndex):  p50 {0:.0f} us, p90 {1:.0f} us, p99 {2:.0f} us, recall {3}/{4} (same queries)'.format(
+        percentile(samples, 50) * 1e6, percentile(samples, 90) * 1e6, percentile(samples, 99) * 1e6, found_after, N_BEFORE_QUERIES))
+    print('after recall over all {0} queries: {1:.1%}'.format(len(queries), found / len(queries)))
+    print('speedup (p50): {:.0f}x'.format(t_before / percentile(samples, 50)))
+
+
+if __name__ == '__main__':
+    main()
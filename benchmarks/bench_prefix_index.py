@@ -0,0 +1,82 @@
+''' Micro-benchmark: latency of inline autocomplete over the whole CMC universe.
+    "before" is what answering a prefix from the crypto map takes without an index: scan every token's symbol and name words,
+    then sort the matches by rank. "after" is PrefixIndex.complete(). Prefixes are 1-6 characters of real symbols and names,
+    i.e. every keystroke of somebody typing a token into an inline query, plus prefixes nothing starts with.
+    Run: python benchmarks/bench_prefix_index.py [n_tokens]
+'''
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_cmc import make_universe  # noqa: E402
+from prefix_index import PrefixIndex  # noqa: E402
+from symbol_index import CryptoEntry  # noqa: E402
+
+N_TOKENS = 10000
+N_LOOKUPS = 5000
+LIMIT = 8
+
+
+def keys_of(entry: CryptoEntry) -> list:
+    name = entry.name.casefold()
+    return [entry.symbol.casefold(), name] + name.split()[1:]
+
+
+def before(prefix: str, entries: list, limit: int) -> list:
+    '''Linear scan with the same matching and ranking rules as PrefixIndex: symbol, name or a word of the name starts with prefix,
+       CMC rank order, best ranked exact match never lower than 2nd.'''
+    prefix = prefix.strip().casefold()
+    found = sorted((entry for entry in entries if any(key.startswith(prefix) for key in keys_of(entry))), key=lambda entry: entry.rank)
+    exact = [entry for entry in found if prefix in keys_of(entry)]
+    if exact and exact[0] not in found[:2]:
+        found = found[:1] + [exact[0]] + [entry for entry in found[1:] if entry is not exact[0]]
+    return found[:limit]
+
+
+def percentile(samples: list, pct: float) -> float:
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main() -> None:
+    n_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else N_TOKENS
+    entries = [CryptoEntry(t['id'], t['symbol'], t['name'], t['slug'], t['rank']) for t in make_universe(n_tokens)]
+
+    tracemalloc.start()
+    index = PrefixIndex(entries, limit=LIMIT)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    build_time = min(timeit.repeat(lambda: PrefixIndex(entries, limit=LIMIT), number=1, repeat=3))
+
+    rnd = random.Random(7)
+    queries = []
+    while len(queries) < N_LOOKUPS:
+        entry = rnd.choice(entries[:200]) if rnd.random() < 0.5 else rnd.choice(entries)  # Popular tokens are typed more often
+        word = rnd.choice([entry.symbol, entry.name])
+        queries.extend(word[:length] for length in range(1, min(6, len(word)) + 1))
+    queries = queries[:N_LOOKUPS - N_LOOKUPS // 10] + ['zzq{}'.format(i) for i in range(N_LOOKUPS // 10)]
+
+    # Fast path must also be right: same candidates in the same order as the linear scan.
+    mismatches = sum(1 for q in queries[:500] if before(q, entries, LIMIT) != index.complete(q))
+
+    t_before = min(timeit.repeat(lambda: [before(q, entries, LIMIT) for q in queries[:200]], number=1, repeat=3)) / 200
+    samples = []
+    for q in queries:
+        started = timeit.default_timer()
+        index.complete(q)
+        samples.append(timeit.default_timer() - started)
+
+    print('Universe: {0} tokens, {1} keys, {2} precomputed heavy prefixes'.format(len(index), index.key_count, len(index._top)))
+    print('PrefixIndex build (once per map load): {0:.0f} ms, {1:.1f} MB'.format(build_time * 1e3, memory / 2 ** 20))
+    print('before (linear scan):  {:10.1f} us/lookup'.format(t_before * 1e6))
+    print('after  (PrefixIndex):  p50 {0:.1f} us, p99 {1:.1f} us, max {2:.1f} us'.format(
+        percentile(samples, 50) * 1e6, percentile(samples, 99) * 1e6, max(samples) * 1e6))
+    print('speedup (p50): {:.0f}x'.format(t_before / percentile(samples, 50)))
+    print('results differ from linear scan: {0} of 500 prefixes'.format(mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+''' Micro-benchmark: cost of turning a CMC quote into a Telegram message, and of the number rounding inside it.
+    "before" is the old CMCPrices._render_quote(): round_nonzero() printing 99 decimals and searching them with a regex, four
+    times per quote, ceil(float()) of the strings it just made and an if/elif emoji cascade. "after" is QuoteRenderer.
+    Also checks that both produce exactly the same text: random quotes over the whole range CMC sends (dust tokens at 1e-12 USD
+    up to trillions of market cap, negative and zero changes, ints) plus hand picked edge cases around every rounding boundary.
+    Run: python benchmarks/bench_render.py [n_quotes]
+'''
+import os
+import random
+import re
+import sys
+import timeit
+from math import ceil
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coinmarketcap import EMOJIS  # noqa: E402
+from quote_render import QuoteRenderer, round_nonzero  # noqa: E402
+
+N_QUOTES = 20000
+N_TIMED = 5000
+BATCH_SIZE = 8  # Quoted candidates of one inline query, roughly
+CMC_URL = 'https://coinmarketcap.com/currencies/'
+EDGE_NUMBERS = [0, 0.0, -0.0, 1, -1, 5, 0.1, -0.1, 0.29, -0.29, 0.999999, 0.99, 0.995, 1.0, 1.005, 0.001, 0.00099999, 1e-05,
+                -1e-05, 5.4e-05, -5.4e-05, 1e-12, 2.0, -2.0, 1.995, -1.995, 14.995, 15.0, -15.0, -14.995, 25.0, -25.0, 49.999,
+                50.0, -50.0, -50.001, 1e16, 123456789.995, 2 ** 60, -(2 ** 60), 0.5, -0.5]
+
+
+def old_round_nonzero(number, digits_to_keep: int = 4) -> str:
+    '''CMCPrices.round_nonzero() before QuoteRenderer, verbatim.'''
+    assert isinstance(number, (float, int)), 'Argument "number" must be of type "float" or "int". You provided: "{}"'.format(type(number))
+    if number == 0:
+        return number
+    number = float(number)
+    if number < 0:
+        negative_number = True
+    else:
+        negative_number = False
+    n = abs(number)
+    if n < 1:
+        s = f'{n:.99f}'
+        index = re.search('[1-9]', s).start()
+        result = s[:index + digits_to_keep]
+        if negative_number is True:
+            return str(-(float(result)))
+        else:
+            return result
+    else:
+        result = str(round(n, digits_to_keep))
+        if negative_number is True:
+            return str(-(float(result)))
+        else:
+            return result
+
+
+def old_render(tmp_crypto_data: dict, currency: str, slug: str, project_url: str, old_currency: str) -> str:
+    '''CMCPrices._render_quote() before QuoteRenderer, verbatim except for taking plain arguments instead of a QuoteRequest.'''
+    data = {
+        'name': tmp_crypto_data['name'],
+        'symbol': tmp_crypto_data['symbol'],
+        'currency': currency,
+        'price': old_round_nonzero(tmp_crypto_data['quote'][currency]['price'], digits_to_keep=2),
+        'market_cap': old_round_nonzero(tmp_crypto_data['quote'][currency]['market_cap'], digits_to_keep=2),
+        'volume_24h': old_round_nonzero(tmp_crypto_data['quote'][currency]['volume_24h'], digits_to_keep=2),
+        'percent_change_24h': old_round_nonzero(tmp_crypto_data['quote'][currency]['percent_change_24h'], digits_to_keep=2),
+        'last_updated': tmp_crypto_data['quote'][currency]['last_updated'][:-5].replace('T', ' ').split()[1] + ' UTC+0'
+    }
+    if old_currency is not None:
+        currency_status_line = '_Currency {0} was not found. Used default {1} instead._\n'.format(old_currency, currency)
+    else:
+        currency_status_line = ''
+    project_url_string = '         [Project page]({})\n\n'.format(project_url) if len(project_url) > 0 else '\n\n'
+    name = f"\n[{data['name']} ({data['symbol']})]({CMC_URL + slug})" + project_url_string
+    price = f"Price:                  *{data['price']}* {data['currency']}\n"
+    market_cap = f"Market Cap:     {ceil(float(data['market_cap'])):,} {data['currency']}\n"
+    volume = f"Volume 24h:    {ceil(float(data['volume_24h'])):,} {data['currency']}\n"
+    last_updated = f"Last Updated: {data['last_updated']}\n\n"
+    if float(data['percent_change_24h']) >= 50:
+        emoji_status = f"{EMOJIS['rocket']}{EMOJIS['rocket']}{EMOJIS['rocket']}"
+    elif float(data['percent_change_24h']) >= 25:
+        emoji_status = f"{EMOJIS['rocket']}{EMOJIS['rocket']}"
+    elif float(data['percent_change_24h']) >= 15:
+        emoji_status = f"{EMOJIS['rocket']}"
+    elif float(data['percent_change_24h']) >= 2:
+        emoji_status = f"{EMOJIS['thumbs_up']}"
+    elif float(data['percent_change_24h']) >= -2 and float(data['percent_change_24h']) <= 2:
+        emoji_status = f"{EMOJIS['zzz']}"
+    elif float(data['percent_change_24h']) <= -50:
+        emoji_status = f"{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}"
+    elif float(data['percent_change_24h']) <= -25:
+        emoji_status = f"{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}"
+    elif float(data['percent_change_24h']) <= -15:
+        emoji_status = f"{EMOJIS['red_triangle']}"
+    elif float(data['percent_change_24h']) <= -2:
+        emoji_status = f"{EMOJIS['thumbs_down']}"
+    change = f"Pct.Ch. 24h:      {data['percent_change_24h']}% {emoji_status}\n"
+    powered_by = "[Powered by @crypto_price_finder_bot](https://t.me/crypto_price_finder_bot)" + f"{EMOJIS['tree']}"
+    return f"{currency_status_line}{name}{price}{market_cap}{volume}{change}{last_updated}{powered_by}"
+
+
+def random_number(rnd: random.Random, low_exponent: int, high_exponent: int, signed: bool = False):
+    number = 10 ** rnd.uniform(low_exponent, high_exponent)
+    if rnd.random() < 0.05:
+        number = int(number)
+    if signed and rnd.random() < 0.5:
+        number = -number
+    return number
+
+
+def make_quotes(n: int, rnd: random.Random) -> list:
+    '''[(token_quote, currency, slug, project_url, old_currency)] i.e. QuoteRenderer.render() arguments.'''
+    quotes = []
+    for i in range(n):
+        currency = rnd.choice(['USD', 'USD', 'EUR', 'JPY'])
+        values = {'price': random_number(rnd, -12, 5), 'market_cap': random_number(rnd, -2, 12),
+                  'volume_24h': random_number(rnd, -2, 11), 'percent_change_24h': random_number(rnd, -4, 2.5, signed=True),
+                  'last_updated': '2022-03-0{0}T{1:02d}:{2:02d}:{3:02d}.000Z'.format(i % 9 + 1, i % 24, i % 60, (i * 7) % 60)}
+        if i < len(EDGE_NUMBERS) * 4:  # Every edge number in every field
+            values[('price', 'market_cap', 'volume_24h', 'percent_change_24h')[i % 4]] = EDGE_NUMBERS[i // 4]
+        token_quote = {'name': 'Token {}'.format(i), 'symbol': 'T{}'.format(i), 'slug': 'token-{}'.format(i), 'quote': {currency: values}}
+        quotes.append((token_quote, currency, token_quote['slug'], rnd.choice(['', 'https://token{}.org'.format(i)]),
+                       rnd.choice([None] * 9 + ['XYZ'])))
+    return quotes
+
+
+def main() -> None:
+    n_quotes = int(sys.argv[1]) if len(sys.argv) > 1 else N_QUOTES
+    rnd = random.Random(7)
+    quotes = make_quotes(n_quotes, rnd)
+    renderer = QuoteRenderer(CMC_URL, EMOJIS)
+
+    mismatches = [quote for quote in quotes if old_render(*quote) != renderer.render(*quote)]
+    numbers = EDGE_NUMBERS + [random_number(rnd, -15, 15, signed=True) for _ in range(n_quotes)]
+    number_mismatches = [number for number in numbers if str(old_round_nonzero(number, 2)) != round_nonzero(number, 2)]
+
+    timed = quotes[:N_TIMED]
+    t_before = min(timeit.repeat(lambda: [old_render(*quote) for quote in timed], number=1, repeat=5)) / len(timed)
+    t_after = min(timeit.repeat(lambda: [renderer.render(*quote) for quote in timed], number=1, repeat=5)) / len(timed)
+    batches = [timed[i:i + BATCH_SIZE] for i in range(0, len(timed), BATCH_SIZE)]
+    t_batch = min(timeit.repeat(lambda: [renderer.render_many(batch) for batch in batches], number=1, repeat=5)) / len(batches)
+    timed_numbers = numbers[:N_TIMED]
+    t_round_before = min(timeit.repeat(lambda: [old_round_nonzero(x, 2) for x in timed_numbers], number=1, repeat=5)) / len(timed_numbers)
+    t_round_after = min(timeit.repeat(lambda: [round_nonzero(x, 2) for x in timed_numbers], number=1, repeat=5)) / len(timed_numbers)
+
+    print('Quotes: {0} ({1} edge values), numbers: {2}'.format(len(quotes), len(EDGE_NUMBERS), len(numbers)))
+    print('before (old _render_quote):  {:6.2f} us/quote'.format(t_before * 1e6))
+    print('after  (QuoteRenderer):      {:6.2f} us/quote'.format(t_after * 1e6))
+    print('after  (render_many, {0}):    {1:6.2f} us/batch, {2:.2f} us/quote'.format(BATCH_SIZE, t_batch * 1e6, t_batch * 1e6 / BATCH_SIZE))
+    print('speedup: {:.1f}x'.format(t_before / t_after))
+    print('round_nonzero: before {0:.2f} us, after {1:.2f} us per number'.format(t_round_before * 1e6, t_round_after * 1e6))
+    print('messages differing from old renderer: {0} of {1}'.format(len(mismatches), len(quotes)))
+    print('numbers rounded differently: {0} of {1}'.format(len(number_mismatches), len(numbers)))
+    for quote in mismatches[:3]:
+        print('  e.g. {}'.format(quote[0]['quote']))
+    for number in number_mismatches[:5]:
+        print('  e.g. {0!r}: {1!r} vs {2!r}'.format(number, str(old_round_nonzero(number, 2)), round_nonzero(number, 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+''' S3 traffic of token metadata sync: old whole-pickle uploads vs MetadataSync, against a local S3 stand-in (fake_s3.py).
+    Simulates one bot session: start with N known tokens, users discover 10 new tokens every other "minute", bot restarts.
+        old -> every minute with >= REUPLOAD_DIFFERENCE new tokens re-pickles and uploads the whole dict. The session counter
+               was never reset, so once over the threshold it re-uploaded every minute, changed or not. Startup downloads everything.
+        new -> compressed snapshot only when content changed; startup is a conditional GET (304 if nothing changed).
+    Also checks that a fresh store pulled from S3 ends up with exactly the same content as the uploader.
+    Run: python benchmarks/bench_s3_sync.py [n_tokens] [minutes]
+'''
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aws_s3 import AWS_S3  # noqa: E402
+from fake_cmc import make_universe  # noqa: E402
+from fake_s3 import FakeS3Client  # noqa: E402
+from metadata_sync import MetadataSync  # noqa: E402
+from token_store import TokenInfoStore  # noqa: E402
+
+REUPLOAD_DIFFERENCE = 10
+
+
+def token_info(token: dict) -> dict:
+    '''Roughly the size and shape of one CMC cryptocurrency/info item.'''
+    return dict(token, description='{0} is a token. '.format(token['name']) * 12, logo='https://s2.coinmarketcap.com/{}.png'.format(token['id']),
+                urls={'website': ['https://{}.example.com'.format(token['slug'])], 'twitter': [], 'chat': [], 'explorer': []},
+                tags=['tag-a', 'tag-b'], platform=None, date_added='2021-01-01T00:00:00.000Z')
+
+
+def old_session(infos: dict, new_batches: list) -> tuple:
+    s3 = FakeS3Client()
+    aws = AWS_S3(s3_client=s3)
+    path = os.path.join(tempfile.mkdtemp(), 'crypto_info.pickle')
+    with open(path, 'wb') as f:
+        pickle.dump(infos, f)
+    aws.upload_file('crypto_info.pickle', path)
+    s3.requests.clear()
+    s3.bytes_in = 0
+    aws.download_file('crypto_info.pickle', path)  # startup
+    saved = len(infos)
+    for batch in new_batches:
+        infos.update(batch)
+        if len(infos) >= saved + REUPLOAD_DIFFERENCE:
+            with open(path, 'wb') as f:
+                pickle.dump(infos, f)
+            aws.upload_file('crypto_info.pickle', path)
+    aws.download_file('crypto_info.pickle', path)  # restart
+    return s3
+
+
+def new_session(infos: dict, new_batches: list) -> tuple:
+    s3 = FakeS3Client()
+    aws = AWS_S3(s3_client=s3)
+    seed = TokenInfoStore(os.path.join(tempfile.mkdtemp(), 'crypto_info.db'))
+    seed.put_many(infos)
+    MetadataSync(aws, seed).push(force=True)
+    s3.requests.clear()
+    s3.bytes_in = s3.bytes_out = 0
+
+    store = TokenInfoStore(os.path.join(tempfile.mkdtemp(), 'crypto_info.db'))
+    sync = MetadataSync(aws, store, min_new_tokens=REUPLOAD_DIFFERENCE)
+    sync.pull()  # startup on a fresh dyno
+    for batch in new_batches:
+        store.put_many(batch)
+        sync.push()
+        sync.push()  # nothing new since -> no request at all
+    store.put_many(new_batches[0])  # same content again
+    sync.push(force=True)  # content hash matches S3 -> skipped
+    sync.pull()  # restart with local store kept -> 304
+
+    fresh = TokenInfoStore(os.path.join(tempfile.mkdtemp(), 'crypto_info.db'))
+    MetadataSync(aws, fresh).pull()  # restart on a fresh dyno
+    assert fresh.content_hash() == store.content_hash(), 'Pulled store differs from uploaded one'
+    return s3, sync
+
+
+def main() -> None:
+    n_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    minutes = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    universe = make_universe(n_tokens + minutes * REUPLOAD_DIFFERENCE)
+    infos = {token['symbol'] + str(token['id']): token_info(token) for token in universe[:n_tokens]}
+    rest = [token_info(token) for token in universe[n_tokens:]]
+    new_batches = []
+    for i in range(0, len(rest), REUPLOAD_DIFFERENCE):
+        new_batches.append({info['symbol'] + str(info['id']): info for info in rest[i:i + REUPLOAD_DIFFERENCE]})
+        new_batches.append({})  # a quiet minute
+
+    started = time.perf_counter()
+    old = old_session(dict(infos), new_batches)
+    old_time = time.perf_counter() - started
+    started = time.perf_counter()
+    new, sync = new_session(dict(infos), new_batches)
+    new_time = time.perf_counter() - started
+
+    print('{0} tokens, {1} minutes with {2} new tokens and {1} quiet minutes, then restart'.format(n_tokens, minutes, REUPLOAD_DIFFERENCE))
+    print('{0:<6} {1:>6} PUT {2:>6} GET {3:>10.1f} MB up {4:>10.1f} MB down {5:>8.2f} s'.format(
+        'old', old.requests['PUT'], old.requests['GET'], old.bytes_in / 1e6, old.bytes_out / 1e6, old_time))
+    print('{0:<6} {1:>6} PUT {2:>6} GET {3:>10.1f} MB up {4:>10.1f} MB down {5:>8.2f} s'.format(
+        'new', new.requests['PUT'], new.requests['GET'], new.bytes_in / 1e6, new.bytes_out / 1e6, new_time))
+    print('new sync stats: {}'.format(sync.stats()))
+
+
+if __name__ == '__main__':
+    main()
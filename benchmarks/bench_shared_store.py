@@ -0,0 +1,100 @@
+''' CMC credits spent by several bot processes, with and without the shared store (multi-process webhook mode, main.BOT_WORKERS).
+    Each process runs its own CMCPrices against one fake CoinMarketCap API (fake_cmc.py) and answers its share of chat lookups
+    of popular tokens from a seeded workload. Without a store every process loads its own maps and quotes; with one
+    (shared_store.StoreServer, same protocol as Redis) they load each quote once between them.
+    Run: python benchmarks/bench_shared_store.py [--processes 4] [--lookups 2000] [--threads 8]
+'''
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import ServiceProcess, popular  # noqa: E402
+from fake_cmc import FIATS, FakeCMCServer, make_universe  # noqa: E402
+from shared_store import SharedStore, StoreServer  # noqa: E402
+
+
+def make_lookups(tokens: list, n: int, seed: int) -> list:
+    rnd = random.Random(seed)
+    currencies = [symbol for _, symbol, _ in FIATS if symbol != 'USD']
+    lookups = []
+    for _ in range(n):
+        token = popular(tokens, rnd)
+        lookups.append((token['symbol'], rnd.choice(currencies) if rnd.random() < 0.2 else 'USD'))
+    return lookups
+
+
+def run_process(index: int, cmc_url: str, store_url: str or None, directory: str, lookups: list, threads: int,
+                start_at: float, results) -> None:
+    import coinmarketcap
+    CMCPrices = coinmarketcap.CMCPrices
+    CMCPrices.CMC_API_BASE_URL = cmc_url
+    CMCPrices.DIR_PATH = directory  # Own directory per process -> maps are not shared through pickle files
+    CMCPrices.CRYPTO_INFO_PICKLE_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_PICKLE_NAME)
+    CMCPrices.CRYPTO_INFO_DB_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_DB_NAME)
+    CP = CMCPrices(store=SharedStore(store_url) if store_url else None, run_jobs=False)
+    time.sleep(max(0.0, start_at - time.time()))  # All processes start their lookups together
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        answered = sum(1 for _, status in executor.map(lambda lookup: CP.getCryptoPrice(*lookup), lookups) if status)
+    CP.ASYNC.run(CP.ASYNC_CMC.close(), timeout=10)
+    results.put((index, answered, time.perf_counter() - started, CP.QUOTE_CACHE.stats()))
+
+
+def measure(processes: int, lookups: list, threads: int, tokens: int, shared: bool) -> dict:
+    cmc = ServiceProcess(FakeCMCServer, n_tokens=tokens, latency=0.05)
+    store_process, store_url = StoreServer.spawn() if shared else (None, None)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start_at = time.time() + 3 + processes  # Time for every process to import and load its maps
+    workers = [context.Process(target=run_process, args=(i, cmc.url, store_url, tempfile.mkdtemp(), lookups[i::processes], threads,
+                                                          start_at, results)) for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    finished = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    stats = cmc.stats()
+    cmc.stop()
+    if store_process is not None:
+        store_process.kill()
+    seconds = max(seconds for _, _, seconds, _ in finished)
+    return {
+        'answered': sum(answered for _, answered, _, _ in finished),
+        'lookups_per_s': len(lookups) / seconds,
+        'calls': stats['calls'],
+        'credits': stats['credits'],
+        'shared_hits': sum(cache['shared_hits'] for _, _, _, cache in finished),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=2000, help='lookups of all processes together')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent lookups per process')
+    parser.add_argument('--tokens', type=int, default=10000, help='tokens in fake CMC map')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    lookups = make_lookups(make_universe(args.tokens), args.lookups, args.seed)
+    print('{0} processes, {1} lookups, {2} threads each, {3} tokens, {4} CPU(s)'.format(
+        args.processes, args.lookups, args.threads, args.tokens, os.cpu_count()))
+    for shared in (False, True):
+        result = measure(args.processes, lookups, args.threads, args.tokens, shared)
+        quote_calls = result['calls'].get('/v2/cryptocurrency/quotes/latest', 0)
+        map_calls = result['calls'].get('/v1/cryptocurrency/map', 0) + result['calls'].get('/v1/fiat/map', 0)
+        print('{0:<12} answered {1}/{2}  {3:7.0f} lookups/s  quote calls {4:5}  map calls {5:3}  credits {6:5}  shared hits {7}'.format(
+            'shared store' if shared else 'no store', result['answered'], len(lookups), result['lookups_per_s'], quote_calls,
+            map_calls, result['credits'], result['shared_hits']))
+
+
+if __name__ == '__main__':
+    main()
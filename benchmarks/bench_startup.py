@@ -0,0 +1,50 @@
+''' Startup: time until CMCPrices can answer the first price lookup, eager vs lazy (warm_up_in_background=True),
+    against a local fake CMC server. Every run starts from an empty directory -> maps come from CMC, like on a fresh dyno.
+        eager -> constructor loads both maps before returning, first lookup uses the index.
+        lazy  -> constructor returns right away, first lookup is a blind query by symbol while maps still load.
+    Run: python benchmarks/bench_startup.py [n_tokens] [latency_seconds]
+'''
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import coinmarketcap  # noqa: E402
+from fake_cmc import FakeCMCServer  # noqa: E402
+
+
+def run(server: FakeCMCServer, lazy: bool) -> dict:
+    directory = tempfile.mkdtemp()
+    CMCPrices = coinmarketcap.CMCPrices
+    CMCPrices.CMC_API_BASE_URL = server.url
+    CMCPrices.DIR_PATH = directory
+    CMCPrices.CRYPTO_INFO_PICKLE_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_PICKLE_NAME)
+    CMCPrices.CRYPTO_INFO_DB_PATH = os.path.join(directory, CMCPrices.CRYPTO_INFO_DB_NAME)
+    started = time.monotonic()
+    cp = CMCPrices(warm_up_in_background=lazy)
+    constructed = time.monotonic() - started
+    token_info, status = cp.getCryptoPrice('eth', 'EUR')
+    assert token_info is not None, status
+    answered = time.monotonic() - started
+    cp.READY.wait()
+    ready = constructed + cp.WARM_UP_SECONDS if lazy else constructed  # Lazy warm-up starts at the end of the constructor
+    return {'constructed': constructed, 'answered': answered, 'ready': ready}
+
+
+def main() -> None:
+    n_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    server = FakeCMCServer(n_tokens=n_tokens, latency=latency).start()
+    results = {name: run(server, lazy) for name, lazy in (('eager', False), ('lazy', True))}
+    server.stop()
+    print('{0} tokens, {1} s CMC latency'.format(n_tokens, latency))
+    for name, result in results.items():
+        print('{0:<6} constructor {1:>6.2f} s   first answer {2:>6.2f} s   maps loaded {3:>6.2f} s'.format(
+            name, result['constructed'], result['answered'], result['ready']))
+
+
+if __name__ == '__main__':
+    main()
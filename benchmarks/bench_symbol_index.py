@@ -0,0 +1,72 @@
+''' Micro-benchmark: per-lookup cost of resolving a chat message symbol (crypto + fiat + slug).
+    "before" replays what CMCPrices.getCryptoPrice() used to do on every message: lower-cased copies of both maps,
+    linear "in" scans and CRYPTO_MAP.index() for the slug. "after" is a single SymbolIndex lookup.
+    Run: python benchmarks/bench_symbol_index.py
+'''
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from symbol_index import CryptoEntry, SymbolIndex  # noqa: E402
+
+N_CRYPTOS = 10000
+N_FIATS = 93
+N_LOOKUPS = 2000
+
+
+def make_maps(seed: int = 42) -> tuple[list, list]:
+    rnd = random.Random(seed)
+    entries = []
+    for cmc_id in range(1, N_CRYPTOS + 1):
+        symbol = ''.join(rnd.choices(string.ascii_uppercase, k=rnd.randint(2, 5)))
+        entries.append(CryptoEntry(cmc_id, symbol, symbol.title() + ' Coin', symbol.lower() + '-coin', cmc_id))
+    fiats = [''.join(rnd.choices(string.ascii_uppercase, k=3)) for _ in range(N_FIATS)]
+    return entries, fiats
+
+
+def before(symbol: str, currency: str, crypto_map: list, slug_map: list, fiat_map: list) -> str or None:
+    crypto_map_lower = [x.lower() for x in crypto_map]
+    fiat_map_lower = [x.lower() for x in fiat_map]
+    if symbol.lower() not in crypto_map_lower:
+        return None
+    if currency.lower() not in fiat_map_lower:
+        return None
+    return slug_map[crypto_map.index(symbol.upper())]
+
+
+def after(symbol: str, currency: str, index: SymbolIndex) -> str or None:
+    entry = index.lookup(symbol)
+    if entry is None or index.fiat(currency) is None:
+        return None
+    return entry.slug
+
+
+def main() -> None:
+    entries, fiats = make_maps()
+    crypto_map = [e.symbol for e in entries]
+    slug_map = [e.slug for e in entries]
+    index = SymbolIndex(entries, fiats)
+
+    rnd = random.Random(7)
+    # Mix of popular (early in list), random and unknown symbols -> roughly what the chat sends.
+    queries = [(rnd.choice(crypto_map[:100]).lower(), rnd.choice(fiats)) for _ in range(N_LOOKUPS // 2)]
+    queries += [(rnd.choice(crypto_map), rnd.choice(fiats)) for _ in range(N_LOOKUPS // 4)]
+    queries += [('NOTACOIN{}'.format(i), 'usd') for i in range(N_LOOKUPS // 4)]
+
+    build_time = timeit.timeit(lambda: SymbolIndex(entries, fiats), number=10) / 10
+    t_before = min(timeit.repeat(lambda: [before(s, c, crypto_map, slug_map, fiats) for s, c in queries], number=1, repeat=3))
+    t_after = min(timeit.repeat(lambda: [after(s, c, index) for s, c in queries], number=1, repeat=3))
+
+    print('Crypto map: {0} symbols ({1} unique), fiat map: {2} currencies'.format(len(entries), len(index), len(fiats)))
+    print('SymbolIndex build (once per map load): {:.2f} ms'.format(build_time * 1e3))
+    print('before: {:10.2f} us/lookup'.format(t_before / len(queries) * 1e6))
+    print('after:  {:10.2f} us/lookup'.format(t_after / len(queries) * 1e6))
+    print('speedup: {:.0f}x'.format(t_before / t_after))
+
+
+if __name__ == '__main__':
+    main()
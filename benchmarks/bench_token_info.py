@@ -0,0 +1,119 @@
+''' Token metadata for the whole CMC universe: memory and load time of the ways the bot has kept it.
+        dict of dicts -> old crypto_info.pickle: every full cryptocurrency/info reply loaded into memory at start
+        store, get()  -> TokenInfoStore reading and parsing the full reply from SQLite on every price lookup
+        store, column -> TokenInfoStore.website(): only the website in memory, full reply stays on disk
+    Replies are generated with the size and shape of real CMC v2 info data (description, logo, tags, urls, platform, contracts).
+    Run: python benchmarks/bench_token_info.py [n_tokens] [lookups]
+'''
+import gc
+import json
+import os
+import pickle
+import random
+import sqlite3
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_cmc import make_universe  # noqa: E402
+from token_store import TokenInfoStore  # noqa: E402
+
+
+def make_info(token: dict, rnd: random.Random) -> dict:
+    words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 9))) for _ in range(rnd.randint(60, 200))]
+    slug = token['slug']
+    contracts = [{'contract_address': '0x' + ''.join(rnd.choices('0123456789abcdef', k=40)),
+                  'platform': {'name': 'Ethereum', 'coin': {'id': '1027', 'name': 'Ethereum', 'symbol': 'ETH', 'slug': 'ethereum'}}}
+                 for _ in range(rnd.randint(0, 3))]
+    return {
+        'id': token['id'], 'name': token['name'], 'symbol': token['symbol'], 'slug': slug, 'category': 'token',
+        'description': ' '.join(words).capitalize() + '.',
+        'logo': 'https://s2.coinmarketcap.com/static/img/coins/64x64/{}.png'.format(token['id']),
+        'subreddit': slug, 'notice': '', 'tags': ['defi', 'binance-smart-chain', 'polygon-ecosystem'][:rnd.randint(0, 3)],
+        'tag-names': ['DeFi', 'BNB Chain', 'Polygon Ecosystem'][:rnd.randint(0, 3)], 'tag-groups': ['INDUSTRY', 'PLATFORM'],
+        'urls': {
+            'website': ['https://{}.io/'.format(slug)] if rnd.random() < 0.9 else [],
+            'twitter': ['https://twitter.com/{}'.format(slug)], 'message_board': [], 'chat': ['https://t.me/{}'.format(slug)],
+            'facebook': [], 'explorer': ['https://etherscan.io/token/{}'.format(c['contract_address']) for c in contracts],
+            'reddit': ['https://reddit.com/r/{}'.format(slug)], 'technical_doc': ['https://{}.io/whitepaper.pdf'.format(slug)],
+            'source_code': ['https://github.com/{}'.format(slug)], 'announcement': [],
+        },
+        'platform': contracts[0]['platform'] if contracts else None, 'date_added': '2021-05-06T00:00:00.000Z',
+        'twitter_username': slug, 'is_hidden': 0, 'date_launched': None, 'contract_address': contracts,
+        'self_reported_circulating_supply': None, 'self_reported_tags': None, 'self_reported_market_cap': None,
+        'infinite_supply': False,
+    }
+
+
+def measure(load) -> tuple:
+    '''(result, seconds, bytes allocated and still held) of "load()". Timed in a run of its own, tracemalloc slows allocations down.'''
+    gc.collect()
+    started = time.perf_counter()
+    load()
+    seconds = time.perf_counter() - started
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, held
+
+
+def time_lookups(lookup, symbols: list) -> float:
+    '''Microseconds per lookup.'''
+    started = time.perf_counter()
+    for symbol in symbols:
+        lookup(symbol)
+    return (time.perf_counter() - started) / len(symbols) * 1e6
+
+
+def main() -> None:
+    n_tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    n_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    rnd = random.Random(1)
+    infos = {}
+    for token in make_universe(n_tokens):
+        infos.setdefault(token['symbol'], make_info(token, rnd))  # Store keeps one token per ticker
+    symbols = [rnd.choice(list(infos)) for _ in range(n_lookups)]
+    directory = tempfile.mkdtemp()
+
+    pickle_path = os.path.join(directory, 'crypto_info.pickle')
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(infos, f)
+    db_path = os.path.join(directory, 'crypto_info.db')
+    TokenInfoStore(db_path).put_many(infos)
+    old_path = os.path.join(directory, 'old_crypto_info.db')  # Store file of the version without the website column
+    old = sqlite3.connect(old_path)
+    old.execute('CREATE TABLE token_info (symbol TEXT PRIMARY KEY, info TEXT NOT NULL)')
+    old.executemany('INSERT INTO token_info VALUES (?, ?)', [(symbol, json.dumps(info)) for symbol, info in infos.items()])
+    old.commit()
+    old.close()
+    del infos
+
+    loaded, pickle_seconds, pickle_bytes = measure(lambda: pickle.load(open(pickle_path, 'rb')))
+    dict_us = time_lookups(lambda symbol: TokenInfoStore.website_of(loaded[symbol]), symbols)
+    loaded.clear()
+    store, store_seconds, store_bytes = measure(lambda: TokenInfoStore(db_path))
+    get_us = time_lookups(lambda symbol: TokenInfoStore.website_of(store.get(symbol)), symbols)
+    column_us = time_lookups(store.website, symbols)
+    started = time.perf_counter()
+    TokenInfoStore(old_path)
+    upgrade_seconds = time.perf_counter() - started
+
+    print('{0} tokens ({1} tickers), pickle {2:.1f} MB, SQLite {3:.1f} MB'.format(
+        n_tokens, len(store), os.path.getsize(pickle_path) / 1e6, os.path.getsize(db_path) / 1e6))
+    print('{0:<15} {1:>10} {2:>12} {3:>14}'.format('', 'load', 'memory', 'website()'))
+    print('{0:<15} {1:>8.0f} ms {2:>9.1f} MB {3:>11.1f} us'.format('dict of dicts', pickle_seconds * 1000, pickle_bytes / 1e6, dict_us))
+    print('{0:<15} {1:>8.0f} ms {2:>9.1f} MB {3:>11.1f} us'.format('store, get()', store_seconds * 1000, store_bytes / 1e6, get_us))
+    print('{0:<15} {1:>8.0f} ms {2:>9.1f} MB {3:>11.1f} us   ({4:.0f} bytes per token)'.format(
+        'store, column', store_seconds * 1000, store_bytes / 1e6, column_us, store_bytes / len(store)))
+    print('first open of a store without website column (one-time upgrade): {0:.0f} ms'.format(upgrade_seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+''' Local fake CoinMarketCap API for benchmarks. Serves the endpoints the bot uses with generated data for "n_tokens" coins,
+    a configurable response latency, and realistic "status" blocks (credit_count, error_code, elapsed).
+    Runs an aiohttp server in a background thread:
+        server = FakeCMCServer(latency=0.05).start()
+        CMCPrices.CMC_API_BASE_URL = server.url
+        ...
+        print(server.calls)  # Counter of requests per endpoint
+        server.stop()
+'''
+import asyncio
+import datetime
+import random
+import string
+import threading
+import time
+from collections import Counter, deque
+from math import ceil
+
+from aiohttp import web
+
+FIATS = [(2781, 'USD', 1.0), (2790, 'EUR', 0.92), (2791, 'GBP', 0.79), (2797, 'JPY', 151.3), (2789, 'DKK', 6.87)]
+
+
+def make_universe(n_tokens: int, seed: int = 1) -> list:
+    '''Generates "n_tokens" map entries. First ones are well known coins, the rest random (some tickers are shared on purpose).'''
+    rnd = random.Random(seed)
+    known = [(1, 'BTC', 'Bitcoin'), (1027, 'ETH', 'Ethereum'), (825, 'USDT', 'Tether'), (1839, 'BNB', 'BNB'), (5426, 'SOL', 'Solana')]
+    tokens = [dict(id=cmc_id, symbol=symbol, name=name, slug=name.lower(), rank=rank + 1, is_active=1)
+              for rank, (cmc_id, symbol, name) in enumerate(known)]
+    cmc_id = 100000
+    while len(tokens) < n_tokens:
+        cmc_id += 1
+        symbol = ''.join(rnd.choices(string.ascii_uppercase, k=rnd.randint(2, 5)))
+        name = symbol.title() + rnd.choice([' Coin', ' Token', ' Finance', ' Protocol', ''])
+        tokens.append(dict(id=cmc_id, symbol=symbol, name=name, slug=name.lower().replace(' ', '-') + '-' + str(cmc_id),
+                           rank=len(tokens) + 1, is_active=1))
+    return tokens
+
+
+class FakeCMCServer(object):
+
+    def __init__(self, n_tokens: int = 10000, latency: float = 0.05, host: str = '127.0.0.1', port: int = 0,
+                 minute_limit: int = 100000, daily_limit: int = 100000, monthly_limit: int = 3000000):
+        self.tokens = make_universe(n_tokens)
+        self.by_id = {token['id']: token for token in self.tokens}
+        self.by_symbol = {}
+        for token in self.tokens:
+            self.by_symbol.setdefault(token['symbol'], token)
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.credits = 0
+        self.limits = {'rate_limit_minute': minute_limit, 'credit_limit_daily': daily_limit, 'credit_limit_monthly': monthly_limit}
+        self._recent_calls = deque()  # Arrival times of calls during the last minute, for key_info
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return 'http://{0}:{1}'.format(self.host, self.port)
+
+    # ----- server lifecycle -----
+    def start(self) -> 'FakeCMCServer':
+        threading.Thread(target=self._run, name='fake-cmc', daemon=True).start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        routes = {
+            '/v1/cryptocurrency/map': self.crypto_map,
+            '/v2/cryptocurrency/info': self.crypto_info,
+            '/v2/cryptocurrency/quotes/latest': self.quotes,
+            '/v1/fiat/map': self.fiat_map,
+            '/v1/key/info': self.key_info,
+            '/v2/tools/price-conversion': self.price_conversion,
+        }
+        for path, handler in routes.items():
+            app.router.add_get(path, self._wrap(path, handler))
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def _wrap(self, path, handler):
+        async def wrapped(request):
+            started = time.monotonic()
+            self.calls[path] += 1
+            self._recent_calls.append(started)
+            if self.latency > 0:
+                await asyncio.sleep(self.latency)
+            data, credits = handler(request.query)
+            self.credits += credits
+            status = {'timestamp': datetime.datetime.utcnow().isoformat() + 'Z', 'error_code': 0, 'error_message': None,
+                      'elapsed': int((time.monotonic() - started) * 1000), 'credit_count': credits, 'notice': None}
+            return web.json_response({'status': status, 'data': data})
+        return wrapped
+
+    # ----- endpoints -----
+    def _lookup(self, query) -> tuple:
+        '''Returns [(response key, token)] for "id" or "symbol" query params.'''
+        if 'id' in query:
+            return [(cmc_id, self.by_id.get(int(cmc_id))) for cmc_id in query['id'].split(',')]
+        return [(symbol.upper(), self.by_symbol.get(symbol.upper())) for symbol in query.get('symbol', '').split(',')]
+
+    def _quote(self, token: dict, currency: str) -> dict:
+        rate = next((rate for _, symbol, rate in FIATS if symbol == currency), 1.0)
+        price = 1000.0 / token['rank'] * rate
+        return {'price': price, 'volume_24h': price * 1e5, 'market_cap': price * 1e7, 'percent_change_1h': 0.1,
+                'percent_change_24h': (token['rank'] % 41) - 20.5, 'percent_change_7d': 1.5,
+                'last_updated': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.000Z')}
+
+    def quotes(self, query) -> tuple:
+        converts = query.get('convert', 'USD').split(',')
+        found = self._lookup(query)
+        data = {str(key): dict(token, quote={currency: self._quote(token, currency) for currency in converts})
+                for key, token in found if token is not None}
+        return data, ceil(len(found) / 100) * len(converts)
+
+    def crypto_info(self, query) -> tuple:
+        found = self._lookup(query)
+        data = {str(key): dict(token, description='x' * 600, logo='https://example.com/{}.png'.format(token['id']),
+                               urls={'website': ['https://{}.example.com'.format(token['slug'])], 'twitter': [], 'chat': []},
+                               tags=['tag-a', 'tag-b'], platform=None)
+                for key, token in found if token is not None}
+        return data, ceil(len(found) / 100)
+
+    def crypto_map(self, query) -> tuple:
+        start, limit = int(query.get('start', 1)), int(query.get('limit', 5000))
+        return self.tokens[start - 1:start - 1 + limit], 1
+
+    def fiat_map(self, query) -> tuple:
+        return [{'id': cmc_id, 'symbol': symbol, 'name': symbol, 'sign': ''} for cmc_id, symbol, _ in FIATS], 1
+
+    def key_info(self, query) -> tuple:
+        '''Real usage of this server (all API keys together): requests during the last minute, credits since start.'''
+        while self._recent_calls and self._recent_calls[0] < time.monotonic() - 60:
+            self._recent_calls.popleft()
+        limits, made = self.limits, len(self._recent_calls)
+        return {'plan': dict(limits),
+                'usage': {'current_minute': {'requests_made': made, 'requests_left': max(0, limits['rate_limit_minute'] - made)},
+                          'current_day': {'credits_used': self.credits, 'credits_left': max(0, limits['credit_limit_daily'] - self.credits)},
+                          'current_month': {'credits_used': self.credits,
+                                            'credits_left': max(0, limits['credit_limit_monthly'] - self.credits)}}}, 0
+
+    def price_conversion(self, query) -> tuple:
+        rates = {symbol: rate for _, symbol, rate in FIATS}
+        converts = query.get('convert', 'USD').split(',')
+        return {'id': 2781, 'symbol': 'USD', 'amount': 1, 'quote': {c: {'price': rates.get(c, 1.0)} for c in converts}}, len(converts)
@@ -0,0 +1,58 @@
+''' Local in-memory stand-in for the boto3 S3 client, covering the calls AWS_S3 makes (put/get object, upload/download file).
+    Behaves like S3 where it matters for sync: quoted MD5 ETags, "304 Not Modified" for a matching IfNoneMatch,
+    "404 NoSuchKey" for missing objects, user metadata. Counts requests and bytes per direction.
+        s3 = FakeS3Client()
+        aws = AWS_S3(s3_client=s3)
+        ...
+        print(s3.requests, s3.bytes_in, s3.bytes_out)
+'''
+import hashlib
+import io
+import threading
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Client(object):
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> (body, etag, metadata)
+        self.requests = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _error(code: str, status: int, operation: str) -> ClientError:
+        return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs) -> dict:
+        body = Body if isinstance(Body, bytes) else Body.read()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        with self._lock:
+            self.requests['PUT'] += 1
+            self.bytes_in += len(body)
+            self.objects[(Bucket, Key)] = (body, etag, dict(Metadata or {}))
+        return {'ETag': etag}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs) -> dict:
+        with self._lock:
+            self.requests['GET'] += 1
+            stored = self.objects.get((Bucket, Key))
+            if stored is None:
+                raise self._error('NoSuchKey', 404, 'GetObject')
+            body, etag, metadata = stored
+            if IfNoneMatch is not None and IfNoneMatch == etag:
+                raise self._error('304', 304, 'GetObject')
+            self.bytes_out += len(body)
+        return {'Body': io.BytesIO(body), 'ETag': etag, 'Metadata': dict(metadata), 'ContentLength': len(body)}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs) -> None:
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket, Key, f.read())
+
+    def download_file(self, Bucket, Key, Filename, **kwargs) -> None:
+        reply = self.get_object(Bucket, Key)
+        with open(Filename, 'wb') as f:
+            f.write(reply['Body'].read())
@@ -0,0 +1,128 @@
+''' Local fake Telegram Bot API for benchmarks. Accepts the methods the bot calls (sendMessage, answerInlineQuery, editMessageText,
+    answerCallbackQuery, sendPhoto, ...) and replies like Telegram does, after a configurable latency. Nothing is delivered anywhere.
+    "flood_limits=True" -> answers like Telegram does when a bot sends too much: 429 "retry after N" for messages over 30 per second
+    in total or over 1 per second to one chat (short bursts of MESSAGE_BURST allowed). Replies and answers to queries are not limited.
+    Runs an aiohttp server in a background thread, same way as FakeCMCServer:
+        server = FakeTelegramServer(latency=0.03).start()
+        bot = telegram.Bot(token, base_url=server.url + '/bot')
+        ...
+        print(server.calls)  # Counter of requests per Bot API method
+        server.stop()
+'''
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from itertools import count
+from math import ceil
+
+from aiohttp import web
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+MESSAGE_METHODS = ('sendMessage', 'editMessageText', 'sendPhoto', 'sendAnimation', 'sendInvoice')  # Count against flood limits
+
+
+class FakeTelegramServer(object):
+    GLOBAL_RATE, GLOBAL_BURST = 30, 30  # messages per second, all chats
+    CHAT_RATE, MESSAGE_BURST = 1, 3  # messages per second, one chat
+
+    def __init__(self, latency: float = 0.03, host: str = '127.0.0.1', port: int = 0, flood_limits: bool = False):
+        self.latency = latency
+        self.flood_limits = flood_limits
+        self._allowance = {}  # chat id (None: all chats) -> (messages allowed now, time) -> token bucket
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self._message_ids = count(1)
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return 'http://{0}:{1}'.format(self.host, self.port)
+
+    # ----- server lifecycle -----
+    def start(self) -> 'FakeTelegramServer':
+        threading.Thread(target=self._run, name='fake-telegram', daemon=True).start()
+        self._ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application(client_max_size=20 * 2 ** 20)  # Photos and GIFs are uploaded once, before MediaCache has their file_id
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:  # multipart upload or form
+            params = {name: value for name, value in (await request.post()).items() if isinstance(value, str)}
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        if self.flood_limits is True and method in MESSAGE_METHODS:
+            retry_after = self._flood_wait(str(params.get('chat_id', '')))
+            if retry_after > 0:
+                self.calls['429'] += 1
+                return web.json_response({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after {}'.format(
+                    retry_after), 'parameters': {'retry_after': retry_after}}, status=429)
+        return web.json_response({'ok': True, 'result': self.reply(method, params)})
+
+    def _flood_wait(self, chat_id: str) -> int:
+        '''0 if a message to "chat_id" may go now (and counts it), otherwise seconds to wait (rounded up, like Telegram).'''
+        now = time.monotonic()
+        limits = ((None, self.GLOBAL_RATE, self.GLOBAL_BURST), (chat_id, self.CHAT_RATE, self.MESSAGE_BURST))
+        allowances = []
+        for key, rate, burst in limits:
+            allowed, updated = self._allowance.get(key, (burst, now))
+            allowed = min(burst, allowed + (now - updated) * rate)
+            if allowed < 1:
+                return ceil((1 - allowed) / rate)
+            allowances.append((key, allowed))
+        for key, allowed in allowances:
+            self._allowance[key] = (allowed - 1, now)
+        return 0
+
+    # ----- methods -----
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = params.get('chat_id', 0)
+        chat_id = int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()), 'from': BOT_USER,
+                   'chat': {'id': chat_id, 'type': 'private'}}
+        message.update(content)
+        return message
+
+    def reply(self, method: str, params: dict):
+        '''"result" of a Bot API call. Methods the bot uses get realistic objects, anything else just True.'''
+        if method == 'getMe':
+            return BOT_USER
+        if method in ('sendMessage', 'editMessageText'):
+            message = self._message(params, text=params.get('text', ''))
+            if 'reply_markup' in params:
+                markup = params['reply_markup']
+                message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+            return message
+        if method == 'sendPhoto':
+            file_id = 'photo-{}'.format(next(self._message_ids))
+            return self._message(params, photo=[{'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320}])
+        if method == 'sendAnimation':
+            file_id = 'animation-{}'.format(next(self._message_ids))
+            return self._message(params, animation={'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320,
+                                                    'duration': 3})
+        return True
@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import concurrent.futures
+
+import aiohttp  # Async HTTP client with connection pooling and keep-alive
+from coinmarketcapapi import APITimer, CoinMarketCapAPIError, Response  # Reusing wrapper's response parsing -> same objects as sync path
+
+import tracing  # Coroutines handed over to the loop keep the caller's trace
+
+
+class CMCTransportError(CoinMarketCapAPIError):
+    '''Raised when CMC could not be reached at all (connection error, timeout). Handled like any other failed CMC request.'''
+
+    def __init__(self, message: str):
+        Exception.__init__(self, message)
+        self.rep = None
+
+
+class _Body(object):
+    '''Minimal stand-in for requests.Response, which is all coinmarketcapapi.Response needs to parse a reply.'''
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class AsyncCMCClient(object):
+    ''' Asyncio CoinMarketCap API client sharing one pooled, keep-alive HTTP connection pool between all API keys and requests.
+        Thousands of lookups can wait on CMC at the same time without a thread each.
+        Endpoint names and API versions mirror methods of 3rd party CoinMarketCapAPI wrapper, and replies are parsed by its Response
+        class -> code consuming the replies works the same for both clients.
+        Must be used from one event loop (see AsyncLoop). HTTP session is created lazily inside that loop.
+    '''
+    BASE_URL = 'https://pro-api.coinmarketcap.com'
+    ENDPOINTS = {
+        'cryptocurrency_map': '/v1/cryptocurrency/map',
+        'cryptocurrency_info': '/v2/cryptocurrency/info',
+        'cryptocurrency_quotes_latest': '/v2/cryptocurrency/quotes/latest',
+        'fiat_map': '/v1/fiat/map',
+        'key_info': '/v1/key/info',
+        'tools_priceconversion': '/v2/tools/price-conversion',
+    }
+
+    def __init__(self, base_url: str = None, pool_size: int = 100, total_timeout: float = 10, connect_timeout: float = 3,
+                 keepalive_timeout: float = 30):
+        self.base_url = (base_url or self.BASE_URL).rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout,
+                                                  headers={'Accepts': 'application/json', 'Accept-Encoding': 'deflate, gzip'})
+        return self._session
+
+    async def request(self, endpoint: str, api_key: str, **params) -> Response:
+        '''Calls CMC "endpoint" (a CoinMarketCapAPI method name) with given API key. Raises CoinMarketCapAPIError on any failure.'''
+        timer = APITimer()
+        url = self.base_url + self.ENDPOINTS[endpoint]
+        query = {name: str(value) for name, value in params.items()}
+        try:
+            async with self._get_session().get(url, params=query, headers={'X-CMC_PRO_API_KEY': api_key}) as http_response:
+                text = await http_response.text()
+                http_status = http_response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise CMCTransportError('{0} {1}: {2!r}'.format(endpoint, type(e).__name__, e))
+        response = Response(_Body(text), timer)
+        response.http_status = http_status  # Lets retry policy tell a proxy's 502 page from a real CMC reply
+        if response.error:
+            raise CoinMarketCapAPIError(response)
+        return response
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncLoop(object):
+    ''' An asyncio event loop running forever in a background daemon thread.
+        Telegram handlers (plain threads) hand coroutines over with submit() and return right away.
+        Example:
+            ASYNC = AsyncLoop()
+            future = ASYNC.submit(some_coroutine())  # concurrent.futures.Future
+            result = ASYNC.run(some_coroutine(), timeout=10)  # blocking, never call it from the loop thread itself
+    '''
+
+    def __init__(self, name: str = 'asyncio-pipeline'):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(tracing.bound(coro), self.loop)
+
+    def run(self, coro, timeout: float = None):
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()  # Caller gave up -> don't leave the coroutine running for nobody
+            raise
+
+    def in_loop_thread(self) -> bool:
+        return threading.current_thread() is self.thread
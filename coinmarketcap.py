@@ -1,20 +1,39 @@
 import os
 import time
-import re
 import datetime
+import asyncio  # Async quote pipeline, see CMCPrices.getCryptoPriceAsync()
+import concurrent.futures  # Timeout of sync callers waiting for the async pipeline
+import threading
+from concurrent.futures import ThreadPoolExecutor  # Loading maps at the same time during warm-up
+from functools import wraps  # Timed scheduler jobs keep their names
 from apscheduler.schedulers.background import BackgroundScheduler  # Scheduling background tasks with defined frequency
 import pickle  # Data structures storing: dicts with crypto info
-from math import ceil  # Rounding up numbers for a print in CMCPRices.getCryptoPrice()
+from collections import Counter, OrderedDict  # Counting how often each token is requested -> what to prefetch
+from math import ceil  # Credits per batch, page counts
 from typing import Union  # Function argument annotations
 
 import emoji  # Converts text like :waving_hand: to its visual representation (real emoji).
-from coinmarketcapapi import CoinMarketCapAPI, CoinMarketCapAPIError  # 3rd party 1:1 wrapper to CoinMarketCap API
+from coinmarketcapapi import CoinMarketCapAPIError  # 3rd party 1:1 wrapper to CoinMarketCap API
 
 from aws_s3 import AWS_S3  # Our custom made Amazon AWS S3 client. Has only two functions: download/upload file.
 from config_class import API_PROFILES
+from symbol_index import CryptoEntry  # One crypto map row
+from map_snapshot import MapSnapshot, diff_maps  # Maps + symbol/autocomplete/fuzzy indexes, swapped in as one immutable object
+from token_store import TokenInfoStore  # SQLite store of token metadata, updated one token at a time
+from metadata_sync import MetadataSync  # Compressed, content-hashed background sync of token metadata with AWS S3
+from quote_cache import QuoteCache  # TTL + LRU cache for price quotes, saves CMC credits on repeated lookups
+from fiat_rates import FiatRates, convert_quote  # Local USD -> fiat conversion of quotes
+from quote_render import QuoteRenderer, round_nonzero  # Templated quote messages, arithmetic number rounding
+from credit_budget import KeyBudget, OutOfCreditsError, SharedKeyBudget  # Live per-key credit accounting (minute/day/month buckets)
+from key_pool import KeyPool  # Any number of CMC API keys, each call routed to the least loaded one
+from cmc_async import AsyncCMCClient, AsyncLoop, CMCTransportError  # Pooled keep-alive asyncio HTTP client + event loop thread
+from retry_policy import CircuitBreaker, RetryPolicy, error_code_of  # Backoff with jitter, deadlines and fail-fast when CMC is down
+from metrics import Metrics  # Prometheus metrics, see CMCPrices.init_metrics()
+from shared_store import StoreError, off_loop  # Shared store of several bot processes is optional and may be down
+import tracing  # Per-phase spans of requests and jobs, slow ones are printed
 
 
-# When testing/running program locally, we don't want to redownload the same crypto_info.pickle from AWS on every run -> we already have file stored locally.
+# When testing/running program locally, we don't want to redownload the same crypto_info.db from AWS on every run -> we already have file stored locally.
 DEBUG_DONT_USE_AWS = True
 
 EMOJIS = {
@@ -32,199 +51,642 @@ EMOJIS = {
 }
 
 
+class QuoteRequest(object):
+    '''State of one getCryptoPrice() call, passed between its local, network and rendering steps.'''
+    __slots__ = ('symbol', 'currency', 'crypto_entry', 'return_status', 'switched_to_default_currency', 'old_currency',
+                 'project_url', 'fiat_rate', 'cache_key', 'quote_params', 'data_key')
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.currency = 'USD'
+        self.crypto_entry = None
+        self.return_status = ''  # will be appended with status messages that can occur during the request.
+        self.switched_to_default_currency = False
+        self.old_currency = None
+        self.project_url = ''
+        self.fiat_rate = None
+        self.cache_key = None
+        self.quote_params = None
+        self.data_key = None
+
+
 class CMCPrices(object):
     ''' A custom class that communicates with CoinmarketCap API through another python wrapper "CoinMarketCapAPI", which is 1:1 wrapper for CMC API.
         Uses another custom class AWS_S3 to download/upload data to Amazon cloud storage.
         '''
 
-    COINMARKETCAP_API_KEY = API_PROFILES['COINMARKETCAP_API_KEY']
-    COINMARKETCAP_API_KEY_2 = API_PROFILES['COINMARKETCAP_API_KEY_2']
-    if COINMARKETCAP_API_KEY_2 == 'None':  # HACK
-        COINMARKETCAP_API_KEY_2 = None
+    # Local credit accounting, per API key. Keys are all COINMARKETCAP_API_KEY* entries in config.ini. Limits below are CMC Basic (free) plan, used until the first reconciliation with key_info.
+    CMC_MINUTE_LIMIT = 30  # requests per minute
+    CMC_DAILY_LIMIT = 333  # credits per UTC day
+    CMC_MONTHLY_LIMIT = 10000  # credits per UTC month
+    CREDIT_RESERVE = 0.01  # Share of daily/monthly credits never spent. Same as old 0.99 thresholds.
+    CREDIT_QUEUE_MAX_WAIT = 5  # seconds. How long a call may wait for per minute limit to refill before it is refused.
+    CREDIT_RECONCILE_MINUTES = 60  # How often local numbers are overwritten with the real ones from key_info.
 
-    # These vars are used to handle credit counting and account switching when active CMC API has ran out of credits.
-    ALL_API_KEYS = [COINMARKETCAP_API_KEY, COINMARKETCAP_API_KEY_2]
-    ACTIVE_API_KEY = COINMARKETCAP_API_KEY
-    OUT_OF_ALL_CREDITS = False
+    # Async HTTP pipeline. Every CMC call goes through it. One pooled keep-alive connection pool shared by all requests and API keys.
+    CMC_API_BASE_URL = AsyncCMCClient.BASE_URL
+    CMC_HTTP_POOL_SIZE = 100  # Max simultaneous connections to CMC.
+    CMC_HTTP_TIMEOUT = 10  # seconds. Whole request.
+    CMC_HTTP_CONNECT_TIMEOUT = 3  # seconds. Establishing a connection.
 
-    RETRY_REQUEST_SLEEP = 3  # seconds. If first request fails for any reason, how long to sleep before attempting second try?
+    # Retries of failed CMC calls. Only errors that can succeed on a second try are retried, see RetryPolicy.
+    RETRY_MAX_ATTEMPTS = 3  # Attempts per call, first one included.
+    RETRY_BASE_DELAY = 0.25  # seconds. Backoff before retry n is random between 0 and BASE_DELAY * 2^n ...
+    RETRY_MAX_DELAY = 4  # seconds. ... but never longer than this.
+    RETRY_DEADLINE = 12  # seconds. Whole call including retries and waiting for the per minute limit.
+    CIRCUIT_FAILURE_THRESHOLD = 5  # Failures in a row (CMC unreachable / 5xx) after which calls fail right away ...
+    CIRCUIT_RESET_SECONDS = 30  # ... for this long. Then one probe call decides whether CMC is back.
 
     DIR_PATH = os.path.dirname(os.path.abspath(__file__))
 
     # Names for .pickle files to store data in
-    CRYPTO_SYMBOLS_PICKLE_NAME = 'crypto_symbols.pickle'
-    CRYPTO_SLUG_PICKLE_NAME = 'crypto_slugs.pickle'
+    CRYPTO_MAP_PICKLE_NAME = 'crypto_map.pickle'
     FIAT_SYMBOLS_PICKLE_NAME = 'fiat_symbols.pickle'
-    CRYPTO_INFO_PICKLE_NAME = 'crypto_info.pickle'
+    CRYPTO_INFO_PICKLE_NAME = 'crypto_info.pickle'  # Old token metadata storage. Imported once into CRYPTO_INFO_DB_NAME.
     CRYPTO_INFO_PICKLE_PATH = os.path.join(DIR_PATH, CRYPTO_INFO_PICKLE_NAME)
+    CRYPTO_INFO_DB_NAME = 'crypto_info.db'  # SQLite token metadata store, see TokenInfoStore
+    CRYPTO_INFO_DB_PATH = os.path.join(DIR_PATH, CRYPTO_INFO_DB_NAME)
+    CRYPTO_INFO_S3_NAME = 'crypto_info.db.gz'  # Compressed snapshot of the store in AWS S3
 
-    TELEGRAM_MSG_CHAR_LIMIT = 4050  # Used to divide long message in PrintSupportedCryptos() into chunks.
+    TELEGRAM_MSG_CHAR_LIMIT = 4050  # Longest message text Telegram accepts is 4096 chars.
 
-    REUPLOAD_DIFFERENCE = 10  # How many new crypto info keys must be added into self.CRYPTO_INFO dict during this session to trigger amazon upload.
+    CRYPTO_MAP_PAGE_SIZE = 5000  # Tokens per cryptocurrency/map request (1 credit each). 5000 is the most CMC returns.
+    CRYPTO_MAP_PARALLEL_PAGES = 3  # Map pages requested at the same time, if the per minute limit leaves room for them.
+    CRYPTO_LIST_PAGE_SIZE = 50  # Tokens per page of /crypto list.
+
+    REUPLOAD_DIFFERENCE = 10  # How many new tokens must be added into self.CRYPTO_INFO store since last sync to trigger amazon upload.
 
     CMC_URL = 'https://coinmarketcap.com/currencies/'
 
-    def __init__(self):
-        self.CMC = CoinMarketCapAPI(self.ACTIVE_API_KEY)  # from coinmarketcapapi import CoinMarketCapAPI
+    # Quote cache settings. CMC updates quotes about every 60 seconds, so anything fresher than that is as good as a new request.
+    QUOTE_CACHE_TTL = 60  # seconds. Quote is served from memory without any refresh.
+    QUOTE_CACHE_STALE_TTL = 240  # seconds after TTL. Quote is served from memory and refreshed in background.
+    QUOTE_CACHE_MAX_SIZE = 5000  # (token, currency) pairs kept in memory. Least recently used are dropped first.
+
+    # Background prefetch of USD quotes for the most requested / highest ranked tokens. CMC charges 1 credit per 100 ids in a batch.
+    PREFETCH_TOP_N = 200  # How many tokens to keep warm in the quote cache.
+    PREFETCH_BATCH_SIZE = 100  # Ids per quotes request. 100 is the most that still costs 1 credit.
+    PREFETCH_INTERVAL_MINUTES = 1  # Shortest time between prefetch runs. Lengthened so a day of runs fits PREFETCH_DAILY_CREDITS.
+    PREFETCH_DAILY_CREDITS = 100  # Max credits per (UTC) day the prefetch may spend. Leaves the rest of the daily limit for users.
+
+    AUTOCOMPLETE_MAX_RESULTS = 10  # Most candidates autocomplete() returns. Telegram shows at most 50 inline results.
+    SUGGESTIONS_MAX = 3  # "Did you mean" suggestions for a token that was not found.
+
+    # Background warm-up of token metadata (project page links). Quotes never wait for it: they render without the link until it's there.
+    METADATA_WARM_UP_MINUTES = 5  # How often warm-up job runs.
+    METADATA_BATCH_SIZE = 100  # Ids per cryptocurrency/info request. 100 is the most that still costs 1 credit.
+    METADATA_BATCHES_PER_RUN = 2  # Requests per run.
+    METADATA_DAILY_CREDITS = 30  # Max credits per (UTC) day the warm-up may spend.
+    METADATA_WANTED_MAX = 1000  # Requested tokens without metadata remembered for the next run. Oldest are forgotten first.
+
+    # Non-USD quotes are derived locally from USD quote and a USD -> fiat rate table, instead of asking CMC per currency.
+    USD_CMC_ID = 2781  # CMC id of US Dollar in fiat map. Used as a base for price conversion requests.
+    FIAT_RATES_MAX_AGE_MINUTES = 60  # Older rates are never used. Quote is then requested from CMC in that currency directly.
+    FIAT_RATES_REFRESH_MINUTES = 30  # How often background job refreshes rates of currencies users asked for.
+    FIAT_RATES_ACTIVE_HOURS = 24  # Currency not requested for this long is no longer refreshed in background.
+    FIAT_RATES_CONVERT_PER_CALL = 1  # Currencies per price-conversion request. Basic (free) CMC plan allows only 1, paid plans more.
+
+    # Several bot processes (see main.py BOT_WORKERS) share quotes, maps, fiat rates and credit counters through a SharedStore.
+    SHARED_MAP_TTL = 24 * 3600  # seconds. Same as pickle expiration of maps.
+    SHARED_WANTED_KEY = 'metadata_wanted'  # Store list of tokens without metadata, filled by all processes, read by the one running jobs
+
+    # Maps are refreshed in background while the bot runs (pickle files expire after 24 hours, listings change every day).
+    MAPS_REFRESH_HOURS = 6  # How often the job running process re-fetches crypto and fiat maps (3-4 credits each time).
+    MAPS_MIN_KEPT_SHARE = 0.5  # New crypto map shorter than this share of the current one is taken for a broken reply and ignored.
+    MAPS_FOLLOW_MINUTES = 10  # How often other processes look for a map refreshed by the job running one (shared store only).
+    SHARED_MAPS_VERSION_KEY = 'maps_version'  # Build time of the maps last put into the store by a refresh
+
+    SLOW_JOB_SECONDS = 30  # Background job running longer than this prints its span breakdown (CMC calls, retries, waits).
+
+    def __init__(self, warm_up_in_background: bool = False, store=None, run_jobs: bool = True):
+        ''' "warm_up_in_background=True" returns right away without loading anything big, see warm_up().
+            Used by the bot so it can take updates while maps are still loading.
+            "store" (shared_store.SharedStore) -> quotes, maps, fiat rates and credit counters are shared with other bot processes.
+            "run_jobs=False" -> no background jobs (prefetch, metadata warm-up, credit reconciliation ...). With several processes
+            exactly one runs them.
+        '''
+        self.STORE = store
+        self.RUN_JOBS = run_jobs
+        # One credit budget per API key. Calls themselves go through ASYNC_CMC, which is shared by all keys.
+        def make_budget(name: str) -> KeyBudget:
+            limits = self.CMC_MINUTE_LIMIT, self.CMC_DAILY_LIMIT, self.CMC_MONTHLY_LIMIT
+            if store is not None:  # Counters in the store -> all processes together stay within the limits
+                return SharedKeyBudget(store, name, *limits, reserve=self.CREDIT_RESERVE)
+            return KeyBudget(*limits, reserve=self.CREDIT_RESERVE)
+        self.KEY_POOL = KeyPool.from_config(API_PROFILES, make_budget)
+        print('Loaded {} CoinMarketCap API key(s).'.format(len(self.KEY_POOL)))
 
         self.AWS = AWS_S3()
 
-        # Attempt to load crypto/fiat symbols from pre-saved pickle files. If those do not exist or too old -> request new data
-        self.CRYPTO_MAP = self.load_symbols_from_pickle(self.CRYPTO_SYMBOLS_PICKLE_NAME)
-        self.SLUG_MAP = self.load_symbols_from_pickle(self.CRYPTO_SLUG_PICKLE_NAME)
-        if self.CRYPTO_MAP is None or self.SLUG_MAP is None:
-            self.CRYPTO_MAP, self.SLUG_MAP = self.get_crypto_symbols_and_slugs(save_pickle=True)  # Pull once a list of supported crypto tokens on CoinmarketCap
-        self.FIAT_MAP = self.load_symbols_from_pickle(self.FIAT_SYMBOLS_PICKLE_NAME)
-        if self.FIAT_MAP is None:
-            self.FIAT_MAP = self.get_fiat_map(save_pickle=True)  # Pull once a list of supported fiat currencies on CoinmarketCap
+        self.ASYNC = AsyncLoop()
+        self.ASYNC_CMC = AsyncCMCClient(self.CMC_API_BASE_URL, pool_size=self.CMC_HTTP_POOL_SIZE,
+                                        total_timeout=self.CMC_HTTP_TIMEOUT, connect_timeout=self.CMC_HTTP_CONNECT_TIMEOUT)
+        self.RETRY = RetryPolicy(self.RETRY_MAX_ATTEMPTS, self.RETRY_BASE_DELAY, self.RETRY_MAX_DELAY, self.RETRY_DEADLINE,
+                                 breaker=CircuitBreaker(self.CIRCUIT_FAILURE_THRESHOLD, self.CIRCUIT_RESET_SECONDS))
+        # Identical concurrent CMC calls share one in-flight task. Only touched from ASYNC loop thread -> no lock needed.
+        self.ASYNC_FLIGHTS = {}
+        self.QUOTE_CACHE = QuoteCache(ttl=self.QUOTE_CACHE_TTL, stale_ttl=self.QUOTE_CACHE_STALE_TTL, max_size=self.QUOTE_CACHE_MAX_SIZE,
+                                      shared=store)
+        self.FIAT_RATES = FiatRates(self.get_fiat_rates, max_age=self.FIAT_RATES_MAX_AGE_MINUTES * 60, shared=store)
+        self.RENDERER = QuoteRenderer(self.CMC_URL, EMOJIS)
 
-        try:
-            if DEBUG_DONT_USE_AWS is False:
-                self.AWS.download_file(self.CRYPTO_INFO_PICKLE_NAME, self.CRYPTO_INFO_PICKLE_PATH)
-                print('Downloading "{}" from AWS. Time sleep for 5 seconds.'.format(self.CRYPTO_INFO_PICKLE_NAME))
-                time.sleep(5)
-            self.CRYPTO_INFO = self.load_symbols_from_pickle(self.CRYPTO_INFO_PICKLE_NAME, expiration_hours=None)  # Once per two weeks
-        except Exception as e:
-            print(f'Failed to either download from AWS or load file frm pickle.{e}')
-            self.CRYPTO_INFO = None
+        # Replaced by warm_up() and maps_refresh(), never modified in place. Read it once per request: maps = self.MAPS.
+        # Until warm-up has loaded the maps it has none -> getCryptoPrice() does blind queries by symbol (degraded path).
+        self.MAPS = MapSnapshot(autocomplete_limit=self.AUTOCOMPLETE_MAX_RESULTS)
+        self.MAPS_VERSION = None  # SHARED_MAPS_VERSION_KEY value the current maps came with
+        self._maps_lock = threading.Lock()  # One refresh at a time. Readers never take it.
+        self.READY = threading.Event()  # Set once warm_up() finished
+        self.WARM_UP_SECONDS = None
+
+        # Token popularity for prefetch. Counter increments from run_async threads may rarely get lost -> fine for a popularity estimate.
+        self.REQUEST_COUNTS = Counter()
+        self.PREVIOUS_REQUEST_COUNTS = Counter()
+        self.PREFETCH_CREDITS_USED = 0
+        self.PREFETCH_BUDGET_REACHED = False  # Logged once a day, not on every run
+        self.METADATA_CREDITS_USED = 0
+        self.CREDITS_DAY = datetime.datetime.utcnow().date()
+        self.METADATA_WANTED = OrderedDict()  # Symbols users asked for that had no metadata yet. Most recent last.
+        self._metadata_lock = threading.Lock()
 
-        if self.CRYPTO_INFO is not None:
-            self.NUMBER_OF_SAVED_CRYPTO_INFO = len(self.CRYPTO_INFO)
-            print('Number of crypto infos loaded into {0} = {1}'.format(self.CRYPTO_INFO_PICKLE_NAME, self.NUMBER_OF_SAVED_CRYPTO_INFO))
+        self.CRYPTO_INFO = TokenInfoStore(self.CRYPTO_INFO_DB_PATH)  # Opening reads nothing up front
+        # S3 copy is merged in by a background job right after start -> no blocking download here.
+        self.METADATA_SYNC = MetadataSync(self.AWS, self.CRYPTO_INFO, self.CRYPTO_INFO_S3_NAME, min_new_tokens=self.REUPLOAD_DIFFERENCE,
+                                          legacy_filename=self.CRYPTO_INFO_PICKLE_NAME, legacy_path=self.CRYPTO_INFO_PICKLE_PATH)
 
-        scheduler = BackgroundScheduler(timezone="Europe/Berlin")
-        scheduler.add_job(self.api_key_scheduled_check, 'cron', minute='*/10')
-        scheduler.add_job(self.aws_crypto_info_check, 'cron', minute='0-59')
+        self.METRICS = Metrics()
+        self.init_metrics()
+
+        self.SCHEDULER = scheduler = BackgroundScheduler(timezone="Europe/Berlin")
+        if run_jobs is True:
+            # First reconciliation right away -> a restart doesn't forget what was already spent today.
+            scheduler.add_job(self.timed_job(self.api_key_scheduled_check))
+            scheduler.add_job(self.timed_job(self.api_key_scheduled_check), 'interval', minutes=self.CREDIT_RECONCILE_MINUTES)
+            if DEBUG_DONT_USE_AWS is False:
+                scheduler.add_job(self.timed_job(self.aws_crypto_info_pull))
+                scheduler.add_job(self.timed_job(self.aws_crypto_info_check), 'cron', minute='0-59')
+            scheduler.add_job(self.timed_job(self.quote_prefetch), 'interval', minutes=self.prefetch_interval_minutes())
+            scheduler.add_job(self.timed_job(self.fiat_rates_refresh), 'cron', minute='*/{}'.format(self.FIAT_RATES_REFRESH_MINUTES))
+            scheduler.add_job(self.timed_job(self.metadata_warm_up), 'interval', minutes=self.METADATA_WARM_UP_MINUTES)
+            scheduler.add_job(self.timed_job(self.maps_refresh), 'interval', hours=self.MAPS_REFRESH_HOURS)
+        elif store is not None:
+            scheduler.add_job(self.timed_job(self.maps_follow), 'interval', minutes=self.MAPS_FOLLOW_MINUTES)
         scheduler.start()
 
+        if warm_up_in_background is True:
+            threading.Thread(target=self.warm_up, name='cmc-warm-up', daemon=True).start()
+        else:
+            self.warm_up()
+
+    def init_metrics(self) -> None:
+        ''' Metrics of CMC calls, credits, caches and scheduled jobs (see metrics.Metrics). Served by main.py next to the webhook port.
+            Calls and job runs are counted as they happen. Credits, cache counters etc. are read from existing state only when scraped.
+        '''
+        metrics = self.METRICS
+        self.CMC_CALLS = metrics.counter('cmc_calls_total', 'CoinMarketCap API calls by endpoint, API key and result (ok, CMC error code '
+                                         'or transport)', ('endpoint', 'key', 'result'))
+        self.CMC_CALL_SECONDS = metrics.histogram('cmc_call_seconds', 'Duration of one CoinMarketCap API call attempt', ('endpoint',))
+        self.CMC_CALLS_REFUSED = metrics.counter('cmc_calls_refused_total', 'Calls refused locally, no API key had credits for them',
+                                                 ('endpoint',))
+        self.CMC_CREDITS_USED = metrics.counter('cmc_credits_used_total', 'Credits charged by CoinMarketCap', ('key',))
+        metrics.gauge('cmc_credits_remaining', 'Requests (minute) and credits (day, month) an API key has left, by local accounting',
+                      lambda: {(key['name'], window): key[window] for key in self.KEY_POOL.stats() for window in ('minute', 'day', 'month')},
+                      ('key', 'window'))
+        metrics.gauge('cmc_key_quarantined', '1 if API key is quarantined after a key/limit error',
+                      lambda: {(key['name'],): int(key['quarantined']) for key in self.KEY_POOL.stats()}, ('key',))
+        metrics.counter_callback('cmc_retries_total', 'CMC call attempts that were retries', lambda: self.RETRY.retries)
+        metrics.counter_callback('cmc_gave_up_total', 'CMC calls that failed after all retries', lambda: self.RETRY.gave_up)
+        metrics.gauge('cmc_circuit_state', '1 for the current state of the CMC circuit breaker',
+                      lambda: {(state,): int(self.RETRY.breaker.state == state) for state in ('closed', 'half-open', 'open')}, ('state',))
+        metrics.gauge('cmc_requests_in_flight', 'Distinct CMC requests waiting for a reply', lambda: len(self.ASYNC_FLIGHTS))
+        metrics.counter_callback('quote_cache_requests_total', 'Quote cache lookups by result',
+                                 lambda: {(result,): self.QUOTE_CACHE.stats()[field] for result, field in
+                                         (('hit', 'hits'), ('stale_hit', 'stale_hits'), ('miss', 'misses'))},
+                                 ('result',))
+        metrics.gauge('quote_cache_hit_ratio', 'Share of quote lookups served from memory', lambda: self.QUOTE_CACHE.stats()['hit_ratio'])
+        metrics.gauge('quote_cache_size', 'Quotes in memory', lambda: len(self.QUOTE_CACHE))
+        metrics.counter_callback('quote_cache_evictions_total', 'Quotes dropped as least recently used', lambda: self.QUOTE_CACHE.evictions)
+        metrics.gauge('fiat_rates_cached', 'USD -> fiat rates in memory', lambda: len(self.FIAT_RATES))
+        metrics.gauge('crypto_map_tokens', 'Tokens in the loaded crypto map', lambda: len(self.MAPS))
+        metrics.gauge('maps_age_seconds', 'Time since the loaded maps were built', lambda: time.time() - self.MAPS.built_at)
+        metrics.gauge('token_infos_stored', 'Tokens with metadata in the local store', lambda: len(self.CRYPTO_INFO))
+        metrics.gauge('metadata_wanted', 'Requested tokens waiting for metadata warm-up', lambda: len(self.METADATA_WANTED))
+        self.JOB_SECONDS = metrics.histogram('scheduler_job_seconds', 'Duration of background scheduler jobs', ('job',))
+        self.JOB_FAILURES = metrics.counter('scheduler_job_failures_total', 'Background jobs that raised an exception', ('job',))
+
+    def timed_job(self, job):
+        '''Wraps a scheduled job so its duration and failures show up in metrics. Exceptions are re-raised -> APScheduler logs them as before.'''
+        name = job.__name__
+
+        @wraps(job)
+        def timed(*args, **kwargs):
+            trace = tracing.Trace('job', name)
+            try:
+                with tracing.active(trace):
+                    return job(*args, **kwargs)
+            except Exception:
+                self.JOB_FAILURES.inc(name)
+                raise
+            finally:
+                self.JOB_SECONDS.observe(trace.finish(self.SLOW_JOB_SECONDS), name)
+        return timed
+
+    def warm_up(self) -> None:
+        ''' Loads crypto/fiat maps (from pickle files, or from CMC if those do not exist or are too old) and builds lookup tables.
+            Both maps load at the same time. Quotes requested before it finishes are served by blind queries by symbol.
+        '''
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='cmc-warm-up') as executor:
+            crypto_entries = executor.submit(self.load_crypto_map)
+            fiat_map = executor.submit(self.load_fiat_map)
+            executor.submit(self.CRYPTO_INFO.migrate_pickle, self.CRYPTO_INFO_PICKLE_PATH)  # One-shot, does nothing once imported
+        # Built once here and reused on every request. Missing maps are kept as None inside -> getCryptoPrice() does blind queries.
+        maps = self.MAPS = self.build_maps(crypto_entries.result(), fiat_map.result())
+        self.WARM_UP_SECONDS = time.monotonic() - started
+        self.READY.set()
+        if self.RUN_JOBS is True:
+            self.SCHEDULER.add_job(self.timed_job(self.metadata_warm_up))  # First run right away, it needs the map
+        print('Warm-up done in {0:.2f} s: {1} crypto tokens, {2} fiat currencies, {3} crypto infos.'.format(
+            self.WARM_UP_SECONDS, len(maps), len(maps.fiat_map or ()), len(self.CRYPTO_INFO)))
+
+    def build_maps(self, crypto_entries: list, fiat_map: list, previous: MapSnapshot = None) -> MapSnapshot:
+        '''New MapSnapshot of given maps (None -> map not available). Takes a second or two for a full crypto map.'''
+        return MapSnapshot(crypto_entries, fiat_map, self.build_crypto_pages, autocomplete_limit=self.AUTOCOMPLETE_MAX_RESULTS,
+                           top_n=self.PREFETCH_TOP_N, previous=previous)
+
+    def maps_refresh(self) -> None:
+        ''' Re-fetches crypto and fiat maps from CMC, compares them with the loaded ones and, if anything changed, swaps in a new
+            MapSnapshot. Requests running meanwhile finish on the old one. A map that fails to load, or comes back much shorter
+            than the current one (MAPS_MIN_KEPT_SHARE), is kept as it is. Used as background scheduled task (3-4 credits per run).
+            With a shared store the new maps are put there too, other processes pick them up in maps_follow().
+        '''
+        if self.OUT_OF_ALL_CREDITS is True or not self.READY.is_set():
+            return
+        with self._maps_lock:
+            current = self.MAPS
+            crypto_entries = self.kept_crypto_map(self.get_crypto_map(), current.crypto_entries)
+            fiat_map = self.get_fiat_map()
+            changed = self.swap_maps(current, crypto_entries, fiat_map)
+            # Saved only once accepted -> a restart never loads a map the check above turned down
+            if crypto_entries is not None:
+                self.save_map_pickle(self.CRYPTO_MAP_PICKLE_NAME, crypto_entries)
+            if fiat_map is not None:
+                self.save_map_pickle(self.FIAT_SYMBOLS_PICKLE_NAME, fiat_map)
+            if changed is True and self.STORE is not None:
+                maps = self.MAPS
+                try:  # Same keys warm-up fills -> a process starting later loads the new maps too
+                    if maps.crypto_entries is not None:
+                        self.STORE.set_obj('crypto_map', list(maps.crypto_entries), ttl=self.SHARED_MAP_TTL)
+                    if maps.fiat_map is not None:
+                        self.STORE.set_obj('fiat_map', list(maps.fiat_map), ttl=self.SHARED_MAP_TTL)
+                    self.MAPS_VERSION = str(maps.built_at).encode('utf-8')
+                    self.STORE.set(self.SHARED_MAPS_VERSION_KEY, self.MAPS_VERSION)
+                except StoreError as e:
+                    print(e)
+
+    def maps_follow(self) -> None:
+        '''Takes maps refreshed by the process running jobs from the shared store, when they are newer than the loaded ones.'''
+        if not self.READY.is_set():
+            return
+        try:
+            version = self.STORE.get(self.SHARED_MAPS_VERSION_KEY)
+            if version is None or version == self.MAPS_VERSION:
+                return
+            crypto_entries, fiat_map = self.STORE.get_obj('crypto_map'), self.STORE.get_obj('fiat_map')
+        except StoreError as e:
+            print(e)
+            return
+        with self._maps_lock:
+            self.swap_maps(self.MAPS, crypto_entries, fiat_map)
+            self.MAPS_VERSION = version
+
+    def swap_maps(self, current: MapSnapshot, crypto_entries: list, fiat_map: list) -> bool:
+        ''' Replaces "current" snapshot with one of the given maps. A map given as None stays as it is in "current".
+            Builds nothing if neither map changed. Returns True if the maps were swapped.
+        '''
+        if crypto_entries is None or (current.crypto_entries is not None and tuple(crypto_entries) == current.crypto_entries):
+            crypto_entries = current.crypto_entries  # Same object -> its indexes are reused
+        if fiat_map is None or (current.fiat_map is not None and tuple(fiat_map) == current.fiat_map):
+            fiat_map = current.fiat_map
+        if crypto_entries is current.crypto_entries and fiat_map is current.fiat_map:
+            print('Maps refresh: no changes.')
+            return False
+        diff = diff_maps(current.crypto_entries, crypto_entries, current.fiat_map, fiat_map)
+        started = time.monotonic()
+        self.MAPS = self.build_maps(crypto_entries, fiat_map, previous=current)
+        print('Maps refresh: {0} new, {1} delisted, {2} changed tokens, fiats +{3} -{4}. Swapped in {5:.2f} s. New: {6}'.format(
+            len(diff.added), len(diff.removed), len(diff.changed), diff.fiats_added, diff.fiats_removed, time.monotonic() - started,
+            ', '.join(entry.symbol for entry in diff.added[:20])))
+        return True
+
+    def load_crypto_map(self) -> list or None:
+        ''' Crypto map from pre-saved pickle file. If it does not exist or is too old -> requests a new one from CMC.
+            With a shared store, processes starting together request it once: the others take it from the store.
+        '''
+        crypto_entries = self.load_symbols_from_pickle(self.CRYPTO_MAP_PICKLE_NAME)
+        if crypto_entries is None:
+            # Pull once a list of supported crypto tokens on CoinmarketCap. Checked before it is shared or saved.
+            crypto_entries = self._fill_shared('crypto_map', self._fetch_kept_crypto_map)
+            if crypto_entries is not None:
+                self.save_map_pickle(self.CRYPTO_MAP_PICKLE_NAME, crypto_entries)
+        return crypto_entries
+
+    def _fetch_kept_crypto_map(self) -> list or None:
+        '''Crypto map from CMC. None if the request failed or the map is much shorter than the last saved one, even if expired.'''
+        crypto_entries = self.get_crypto_map()
+        if crypto_entries is None:
+            return None
+        return self.kept_crypto_map(crypto_entries, self.load_symbols_from_pickle(self.CRYPTO_MAP_PICKLE_NAME, expiration_hours=None))
+
+    def kept_crypto_map(self, crypto_entries: list, loaded: list) -> list or None:
+        '''"crypto_entries", or None if they are fewer than MAPS_MIN_KEPT_SHARE of "loaded" tokens (taken for a broken reply).'''
+        if crypto_entries is not None and loaded is not None and len(crypto_entries) < len(loaded) * self.MAPS_MIN_KEPT_SHARE:
+            print('Maps refresh: new crypto map has {0} tokens, loaded one {1}. Keeping the loaded one.'.format(
+                len(crypto_entries), len(loaded)))
+            return None
+        return crypto_entries
+
+    def load_fiat_map(self) -> list or None:
+        '''Fiat map from pre-saved pickle file. If it does not exist or is too old -> requests a new one from CMC (or takes it from shared store).'''
+        fiat_map = self.load_symbols_from_pickle(self.FIAT_SYMBOLS_PICKLE_NAME)
+        if fiat_map is None:
+            # Pull once a list of supported fiat currencies on CoinmarketCap
+            fiat_map = self._fill_shared('fiat_map', self.get_fiat_map)
+            if fiat_map is not None:
+                self.save_map_pickle(self.FIAT_SYMBOLS_PICKLE_NAME, fiat_map)
+        return fiat_map
+
+    def _fill_shared(self, name: str, fetch):
+        '''Result of "fetch()" shared by all bot processes for SHARED_MAP_TTL, see SharedStore.get_or_fill(). Just fetch() without a store.'''
+        if self.STORE is None:
+            return fetch()
+        return self.STORE.get_or_fill(name, fetch, ttl=self.SHARED_MAP_TTL, lock_ttl=self.RETRY_DEADLINE * 3)
+
+    @property
+    def OUT_OF_ALL_CREDITS(self) -> bool:
+        '''True when no API key can serve a call (out of credits or quarantined). Computed live, not from a periodic snapshot.'''
+        return self.KEY_POOL.exhausted()
+
     def getCryptoPrice(self, symbol: str, currency: str = 'USD'):
         ''' Main function to get a price quote on a crypto token.
-            Checks whether crypto symbol exists in a list stored in CRYPTO_MAP (thats initialized in class __init__() function.
+            Checks whether crypto symbol exists in the crypto map (MAPS, loaded by warm_up() and refreshed by maps_refresh()).
             If symbol exists, it will look it up. If not -> will return a message saying "Token not found".
             Does the same process above for specified fiat currencies. Uses "USD" by default. Case insensitive.
             Example call: getCryptoPrice('btc', 'EUR')
             Returns a nice print message formated for a telegram chat window (using Markdown syntax).
         '''
+        with tracing.span('plan'):
+            request, early_reply = self._plan_quote_request(symbol, currency)
+            if request is None:
+                return early_reply
+            request.project_url = self.get_project_url(request.symbol)
+        with tracing.span('fiat rate'):
+            request.fiat_rate = self.FIAT_RATES.rate(request.currency) if request.currency != 'USD' else None
+        self._set_quote_source(request)
+        with tracing.span('quote'):
+            tmp_crypto_data, error = self.QUOTE_CACHE.get(request.cache_key, lambda: self._load_quote(request))
+        with tracing.span('render'):
+            return self._finish_quote_request(request, tmp_crypto_data, error)
+
+    async def getCryptoPriceAsync(self, symbol: str, currency: str = 'USD'):
+        ''' Same as getCryptoPrice(), for the asyncio pipeline: CMC requests go through pooled AsyncCMCClient and never block a thread.
+            Must be awaited inside self.ASYNC loop, e.g. CP.ASYNC.submit(CP.getCryptoPriceAsync('btc', 'EUR')).
+        '''
+        with tracing.span('plan'):
+            request, early_reply = self._plan_quote_request(symbol, currency)
+            if request is None:
+                return early_reply
+            request.project_url = self.get_project_url(request.symbol)
+        if request.currency != 'USD':
+            request.fiat_rate = self.FIAT_RATES.cached_rate(request.currency)
+            if request.fiat_rate is None:
+                with tracing.span('fiat rate'):
+                    request.fiat_rate = await asyncio.get_running_loop().run_in_executor(None, self.FIAT_RATES.rate, request.currency)
+        self._set_quote_source(request)
+        with tracing.span('quote'):
+            tmp_crypto_data, error = await self.QUOTE_CACHE.get_async(request.cache_key, lambda: self._load_quote_async(request))
+        with tracing.span('render'):
+            return self._finish_quote_request(request, tmp_crypto_data, error)
+
+    def autocomplete(self, text: str, limit: int = None) -> list:
+        ''' Best ranked tokens (CryptoEntry) whose symbol or name starts with "text". If none does, tokens "text" is a typo of.
+            Answered from memory, never calls CMC. Empty list until the crypto map is loaded.
+        '''
+        maps = self.MAPS
+        candidates = maps.prefix_index.complete(text, limit)
+        if len(candidates) == 0:
+            candidates = [entry for entry, _ in maps.fuzzy_index.search(text, limit or self.AUTOCOMPLETE_MAX_RESULTS)]
+        return candidates
+
+    def getCryptoPrices(self, crypto_entries: list, currency: str = 'USD') -> list:
+        '''Sync version of getCryptoPricesAsync(), for plain threads.'''
+        try:
+            return self.ASYNC.run(self.getCryptoPricesAsync(crypto_entries, currency), timeout=self.RETRY_DEADLINE + 1)
+        except concurrent.futures.TimeoutError:
+            return [(None, 'No reply from CoinMarketCap, try again.')] * len(crypto_entries)
+
+    async def getCryptoPricesAsync(self, crypto_entries: list, currency: str = 'USD') -> list:
+        ''' Price messages of several tokens at once, e.g. the top autocomplete candidates of an inline query.
+            Quotes that are not fresh in QUOTE_CACHE are fetched together in one request by CMC id (1 credit per 100 tokens)
+            and cached, so every following keystroke showing the same tokens is answered from memory.
+            Returns [(message, status)] in the order of "crypto_entries", same values as getCryptoPrice().
+        '''
+        requests, replies = [], []
+        with tracing.span('plan'):
+            for entry in crypto_entries:
+                request, early_reply = self._plan_quote_request(entry.symbol, currency)
+                if request is not None:
+                    request.crypto_entry = entry  # The candidate itself, even if a better ranked token has the same ticker
+                requests.append(request)
+                replies.append(early_reply)
+        planned = [request for request in requests if request is not None]
+        if len(planned) == 0:
+            return replies
+
+        fiat_rate = None
+        if planned[0].currency != 'USD':
+            fiat_rate = self.FIAT_RATES.cached_rate(planned[0].currency)
+            if fiat_rate is None:
+                with tracing.span('fiat rate'):
+                    fiat_rate = await asyncio.get_running_loop().run_in_executor(None, self.FIAT_RATES.rate, planned[0].currency)
+        for request in planned:
+            request.project_url = self.get_project_url(request.symbol)
+            request.fiat_rate = fiat_rate
+            self._set_quote_source(request)
+
+        error = None
+        fresh = await asyncio.gather(*[self.QUOTE_CACHE.peek_async(request.cache_key, max_age=self.QUOTE_CACHE_TTL)
+                                       for request in planned])
+        missing = [request for request, quote in zip(planned, fresh) if quote is None]
+        if len(missing) > 0:
+            ids = ','.join(sorted({request.data_key for request in missing}))
+            try:
+                with tracing.span('quotes'):
+                    data_quote = await self._request_async('cryptocurrency_quotes_latest', id=ids, convert=missing[0].cache_key[1])
+            except CoinMarketCapAPIError as e:
+                error = e
+            else:
+                await self.QUOTE_CACHE.put_many_async([(request.cache_key, data_quote.data[request.data_key]) for request in missing
+                                                       if data_quote.data.get(request.data_key) is not None])
+
+        found = []  # (reply index, request, quote)
+        for i, request in enumerate(requests):
+            if request is None:
+                continue
+            tmp_crypto_data = await self.QUOTE_CACHE.peek_async(request.cache_key)
+            if tmp_crypto_data is None:
+                replies[i] = self._finish_quote_request(request, None, error or 'Crypto token not found or misspelled.')
+            else:
+                found.append((i, request, tmp_crypto_data))
+        with tracing.span('render'):
+            messages = self.RENDERER.render_many([self._render_args(request, tmp_crypto_data) for _, request, tmp_crypto_data in found])
+        for (i, request, _), message in zip(found, messages):
+            replies[i] = message, self._found_status(request)
+        return replies
+
+    def _plan_quote_request(self, symbol: str, currency: str) -> tuple:
+        '''Local part of a quote request: credit check, symbol and currency lookup. Returns (QuoteRequest, None) or (None, early reply).'''
         if self.OUT_OF_ALL_CREDITS is True:
             msg = 'Sorry, I am out of mana! Come back soon!\n_(reached API call limit)_'
-            return msg, False
+            return None, (msg, False)
 
-        return_status = ''  # will be appended with status messages that can occur in this function.
-        cryptolist_exists, fiatlist_exists = True, True
-        if self.CRYPTO_MAP is None:
+        maps = self.MAPS  # Same snapshot for the whole lookup, even if a refresh swaps in a new one meanwhile
+        index = maps.symbol_index
+        if currency.lower() != 'usd' and index.fiat(currency) is None and maps.fuzzy_index.exact(symbol + currency) is not None:
+            symbol, currency = symbol + ' ' + currency, 'USD'  # Two word name like "shiba inu", not a currency
+        request = QuoteRequest(symbol)
+        if index.has_crypto_map is False:
             print('Crypto map not found. Doing blind query')
-            cryptolist_exists = False
-        else:
-            crypto_map = [x.lower() for x in self.CRYPTO_MAP]  # Storing a copy in lower casing.
-        if self.FIAT_MAP is None:
-            print('FIAT map not found. Doing blind query')
-            fiatlist_exists = False
         else:
-            fiat_map = [x.lower() for x in self.FIAT_MAP]  # Storing a copy in lower casing.
-
-        if cryptolist_exists is True:
-            if symbol.lower() not in crypto_map:
-                return_status += 'Crypto token not found or misspelled.'
-                return None, return_status
-
-        project_url = ''
-        if self.CRYPTO_INFO is not None:
-            symbol_uppercased = symbol.upper()
-            if symbol_uppercased in self.CRYPTO_INFO:
-                project_url = self.CRYPTO_INFO[symbol_uppercased]['urls']['website'][0]
-                # project_logo_url = self.CRYPTO_INFO[symbol_uppercased]['logo']
-            else:
-                token_info = self.get_crypto_info([symbol_uppercased], save_pickle=True)
-                if token_info is not None:
-                    project_url = token_info[symbol_uppercased]['urls']['website'][0]
-                    # project_logo_url = token_info[symbol_uppercased]['logo']
+            request.crypto_entry = index.lookup(symbol) or maps.fuzzy_index.exact(symbol)  # Symbol, or full name / slug
+            if request.crypto_entry is None:
+                request.return_status += 'Crypto token not found or misspelled.' + self.suggestions_line(symbol, maps)
+                return None, (None, request.return_status)
+            request.symbol = request.crypto_entry.symbol
 
-        switched_to_default_currency = False
         if currency.lower() != 'usd':
-            if fiatlist_exists is True:
-                if currency.lower() not in fiat_map:
-                    print('{0} is not in fiat map...'.format(currency))
-                    def_currency = 'USD'
-                    old_currency = currency  # for printing in the end
-                    return_status += f'No currency "{currency}" was found. Used "{def_currency}" by default.'
-                    currency = def_currency
-                    switched_to_default_currency = True
-
-        currency = currency.upper()
-        data_quote, error = self.get_cryptocurrency_quote(symbol=symbol, currency=currency)
-        if data_quote is None:
-            return_status += str(error)
-            return None, return_status
-        tmp_crypto_data = data_quote.data[symbol.upper()]
-        data = {
-            'name': tmp_crypto_data['name'],
-            'symbol': tmp_crypto_data['symbol'],
-            'currency': currency,
-            'price': self.round_nonzero(tmp_crypto_data['quote'][currency]['price'], digits_to_keep=2),
-            'market_cap': self.round_nonzero(tmp_crypto_data['quote'][currency]['market_cap'], digits_to_keep=2),
-            'volume_24h': self.round_nonzero(tmp_crypto_data['quote'][currency]['volume_24h'], digits_to_keep=2),
-            'percent_change_24h': self.round_nonzero(tmp_crypto_data['quote'][currency]['percent_change_24h'], digits_to_keep=2),
-            'last_updated': tmp_crypto_data['quote'][currency]['last_updated'][:-5].replace('T', ' ').split()[1] + ' UTC+0'
-        }
-        if switched_to_default_currency is True:
-            currency_status_line = '_Currency {0} was not found. Used default {1} instead._\n'.format(old_currency, def_currency)
+            if index.has_fiat_map is False:
+                print('FIAT map not found. Doing blind query')
+            elif index.fiat(currency) is None:
+                print('{0} is not in fiat map...'.format(currency))
+                def_currency = 'USD'
+                request.old_currency = currency  # for printing in the end
+                request.return_status += f'No currency "{currency}" was found. Used "{def_currency}" by default.'
+                currency = def_currency
+                request.switched_to_default_currency = True
+        request.currency = currency.upper()
+        return request, None
+
+    def suggestions_line(self, text: str, maps: MapSnapshot = None) -> str:
+        '''" Did you mean: BTC (Bitcoin), BIT (Bit Coin)?" for a token that was not found. '' if nothing is close enough.'''
+        suggestions = (maps or self.MAPS).fuzzy_index.search(text, self.SUGGESTIONS_MAX)
+        if len(suggestions) == 0:
+            return ''
+        return ' Did you mean: {}?'.format(', '.join('{0} ({1})'.format(entry.symbol, entry.name) for entry, _ in suggestions))
+
+    def get_project_url(self, symbol: str) -> str:
+        ''' Returns project website of a token from CRYPTO_INFO, '' if the store doesn't have the token yet.
+            Never calls CMC: missing tokens are remembered and fetched by metadata_warm_up() in background.
+        '''
+        symbol_uppercased = symbol.upper()
+        website = self.CRYPTO_INFO.website(symbol_uppercased)  # From memory, full info stays on disk
+        if website is None:
+            with self._metadata_lock:
+                is_new = symbol_uppercased not in self.METADATA_WANTED
+                self.METADATA_WANTED[symbol_uppercased] = None
+                self.METADATA_WANTED.move_to_end(symbol_uppercased)
+                if len(self.METADATA_WANTED) > self.METADATA_WANTED_MAX:
+                    self.METADATA_WANTED.popitem(last=False)
+            if is_new is True and self.STORE is not None and self.RUN_JOBS is False:
+                self.STORE.submit(self._push_wanted, symbol_uppercased)  # Warm-up runs in another process -> tell it, without waiting
+            return ''
+        return website
+
+    def _push_wanted(self, symbol: str) -> None:
+        try:
+            self.STORE.push(self.SHARED_WANTED_KEY, [symbol], self.METADATA_WANTED_MAX)
+        except StoreError as e:
+            print(e)
+
+    def _set_quote_source(self, request) -> None:
+        ''' Decides which quote to fetch/cache for a request.
+            Non-USD price is USD quote (shared with everybody asking for this token) times a cached fiat rate. If the rate is not
+            available, falls back to asking CMC for that currency directly.
+        '''
+        quote_currency = 'USD' if request.fiat_rate is not None else request.currency
+        crypto_entry = request.crypto_entry
+        if crypto_entry is not None and crypto_entry.id is not None:
+            # Asking by CMC id -> always get the same coin the index picked, even when the ticker is shared by several coins.
+            request.cache_key = (crypto_entry.id, quote_currency)
+            request.quote_params = {'cmc_id': crypto_entry.id, 'currency': quote_currency}
+            request.data_key = str(crypto_entry.id)
         else:
-            currency_status_line = ''
-        # NOTE: One day re-code it to fit 120-160 lines limit...
-        # header = f"*Crypto Price Finder BOT!* {EMOJIS['detective']} \n"
-        slug_list_id = self.CRYPTO_MAP.index(data['symbol'])
-
-        project_url_string = '         [Project page]({})\n\n'.format(project_url) if len(project_url) > 0 else '\n\n'
-        name = f"\n[{data['name']} ({data['symbol']})]({self.CMC_URL + self.SLUG_MAP[slug_list_id]})" + project_url_string
-        price = f"Price:                  *{data['price']}* {data['currency']}\n"
-        market_cap = f"Market Cap:     {ceil(float(data['market_cap'])):,} {data['currency']}\n"
-        volume = f"Volume 24h:    {ceil(float(data['volume_24h'])):,} {data['currency']}\n"
-        last_updated = f"Last Updated: {data['last_updated']}\n\n"
-        if float(data['percent_change_24h']) >= 50:
-            emoji_status = f"{EMOJIS['rocket']}{EMOJIS['rocket']}{EMOJIS['rocket']}"
-        elif float(data['percent_change_24h']) >= 25:
-            emoji_status = f"{EMOJIS['rocket']}{EMOJIS['rocket']}"
-        elif float(data['percent_change_24h']) >= 15:
-            emoji_status = f"{EMOJIS['rocket']}"
-        elif float(data['percent_change_24h']) >= 2:
-            emoji_status = f"{EMOJIS['thumbs_up']}"
-        elif float(data['percent_change_24h']) >= -2 and float(data['percent_change_24h']) <= 2:
-            emoji_status = f"{EMOJIS['zzz']}"
-        elif float(data['percent_change_24h']) <= -50:
-            emoji_status = f"{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}"
-        elif float(data['percent_change_24h']) <= -25:
-            emoji_status = f"{EMOJIS['red_triangle']}{EMOJIS['red_triangle']}"
-        elif float(data['percent_change_24h']) <= -15:
-            emoji_status = f"{EMOJIS['red_triangle']}"
-        elif float(data['percent_change_24h']) <= -2:
-            emoji_status = f"{EMOJIS['thumbs_down']}"
-        change = f"Pct.Ch. 24h:      {data['percent_change_24h']}% {emoji_status}\n"
-        powered_by = "[Powered by @crypto_price_finder_bot](https://t.me/crypto_price_finder_bot)" + f"{EMOJIS['tree']}"
-        output_string = f"{currency_status_line}{name}{price}{market_cap}{volume}{change}{last_updated}{powered_by}"
-        # nice_output_msg += '\n_If you like the bot, consider donating with_ */donate* _command. Cheers!_'
-        if len(return_status) == 0:
-            return_status = 'Token has been found!'
-        return output_string, return_status
-
-    def PrintSupportedCryptos(self) -> tuple[list, bool]:
-        ''' Returns a long string with crypto symbols, supported in CoinMarketCap API. Currently the number is 10000.
-            NOTE: Something not done with pagination in request, returns only 10k symbols, but has more. Can be fixed but didnt bother...
-            Slices big string into smaller chunks, storing in a list.
+            request.cache_key = (request.symbol.upper(), quote_currency)
+            request.quote_params = {'symbol': request.symbol, 'currency': quote_currency}
+            request.data_key = request.symbol.upper()
+        self.REQUEST_COUNTS[request.cache_key[0]] += 1
+
+    def _load_quote(self, request) -> tuple:
+        data_quote, error = self.get_cryptocurrency_quote(**request.quote_params)
+        return self._extract_token_quote(request, data_quote, error)
+
+    async def _load_quote_async(self, request) -> tuple:
+        data_quote, error = await self.get_cryptocurrency_quote_async(**request.quote_params)
+        return self._extract_token_quote(request, data_quote, error)
+
+    def _extract_token_quote(self, request, data_quote, error) -> tuple:
+        if data_quote is None:
+            return None, error
+        token_quote = data_quote.data.get(request.data_key)
+        if isinstance(token_quote, list):  # Blind query by symbol: v2 replies hold every token with that ticker, best ranked first
+            token_quote = token_quote[0] if len(token_quote) > 0 else None
+        if token_quote is None:
+            return None, 'Crypto token not found or misspelled.'
+        return token_quote, None
+
+    def _finish_quote_request(self, request, tmp_crypto_data: dict, error) -> tuple:
+        if tmp_crypto_data is None:
+            request.return_status += str(error)
+            return None, request.return_status
+        return self.RENDERER.render(*self._render_args(request, tmp_crypto_data)), self._found_status(request)
+
+    def _render_args(self, request, tmp_crypto_data: dict) -> tuple:
+        '''QuoteRenderer.render() arguments of a request that got its quote. Converts USD quote into the requested fiat if needed.'''
+        if request.fiat_rate is not None:
+            tmp_crypto_data = convert_quote(tmp_crypto_data, request.currency, request.fiat_rate)
+        slug = request.crypto_entry.slug if request.crypto_entry is not None else tmp_crypto_data['slug']
+        old_currency = request.old_currency if request.switched_to_default_currency is True else None
+        return tmp_crypto_data, request.currency, slug, request.project_url, old_currency
+
+    @staticmethod
+    def _found_status(request) -> str:
+        return request.return_status if len(request.return_status) > 0 else 'Token has been found!'
+
+    def build_crypto_pages(self, crypto_entries: list) -> list:
+        ''' Splits crypto map into pages of /crypto list, best ranked first (CRYPTO_LIST_PAGE_SIZE tokens per page).
+            Built once per map load (see MapSnapshot), so browsing the list never formats anything.
         '''
-        if self.OUT_OF_ALL_CREDITS is True:
-            msg = 'Sorry, I am out of mana! Come back soon!\n_(reached API call limit)_'
-            status = False
-            return msg, status
-
-        assert self.CRYPTO_MAP is not None, 'Supported crypto tokens list is not available...'
-        str_1 = '{0} The following {1} crypto tokens are supported:\n'.format(EMOJIS['globe'], len(self.CRYPTO_MAP))
-        str_2 = " ".join(map(str, self.CRYPTO_MAP))
-        # Line below chops a large string into equal portions of 'self.TELEGRAM_MSG_CHAR_LIMIT' char length.
-        msg = [str_2[i:i + self.TELEGRAM_MSG_CHAR_LIMIT] for i in range(0, len(str_2), self.TELEGRAM_MSG_CHAR_LIMIT)]
-        msg.insert(0, str_1)
-        msg.append('Sorry for spam! Above are {0} crypto tokens!\n'.format(len(self.CRYPTO_MAP)))
-        msg.append('Use Ctrl+F to find the one you need! If you are on the phone, well... Good luck searching!')
-        return msg, True
+        ranked = sorted(crypto_entries, key=lambda entry: (entry.rank is None, entry.rank or 0))
+        page_count = max(1, ceil(len(ranked) / self.CRYPTO_LIST_PAGE_SIZE))
+        pages = []
+        for page in range(page_count):
+            header = '{0} Crypto tokens on CoinMarketCap, best ranked first. Page {1}/{2}, {3} tokens in total.\n\n'.format(
+                EMOJIS['globe'], page + 1, page_count, len(ranked))
+            lines = []
+            for entry in ranked[page * self.CRYPTO_LIST_PAGE_SIZE:(page + 1) * self.CRYPTO_LIST_PAGE_SIZE]:
+                rank = '#{} '.format(entry.rank) if entry.rank is not None else ''
+                lines.append('{0}{1} - {2}'.format(rank, entry.symbol, entry.name))
+            pages.append(header + '\n'.join(lines)[:self.TELEGRAM_MSG_CHAR_LIMIT - len(header)])
+        return pages
+
+    def PrintSupportedCryptos(self, page: int = 0) -> tuple[str, int, int]:
+        ''' Returns one page of crypto tokens supported in CoinMarketCap API as (text, page, page count).
+            "page" counts from 0 and is clamped to existing pages. Pages are prebuilt by build_crypto_pages(), nothing is requested.
+        '''
+        pages = self.MAPS.crypto_pages
+        if len(pages) == 0:
+            return 'Supported crypto tokens list is not available yet. Try again in a minute!', 0, 0
+        page = min(max(page, 0), len(pages) - 1)
+        return pages[page], page, len(pages)
 
     def PrintSupportedFiats(self) -> str:
         '''Returns a string with fiat currency symbols supported in CoinMarketCap API.'''
@@ -232,9 +694,11 @@ class CMCPrices(object):
             msg = 'Sorry, I am out of mana! Come back soon!\n_(reached API call limit)_'
             return msg, False
 
-        assert self.FIAT_MAP is not None, 'Supported fiat currency list is not available...'
-        str_1 = '{0} The following {1} fiat currencies are supported:\n'.format(EMOJIS['globe'], len(self.FIAT_MAP))
-        str_2 = " ".join(map(str, self.FIAT_MAP))
+        fiat_map = self.MAPS.fiat_map
+        if fiat_map is None:
+            return 'Supported fiat currency list is not available yet. Try again in a minute!', True
+        str_1 = '{0} The following {1} fiat currencies are supported:\n'.format(EMOJIS['globe'], len(fiat_map))
+        str_2 = " ".join(map(str, fiat_map))
         return str_1 + str_2, True
 
     def PrintKeyInfo(self) -> str:
@@ -248,94 +712,82 @@ class CMCPrices(object):
             usage['current_minute']['requests_made'], usage['current_minute']['requests_left'] + usage['current_minute']['requests_made'])
         str_3 = 'Credits used [day]: {0} / {1}\n'.format(
             usage['current_day']['credits_used'], usage['current_day']['credits_left'] + usage['current_day']['credits_used'])
-        str_4 = 'Credits used [month]: {0} / {1}'.format(
+        str_4 = 'Credits used [month]: {0} / {1}\n'.format(
             usage['current_month']['credits_used'], usage['current_month']['credits_left'] + usage['current_month']['credits_used'])
-        result_msg = f"{str_1}{str_2}{str_3}{str_4}"
+        cache = self.QUOTE_CACHE.stats()
+        str_5 = 'Quote cache: {0} hits, {1} stale hits, {2} misses ({3:.0%} served from memory), {4} quotes cached'.format(
+            cache['hits'], cache['stale_hits'], cache['misses'], cache['hit_ratio'], cache['size'])
+        str_5 += '\nToken infos: {0} stored, {1} waiting for warm-up'.format(len(self.CRYPTO_INFO), len(self.METADATA_WANTED))
+        str_5 += '\nCMC retries: {0}, gave up: {1}, circuit breaker {2}'.format(self.RETRY.retries, self.RETRY.gave_up, self.RETRY.breaker.state)
+        str_6 = ''
+        for key_stats in self.KEY_POOL.stats():
+            str_6 += '\n{0}: {1} requests this minute, {2} credits today, {3} this month left{4}'.format(
+                key_stats['name'], key_stats['minute'], key_stats['day'], key_stats['month'], ' (quarantined)' if key_stats['quarantined'] else '')
+        result_msg = f"{str_1}{str_2}{str_3}{str_4}{str_5}{str_6}"
         return result_msg
 
     def get_key_info(self) -> tuple[dict, str]:
         '''Request to get CMC API usage info using 3rd party CMC wrapper.'''
         try:
-            data_quote = self.CMC.key_info()
-            status = self.api_status_handler(data_quote.status)
-        except CoinMarketCapAPIError:
-            time.sleep(self.RETRY_REQUEST_SLEEP)
-            try:
-                data_quote = self.CMC.key_info()
-                status = self.api_status_handler(data_quote.status)
-            except CoinMarketCapAPIError as e:
-                return None, e
-        return data_quote, status
+            data_quote = self._request('key_info')
+        except CoinMarketCapAPIError as e:
+            return None, e
+        return data_quote, self.api_status_handler(data_quote.status)
 
-    def get_crypto_symbols_and_slugs(self, save_pickle: bool = False) -> list or None:
-        '''Request to get crypto symbols and "slugs"(url component) of all cryptos supported in CMC.
-           Request uses 3rd party CMC wrapper. Can store data in a .pickle file is "save_pickle=True
+    def get_crypto_map(self, save_pickle: bool = False) -> list or None:
+        '''Request to get id, symbol, name, "slug"(url component) and rank of all cryptos supported in CMC.
+           Walks all pages of the map (CRYPTO_MAP_PAGE_SIZE tokens each), several pages at a time while the per minute limit
+           leaves room for user requests too. Returns a list of CryptoEntry tuples. Can store data in a .pickle file if "save_pickle=True"
         '''
+        entries, seen_ids = [], set()
+        start = 1
         try:
-            c_map = self.CMC.cryptocurrency_map()
-        except CoinMarketCapAPIError:
-            time.sleep(self.RETRY_REQUEST_SLEEP)
-            try:
-                c_map = self.CMC.cryptocurrency_map()
-            except CoinMarketCapAPIError as e:
-                print(e)
-                return None
-        symbols_list = []
-        slug_list = []  # nicknames that CMC uses for cryptos. Used in getting crypto URL.
-        for item in c_map.data:
-            symbols_list.append(item['symbol'])
-            slug_list.append(item['slug'])
+            while True:
+                parallel = max(1, min(self.CRYPTO_MAP_PARALLEL_PAGES, self.KEY_POOL.requests_available() // 2))
+                futures = [self.ASYNC.submit(self._request_async('cryptocurrency_map', start=start + i * self.CRYPTO_MAP_PAGE_SIZE,
+                                                                 limit=self.CRYPTO_MAP_PAGE_SIZE)) for i in range(parallel)]
+                pages = [future.result(timeout=self.RETRY_DEADLINE + 1) for future in futures]
+                for c_map in pages:
+                    for item in c_map.data:
+                        if item['id'] not in seen_ids:  # Listings can shift between pages while they are fetched
+                            seen_ids.add(item['id'])
+                            entries.append(CryptoEntry(item['id'], item['symbol'], item['name'], item['slug'], item.get('rank')))
+                if any(len(c_map.data) < self.CRYPTO_MAP_PAGE_SIZE for c_map in pages):
+                    break
+                start += parallel * self.CRYPTO_MAP_PAGE_SIZE
+        except CoinMarketCapAPIError as e:
+            print(e)
+            return None
+        except concurrent.futures.TimeoutError:
+            print('cryptocurrency_map: no reply within {} seconds'.format(self.RETRY_DEADLINE))
+            return None
 
         if save_pickle is True:
-            if '.pickle' not in self.CRYPTO_SYMBOLS_PICKLE_NAME:  # if file name provided contains no extension -> add it.
-                symbols_pickle_file_name = self.CRYPTO_SYMBOLS_PICKLE_NAME + '.pickle'
-                slugs_pickle_file_name = self.CRYPTO_SLUG_PICKLE_NAME + '.pickle'
-            else:
-                symbols_pickle_file_name = self.CRYPTO_SYMBOLS_PICKLE_NAME
-                slugs_pickle_file_name = self.CRYPTO_SLUG_PICKLE_NAME
-            try:
-                with open(os.path.join(self.DIR_PATH, symbols_pickle_file_name), "wb") as f:
-                    pickle.dump(symbols_list, f)
-                with open(os.path.join(self.DIR_PATH, slugs_pickle_file_name), "wb") as f:
-                    pickle.dump(slug_list, f)
-            except Exception as e:
-                print('PICKLE ERROR: {}'.format(e))
-        print('Loaded fresh list of crypto tokens listed on CoinmarketCap.')
-        return [symbols_list, slug_list]
+            self.save_map_pickle(self.CRYPTO_MAP_PICKLE_NAME, entries)
+        print('Loaded fresh list of {} crypto tokens listed on CoinmarketCap.'.format(len(entries)))
+        return entries
 
     def get_fiat_map(self, save_pickle: bool = False) -> list or None:
         '''Request to get fiat currency symbols supported in CMC.
            Request uses 3rd party CMC wrapper. Can store data in a .pickle file is "save_pickle=True
         '''
         try:
-            f_map = self.CMC.fiat_map()
-        except CoinMarketCapAPIError:
-            time.sleep(self.RETRY_REQUEST_SLEEP)
-            try:
-                f_map = self.CMC.fiat_map()
-            except CoinMarketCapAPIError as e:
-                print(e)
-                return None
+            f_map = self._request('fiat_map')
+        except CoinMarketCapAPIError as e:
+            print(e)
+            return None
         symbols_list = []
         for item in f_map.data:
             symbols_list.append(item['symbol'])
 
         if save_pickle is True:
-            if '.pickle' not in self.FIAT_SYMBOLS_PICKLE_NAME:  # if file name provided contains no extension -> add it.
-                pickle_file_name = self.FIAT_SYMBOLS_PICKLE_NAME + '.pickle'
-            else:
-                pickle_file_name = self.FIAT_SYMBOLS_PICKLE_NAME
-            try:
-                with open(os.path.join(self.DIR_PATH, pickle_file_name), "wb") as f:
-                    pickle.dump(symbols_list, f)
-            except Exception as e:
-                print('PICKLE ERROR: {}'.format(e))
+            self.save_map_pickle(self.FIAT_SYMBOLS_PICKLE_NAME, symbols_list)
         print('Loaded fresh list of fiat currencies available on CoinmarketCap.')
         return symbols_list
 
-    def get_crypto_info(self, symbols_list, save_pickle: bool = False) -> list or None:
+    def get_crypto_info(self, symbols_list, save: bool = False) -> dict or None:
         '''Request to get a crypto currency info. Input supports both a single symbol in string or a list of strings with many symbols.
-           Request uses 3rd party CMC wrapper. Can store data in a .pickle file is "save_pickle=True
+           Stores fetched tokens in CRYPTO_INFO store if "save=True".
         '''
         if not isinstance(symbols_list, list) and isinstance(symbols_list, str):
             symbols_list = [symbols_list]
@@ -349,64 +801,137 @@ class CMCPrices(object):
         crypto_list_string = crypto_list_string[:-1]
 
         try:
-            c_info = self.CMC.cryptocurrency_info(symbol=crypto_list_string)
-        except CoinMarketCapAPIError:
-            time.sleep(self.RETRY_REQUEST_SLEEP)
+            c_info = self._request('cryptocurrency_info', symbol=crypto_list_string)
+        except CoinMarketCapAPIError as e:
+            print(e)
+            return None
+
+        if save is True:
+            added = self.CRYPTO_INFO.put_many(c_info.data)
+            print('Stored {0} new token(s) in {1} (total {2} tokens): {3}.'.format(added, self.CRYPTO_INFO_DB_NAME, len(self.CRYPTO_INFO), symbols_list))
+        return c_info.data
+
+    def get_fiat_rates(self, currencies: list) -> tuple[dict, str]:
+        '''Request to get how many units of each fiat currency 1 USD is worth, e.g. {'EUR': 0.92, 'DKK': 6.87}.
+           Uses CMC price conversion tool in chunks of FIAT_RATES_CONVERT_PER_CALL currencies. Returns (rates, error).
+        '''
+        rates = {}
+        error = None
+        for i in range(0, len(currencies), self.FIAT_RATES_CONVERT_PER_CALL):
+            chunk = currencies[i:i + self.FIAT_RATES_CONVERT_PER_CALL]
             try:
-                c_info = self.CMC.cryptocurrency_info(symbol=crypto_list_string)
+                conversion = self._request('tools_priceconversion', amount=1, id=self.USD_CMC_ID, convert=','.join(chunk))
             except CoinMarketCapAPIError as e:
-                print(e)
-                return None
+                error = e
+                continue
+            for currency, converted in conversion.data['quote'].items():
+                rates[currency] = converted['price']
+        if len(rates) == 0:
+            return None, error
+        return rates, error
 
-        if save_pickle is True:
-            if '.pickle' not in self.CRYPTO_INFO_PICKLE_NAME:
-                pickle_file_name = self.CRYPTO_INFO_PICKLE_NAME + '.pickle'
-            else:
-                pickle_file_name = self.CRYPTO_INFO_PICKLE_NAME
+    def get_cryptocurrency_quote(self, symbol: str = None, currency: str = 'USD', cmc_id: int = None) -> dict:
+        '''Request to get a crypto currency price quote. Looks token up by CMC id if given (unambiguous), otherwise by symbol.
+        '''
+        params = {'id': cmc_id} if cmc_id is not None else {'symbol': symbol}
+        try:
+            data_quote = self._request('cryptocurrency_quotes_latest', convert=currency, **params)
+        except CoinMarketCapAPIError as e:
+            return None, e
+        return data_quote, self.api_status_handler(data_quote.status)
 
-            full_path = os.path.join(self.DIR_PATH, pickle_file_name)  # NOTE: Only looks in directory where this script is running
+    def _request(self, endpoint: str, **params):
+        '''Single entry point for all CoinMarketCap API calls from plain threads. "endpoint" is a method name of CoinMarketCapAPI wrapper.
+           Runs _request_async() in self.ASYNC loop and waits for it -> retries and backoff never park a thread in time.sleep,
+           and sync and async callers asking for the same thing share one request. Must not be called from the loop thread itself.
+        '''
+        assert not self.ASYNC.in_loop_thread(), 'Use _request_async() inside ASYNC loop'
+        try:
+            return self.ASYNC.run(self._request_async(endpoint, **params), timeout=self.RETRY_DEADLINE + 1)
+        except concurrent.futures.TimeoutError:
+            raise CMCTransportError('{0}: no reply within {1} seconds'.format(endpoint, self.RETRY_DEADLINE))
 
-            if not os.path.exists(full_path):
-                print(f'{pickle_file_name} doesnt exist. Creating new one.')
-                try:
-                    with open(os.path.join(full_path), "wb") as f:
-                        pickle.dump(c_info.data, f)
-                        print('Loaded fresh crypto info package ({} different crypto tokens) available on CoinmarketCap.'.format(len(c_info.data)))
-                except Exception as e:
-                    print('PICKLE ERROR: {}'.format(e))
+    async def _request_async(self, endpoint: str, **params):
+        ''' Concurrent calls with the same endpoint and parameters wait for one in-flight request and share its response or error.
+            The request is retried by self.RETRY policy and every attempt is routed to the API key with most credits left.
+        '''
+        key = (endpoint, tuple(sorted(params.items())))
+        task = self.ASYNC_FLIGHTS.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.RETRY.call(lambda: self._routed_call_async(endpoint, params)))
+            self.ASYNC_FLIGHTS[key] = task
+            task.add_done_callback(lambda _: self.ASYNC_FLIGHTS.pop(key, None))
+        return await asyncio.shield(task)  # One caller giving up doesn't cancel the request for the others
 
-            else:
-                try:
-                    with open(full_path, "rb") as f:
-                        pickle_data = pickle.load(f)
-                except Exception as e:
-                    print('PICKLE ERROR: {}'.format(e))
-                for token in symbols_list:
-                    pickle_data[token] = c_info.data[token]
-                try:
-                    with open(os.path.join(full_path), "wb") as f:
-                        pickle.dump(pickle_data, f)
-                        print('Updated existing crypto_info pickle (total {0} tokens) with new token(s): {1}.'.format(len(pickle_data), symbols_list))
-                except Exception as e:
-                    print('PICKLE ERROR: {}'.format(e))
-            self.CRYPTO_INFO = self.load_symbols_from_pickle(self.CRYPTO_INFO_PICKLE_NAME, expiration_hours=None)
-        return c_info.data
+    async def _routed_call_async(self, endpoint: str, params: dict):
+        credits = self.estimate_credits(endpoint, params)
+        deadline = time.monotonic() + self.CREDIT_QUEUE_MAX_WAIT
+        while True:
+            try:
+                # Never waits for the minute limit, that happens below. Shared budgets are store round trips -> off the loop.
+                api_key = await off_loop(self.STORE, self.KEY_POOL.acquire, credits)
+                break
+            except OutOfCreditsError:
+                wait = await off_loop(self.STORE, self.KEY_POOL.minute_wait)
+                if wait is None or time.monotonic() + wait > deadline:
+                    self.CMC_CALLS_REFUSED.inc(endpoint)
+                    raise
+                with tracing.span('minute limit wait'):
+                    await asyncio.sleep(wait)
+        started = time.perf_counter()
+        try:
+            with tracing.span('cmc ' + endpoint):
+                response = await self.ASYNC_CMC.request(endpoint, api_key.key, **params)
+        except CoinMarketCapAPIError as e:
+            # Failed calls are not charged by CMC. Key/limit errors quarantine the key.
+            error_code = e.rep.status.get('error_code') if getattr(e, 'rep', None) is not None else None
+            self._release_key(api_key, credits, 0, error_code)
+            self._count_cmc_call(endpoint, api_key, started, error_code_of(e) or 'transport')
+            raise
+        except BaseException:
+            self._release_key(api_key, credits, 0)
+            self._count_cmc_call(endpoint, api_key, started, 'cancelled')
+            raise
+        credit_count = response.status.get('credit_count')
+        self._release_key(api_key, credits, credit_count)
+        self._count_cmc_call(endpoint, api_key, started, 'ok')
+        if credit_count:
+            self.CMC_CREDITS_USED.inc(api_key.name, amount=credit_count)
+        return response
 
-    def get_cryptocurrency_quote(self, symbol: str, currency: str = 'USD') -> dict:
-        '''Request to get a crypto currency price quote.
-           Request uses 3rd party CMC wrapper. Can store data in a .pickle file is "save_pickle=True
-        '''
+    def _release_key(self, api_key, credits: float, actual: float or None, error_code=None) -> None:
+        '''KEY_POOL.release() for asyncio code. Settling shared credits is a store round trip -> done in a store thread, not awaited.'''
+        if self.STORE is None:
+            self.KEY_POOL.release(api_key, credits, actual, error_code=error_code)
+        else:
+            self.STORE.submit(self.KEY_POOL.release, api_key, credits, actual, error_code)
+
+    def _count_cmc_call(self, endpoint: str, api_key, started: float, result) -> None:
+        self.CMC_CALL_SECONDS.observe(time.perf_counter() - started, endpoint)
+        self.CMC_CALLS.inc(endpoint, api_key.name, str(result))
+
+    def estimate_credits(self, endpoint: str, params: dict) -> int:
+        '''Credit cost of a CMC call, as documented by CMC. Used to reserve credits before the call, corrected by real cost afterwards.'''
+        if endpoint == 'key_info':
+            return 0
+        items = len(str(params.get('id') or params.get('symbol') or '').split(','))
+        converts = len(str(params.get('convert') or 'USD').split(','))
+        if endpoint == 'cryptocurrency_quotes_latest':
+            return ceil(items / 100) * converts  # 1 credit per 100 tokens, +1 per each extra convert currency
+        if endpoint == 'cryptocurrency_info':
+            return ceil(items / 100)
+        if endpoint == 'tools_priceconversion':
+            return converts
+        return 1
+
+    async def get_cryptocurrency_quote_async(self, symbol: str = None, currency: str = 'USD', cmc_id: int = None) -> tuple:
+        '''Async version of get_cryptocurrency_quote(), for code running inside self.ASYNC loop.'''
+        params = {'id': cmc_id} if cmc_id is not None else {'symbol': symbol}
         try:
-            data_quote = self.CMC.cryptocurrency_quotes_latest(symbol=symbol, convert=currency)
-            status = self.api_status_handler(data_quote.status)
-        except CoinMarketCapAPIError:
-            time.sleep(self.RETRY_REQUEST_SLEEP)
-            try:
-                data_quote = self.CMC.cryptocurrency_quotes_latest(symbol=symbol, convert=currency)
-                status = self.api_status_handler(data_quote.status)
-            except CoinMarketCapAPIError as e:
-                return None, e
-        return data_quote, status
+            data_quote = await self._request_async('cryptocurrency_quotes_latest', convert=currency, **params)
+        except CoinMarketCapAPIError as e:
+            return None, e
+        return data_quote, self.api_status_handler(data_quote.status)
 
     def api_status_handler(self, status_dict: dict) -> str:
         ''' Takes in status part of Coinmarketcap API request return and handles errors.'''
@@ -435,94 +960,168 @@ class CMCPrices(object):
         elif status_dict['error_code'] == 1011:
             return 'HTTP Status: 429. Error Code: 1011. ' + status_dict['error_message']
 
-    def api_key_scheduled_check(self, day_threshold: float = 0.99, month_threshold: float = 0.99) -> None:
-        '''Checks API usage and tries to switch to another API key stored in  "ALL_API_KEYS" class variable.
-           The switch happens if credits used >= "day(month)_threshold" * credits total. Credits info obtained from get_key_info() method.
-           Flips OUT_OF_ALL_CREDITS to True if no credits left in all keys... Will print the same "Out of mana message. Wait X time" to users.
+    def api_key_scheduled_check(self) -> None:
+        '''Reconciles local credit accounting of every API key with real usage from key_info (a free CMC call).
+           Used as background scheduled task.
         '''
-        # Just putting currently used API key to the beginning of the list.
-        self.ALL_API_KEYS.remove(self.ACTIVE_API_KEY)
-        self.ALL_API_KEYS.insert(0, self.ACTIVE_API_KEY)
-
-        for key in self.ALL_API_KEYS:
-            if key is not None:
-                current_key_good = False
-                if key == self.ACTIVE_API_KEY:  # If key is point at the currently used api key -> Don't do anything
-                    current_key_good = True
-                else:  # If we switch the keys, we need to reload self.CMC class initialized in __init__()
-                    self.ACTIVE_API_KEY = key
-                    self.CMC = CoinMarketCapAPI(self.ACTIVE_API_KEY)
-                data_quote, error = self.get_key_info()
-                if data_quote is None:
-                    print(error)
-                usage = data_quote.data['usage']
-                plan = data_quote.data['plan']
-                if not (usage['current_day']['credits_used'] >= plan['credit_limit_daily'] * day_threshold) and \
-                   not (usage['current_month']['credits_used'] >= plan['credit_limit_monthly'] * month_threshold):
-                    self.OUT_OF_ALL_CREDITS = False
-                    if current_key_good is True:
-                        pass
-                    else:
-                        print('Switched to another API key with available credits.')
-                    return
-
-        # If the code got here -> no credits left on any of API keys.
-        # Flip "self.OUT_OF_ALL_CREDITS" that will block all requests and just print "Out of mana" for users in Telegram.
-        # NOTE: Add later -> "Come back in X time when I will regenerate mana and work again."
-        print('Out of all credits...')
-        self.OUT_OF_ALL_CREDITS = True
-        return
+        for api_key in self.KEY_POOL.API_KEYS:
+            try:
+                data_quote = self.ASYNC.run(self.ASYNC_CMC.request('key_info', api_key.key), timeout=self.CMC_HTTP_TIMEOUT + 1)
+            except Exception as e:
+                print('Failed to reconcile credits of API key {0}: {1}'.format(api_key.name, e))
+                continue
+            api_key.budget.reconcile(data_quote.data)
+
+        if self.OUT_OF_ALL_CREDITS is True:
+            # getCryptoPrice() etc. see OUT_OF_ALL_CREDITS and print "Out of mana" for users in Telegram.
+            print('Out of all credits...')
 
     def aws_crypto_info_check(self) -> None:
-        ''' Compares length of CRYPTO_INFO dictionary to a file stored in amazon AWS s3 and updated online file
-            if the local file is larger than online one by REUPLOAD_DIFFERENCE (currently 10).
-            Used as background scheduled task.
+        ''' Uploads a compressed snapshot of CRYPTO_INFO store to amazon AWS s3 once at least REUPLOAD_DIFFERENCE (currently 10)
+            new tokens were added since the last sync and the content differs from what S3 has. Used as background scheduled task.
             NOTE: Using free version of AWS S3 -> limited number of push/pull requests for free. So trying to save some here.
         '''
-        self.SESSION_NUM_SAVED = len(self.CRYPTO_INFO)
-        if self.SESSION_NUM_SAVED >= (self.NUMBER_OF_SAVED_CRYPTO_INFO + self.REUPLOAD_DIFFERENCE):
+        try:
+            self.METADATA_SYNC.push()
+        except Exception as e:
+            print(f'Failed to upload {self.CRYPTO_INFO_S3_NAME} to AWS. {e}')
+
+    def aws_crypto_info_pull(self) -> None:
+        '''Merges token metadata from amazon AWS s3 into CRYPTO_INFO store, if it changed since last sync. Used as background task.'''
+        try:
+            self.METADATA_SYNC.pull()
+        except Exception as e:
+            print(f'Failed to download {self.CRYPTO_INFO_S3_NAME} from AWS. {e}')
+
+    def prefetch_interval_minutes(self) -> int:
+        ''' Minutes between quote_prefetch() runs: PREFETCH_INTERVAL_MINUTES, or longer if that many runs a day would cost more
+            than PREFETCH_DAILY_CREDITS -> the budget lasts the whole day. Defaults: 200 tokens = 2 credits a run -> every 29 minutes.
+        '''
+        credits_per_run = ceil(self.PREFETCH_TOP_N / self.PREFETCH_BATCH_SIZE) * ceil(self.PREFETCH_BATCH_SIZE / 100)
+        return max(self.PREFETCH_INTERVAL_MINUTES, ceil(24 * 60 * credits_per_run / max(1, self.PREFETCH_DAILY_CREDITS)))
+
+    def quote_prefetch(self) -> None:
+        ''' Pulls USD quotes for the PREFETCH_TOP_N most wanted tokens in batched requests and puts them into the quote cache,
+            so the common case is answered from memory. "Most wanted" = most requested since the last two runs, then highest CMC rank.
+            Used as background scheduled task. Skips the run if it would go over PREFETCH_DAILY_CREDITS.
+        '''
+        if self.OUT_OF_ALL_CREDITS is True:
+            return
+        self.roll_daily_credits()
+
+        recent, self.REQUEST_COUNTS = self.REQUEST_COUNTS, Counter()
+        popularity = recent + Counter({key: count // 2 for key, count in self.PREVIOUS_REQUEST_COUNTS.items()})
+        self.PREVIOUS_REQUEST_COUNTS = recent
+        ids = [key for key, _ in popularity.most_common() if isinstance(key, int)][:self.PREFETCH_TOP_N]
+        for cmc_id in self.MAPS.top_ranked_ids:
+            if len(ids) >= self.PREFETCH_TOP_N:
+                break
+            if cmc_id not in popularity:
+                ids.append(cmc_id)
+
+        batches = [ids[i:i + self.PREFETCH_BATCH_SIZE] for i in range(0, len(ids), self.PREFETCH_BATCH_SIZE)]
+        for batch in batches:
+            batch_cost = ceil(len(batch) / 100)
+            if self.PREFETCH_CREDITS_USED + batch_cost > self.PREFETCH_DAILY_CREDITS:
+                if self.PREFETCH_BUDGET_REACHED is False:
+                    self.PREFETCH_BUDGET_REACHED = True
+                    print('Quote prefetch reached its daily budget of {} credits.'.format(self.PREFETCH_DAILY_CREDITS))
+                return
+            try:
+                data_quote = self._request('cryptocurrency_quotes_latest', id=','.join(map(str, batch)), convert='USD')
+            except CoinMarketCapAPIError as e:
+                print('Quote prefetch failed: {}'.format(e))
+                return
+            self.PREFETCH_CREDITS_USED += data_quote.status.get('credit_count') or batch_cost
+            self.QUOTE_CACHE.put_many([((cmc_id, 'USD'), data_quote.data[str(cmc_id)]) for cmc_id in batch
+                                       if data_quote.data.get(str(cmc_id)) is not None])
+
+    def roll_daily_credits(self) -> None:
+        '''Resets credits spent by background jobs when a new UTC day starts (CMC daily credits reset at UTC midnight).'''
+        today = datetime.datetime.utcnow().date()
+        if today != self.CREDITS_DAY:
+            self.CREDITS_DAY, self.PREFETCH_CREDITS_USED, self.METADATA_CREDITS_USED = today, 0, 0
+            self.PREFETCH_BUDGET_REACHED = False
+
+    def metadata_warm_up(self) -> None:
+        ''' Fills CRYPTO_INFO store with metadata of tokens it doesn't have yet, in batched cryptocurrency/info requests by CMC id.
+            Tokens users asked for come first (most recent first), then all others by CMC rank. Used as background scheduled task.
+            Stops when the run would go over METADATA_DAILY_CREDITS.
+        '''
+        maps = self.MAPS
+        if self.OUT_OF_ALL_CREDITS is True or maps.crypto_entries is None:
+            return
+        self.roll_daily_credits()
+        index = maps.symbol_index
+        stored = set(self.CRYPTO_INFO.symbols())
+        shared_wanted = []
+        if self.STORE is not None:
             try:
-                with open(os.path.join(self.CRYPTO_INFO_PICKLE_PATH), "wb") as f:
-                    pickle.dump(self.CRYPTO_INFO, f)
-                    print('Updated existing crypto_info pickle (total {0} tokens).'.format(len(self.CRYPTO_INFO)))
-            except Exception as e:
-                print('PICKLE ERROR DURING AWS CHECK: {}'.format(e))
+                shared_wanted = [symbol.decode('utf-8') for symbol in self.STORE.pop_all(self.SHARED_WANTED_KEY)]
+            except StoreError as e:
+                print(e)
+        with self._metadata_lock:
+            for symbol in shared_wanted:
+                self.METADATA_WANTED[symbol] = None
+                self.METADATA_WANTED.move_to_end(symbol)
+            wanted = list(reversed(self.METADATA_WANTED))
+        ranked = sorted(maps.crypto_entries, key=lambda entry: (entry.rank is None, entry.rank or 0))
+        ids, picked = [], {}  # picked: CMC id -> symbol
+        done = set()  # Symbols that need no more fetching: stored now, or unknown to the map
+        for symbol in wanted + [entry.symbol for entry in ranked]:
+            if len(ids) >= self.METADATA_BATCH_SIZE * self.METADATA_BATCHES_PER_RUN:
+                break
+            if symbol in stored or symbol in done:
+                continue
+            entry = index.lookup(symbol)  # Best ranked token with this ticker -> same one a quote shows
+            if entry is None or entry.id is None or entry.id in picked:
+                done.add(symbol)
+                continue
+            picked[entry.id] = symbol
+            ids.append(entry.id)
+
+        for i in range(0, len(ids), self.METADATA_BATCH_SIZE):
+            batch = ids[i:i + self.METADATA_BATCH_SIZE]
+            batch_cost = ceil(len(batch) / 100)
+            if self.METADATA_CREDITS_USED + batch_cost > self.METADATA_DAILY_CREDITS:
+                print('Metadata warm-up reached its daily budget of {} credits.'.format(self.METADATA_DAILY_CREDITS))
+                break
             try:
-                self.AWS.upload_file(self.CRYPTO_INFO_PICKLE_NAME, self.CRYPTO_INFO_PICKLE_PATH)
-                print('Uploaded {} to AWS successfully'.format(self.CRYPTO_INFO_PICKLE_NAME))
-            except Exception as e:
-                print(f'Failed to upload pickle to AWS or load file frm pickle.{e}')
+                c_info = self._request('cryptocurrency_info', id=','.join(map(str, batch)))
+            except CoinMarketCapAPIError as e:
+                print('Metadata warm-up failed: {}'.format(e))
+                break
+            self.METADATA_CREDITS_USED += c_info.status.get('credit_count') or batch_cost
+            added = self.CRYPTO_INFO.put_many({item['symbol']: item for item in c_info.data.values()})
+            done.update(picked[cmc_id] for cmc_id in batch)  # Also tokens CMC had no info for -> not asked again every run
+            print('Metadata warm-up stored {0} new token(s), {1} in total.'.format(added, len(self.CRYPTO_INFO)))
+        with self._metadata_lock:
+            for symbol in done:
+                self.METADATA_WANTED.pop(symbol, None)
+
+    def fiat_rates_refresh(self) -> None:
+        '''Refreshes USD -> fiat rates of currencies requested during the last FIAT_RATES_ACTIVE_HOURS. Used as background scheduled task.'''
+        if self.OUT_OF_ALL_CREDITS is True:
+            return
+        currencies = self.FIAT_RATES.active_currencies(self.FIAT_RATES_ACTIVE_HOURS * 3600)
+        if len(currencies) > 0:
+            self.FIAT_RATES.refresh(currencies)
 
     def round_nonzero(self, number: Union[int, float], digits_to_keep: int = 4) -> str:
         ''' A utility function to round numbers to first NON-ZERO digits. Returns a string.
             Example: 0.00005412323132 -> 0.000054
         '''
-        assert isinstance(number, (float, int)), 'Argument "number" must be of type "float" or "int". You provided: "{}"'.format(type(number))
-        if number == 0:
-            return number
-        number = float(number)
-        if number < 0:
-            negative_number = True
-        else:
-            negative_number = False
-        n = abs(number)
-        if n < 1:
-            # Find the first non-zero digit.
-            # We want 3 digits, starting at that location.
-            s = f'{n:.99f}'
-            index = re.search('[1-9]', s).start()
-            result = s[:index + digits_to_keep]
-            if negative_number is True:
-                return str(-(float(result)))  # Converting number back to negative
-            else:
-                return result
-        else:
-            # We want 2 digits after decimal point.
-            result = str(round(n, digits_to_keep))
-            if negative_number is True:
-                return str(-(float(result)))  # Converting number back to negative
-            else:
-                return result
+        return round_nonzero(number, digits_to_keep)
+
+    def save_map_pickle(self, pickle_file_name: str, data: list) -> None:
+        '''Saves a map to a .pickle file next to this script, for load_symbols_from_pickle() to load on next start.'''
+        if '.pickle' not in pickle_file_name:  # if file name provided contains no extension -> add it.
+            pickle_file_name += '.pickle'
+        try:
+            with open(os.path.join(self.DIR_PATH, pickle_file_name), "wb") as f:
+                pickle.dump(data, f)
+        except Exception as e:
+            print('PICKLE ERROR: {}'.format(e))
 
     def load_symbols_from_pickle(self, pickle_file_name: str, expiration_hours: int = 24) -> list or None:
         ''' A utility function to load .pickle files. Has optional argument "expiration_hours". if file is older than this var -> return None.
@@ -561,7 +1160,7 @@ class CMCPrices(object):
 if __name__ == '__main__':
     try:
         CP = CMCPrices()
-        crypto_info = CP.get_crypto_info(['TRX'], save_pickle=True)
+        crypto_info = CP.get_crypto_info(['TRX'], save=True)
         from pprint import pprint
         pprint(crypto_info)
     except KeyboardInterrupt:
@@ -0,0 +1,326 @@
+import time
+import datetime
+import threading
+
+from coinmarketcapapi import CoinMarketCapAPIError  # 3rd party 1:1 wrapper to CoinMarketCap API
+
+from shared_store import StoreError  # SharedKeyBudget falls back to local buckets when the store is down
+
+
+class TokenBucket(object):
+    '''Continuously refilling bucket: holds up to "capacity" tokens, refilled evenly over "period" seconds.'''
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, amount: float = 1) -> float:
+        '''Seconds until "amount" tokens are available.'''
+        missing = amount - self.available()
+        return max(0.0, missing * self.period / self.capacity)
+
+    def consume(self, amount: float = 1) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def drain(self) -> None:
+        self._refill()
+        self.tokens = min(self.tokens, 0)
+
+    def set_capacity(self, capacity: float) -> None:
+        self._refill()
+        self.tokens = min(self.tokens, capacity)
+        self.capacity = capacity
+
+
+class CalendarBucket(object):
+    ''' Credit allowance for a fixed calendar window that refills completely when a new UTC day or month starts.
+        That's how CMC counts daily and monthly credits, so it is a bucket with a single refill per window.
+    '''
+
+    def __init__(self, capacity: float, period: str = 'day'):
+        assert period in ('day', 'month'), 'Argument "period" must be "day" or "month". You provided: "{}"'.format(period)
+        self.capacity = capacity
+        self.period = period
+        self.used = 0
+        self.window = self._current_window()
+
+    def _current_window(self) -> tuple:
+        now = datetime.datetime.utcnow()
+        return (now.year, now.month, now.day) if self.period == 'day' else (now.year, now.month)
+
+    def _roll(self) -> None:
+        window = self._current_window()
+        if window != self.window:
+            self.window, self.used = window, 0
+
+    def available(self) -> float:
+        self._roll()
+        return self.capacity - self.used
+
+    def consume(self, amount: float) -> None:
+        self._roll()
+        self.used += amount
+
+    def drain(self) -> None:
+        self._roll()
+        self.used = max(self.used, self.capacity)
+
+    def reconcile(self, used: float, capacity: float) -> None:
+        self._roll()
+        self.used, self.capacity = used, capacity
+
+
+class OutOfCreditsError(CoinMarketCapAPIError):
+    ''' Raised when CMC API call is refused locally because the key has no credits left for it.
+        Subclass of CoinMarketCapAPIError, so callers handle it like any other failed CMC request.
+    '''
+
+    def __init__(self, message: str):
+        Exception.__init__(self, message)
+        self.rep = None
+
+
+class KeyBudget(object):
+    ''' Live credit accounting for one CMC API key, so calls are admitted or refused on current numbers instead of a key_info snapshot.
+            minute -> TokenBucket of requests (CMC rate limits calls per minute, not credits).
+            day/month -> CalendarBucket of credits.
+        Every call is admitted with an estimated cost, then settled with the credit count CMC reports in the response status.
+        reconcile() overwrites local numbers with the truth from key_info endpoint from time to time.
+        "reserve" is a share of day/month credits that is never spent (same as the old 0.99 thresholds).
+    '''
+    # CMC error codes that say one of the limits is used up -> matching bucket is drained right away.
+    MINUTE_LIMIT_ERRORS = (1008, 1011)
+    DAILY_LIMIT_ERROR = 1009
+    MONTHLY_LIMIT_ERROR = 1010
+
+    def __init__(self, minute_limit: int = 30, daily_limit: int = 333, monthly_limit: int = 10000, reserve: float = 0.01):
+        self.reserve = reserve
+        self.minute = TokenBucket(minute_limit, 60)
+        self.day = CalendarBucket(daily_limit, 'day')
+        self.month = CalendarBucket(monthly_limit, 'month')
+        self.credits_used = 0  # Total since start. For stats only.
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def _credits_left(self) -> float:
+        return min(self.day.available() - self.day.capacity * self.reserve,
+                   self.month.available() - self.month.capacity * self.reserve)
+
+    def admit(self, credits: float = 1, max_wait: float = 0) -> None:
+        ''' Takes one request from minute bucket and reserves "credits" from day/month buckets.
+            Waits up to "max_wait" seconds for the minute bucket to refill (queueing). Raises OutOfCreditsError otherwise.
+        '''
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                if self._credits_left() < credits:
+                    self.refused += 1
+                    raise OutOfCreditsError('Daily or monthly credit limit reached')
+                wait = self.minute.wait_time(1)
+                if wait == 0:
+                    self.minute.consume(1)
+                    self.day.consume(credits)
+                    self.month.consume(credits)
+                    return
+            if time.monotonic() + wait > deadline:
+                with self._lock:
+                    self.refused += 1
+                raise OutOfCreditsError('Per minute request limit reached')
+            time.sleep(wait)
+
+    def minute_wait(self) -> float:
+        '''Seconds until per minute limit allows one more request.'''
+        with self._lock:
+            return self.minute.wait_time(1)
+
+    def settle(self, reserved: float, actual: float or None) -> None:
+        '''Corrects a reservation made in admit() with the credit count CMC reported. "actual" None -> keep the estimate.'''
+        if actual is None:
+            actual = reserved
+        with self._lock:
+            self.day.consume(actual - reserved)
+            self.month.consume(actual - reserved)
+            self.credits_used += actual
+
+    def on_error_code(self, error_code) -> None:
+        '''Drains the bucket matching CMC rate limit error, so no more calls go out until it refills.'''
+        with self._lock:
+            if error_code in self.MINUTE_LIMIT_ERRORS:
+                self.minute.drain()
+            elif error_code == self.DAILY_LIMIT_ERROR:
+                self.day.drain()
+            elif error_code == self.MONTHLY_LIMIT_ERROR:
+                self.month.drain()
+
+    def reconcile(self, key_info: dict) -> None:
+        '''Replaces local numbers with "data" part of CMC key_info response.'''
+        plan, usage = key_info['plan'], key_info['usage']
+        with self._lock:
+            self.minute.set_capacity(plan.get('rate_limit_minute') or self.minute.capacity)
+            self.minute.tokens = min(self.minute.tokens, usage['current_minute']['requests_left'])
+            self.day.reconcile(usage['current_day']['credits_used'], plan.get('credit_limit_daily') or self.day.capacity)
+            self.month.reconcile(usage['current_month']['credits_used'], plan.get('credit_limit_monthly') or self.month.capacity)
+
+    def exhausted(self) -> bool:
+        '''True if day or month credits are used up. Minute limit alone never counts as exhausted.'''
+        with self._lock:
+            return self._credits_left() < 1
+
+    def remaining(self) -> dict:
+        with self._lock:
+            return {
+                'minute': int(self.minute.available()),
+                'day': int(self.day.available()),
+                'month': int(self.month.available()),
+                'credits_left': int(self._credits_left()),
+            }
+
+
+class SharedKeyBudget(KeyBudget):
+    ''' KeyBudget whose numbers live in a SharedStore -> several bot processes spend one set of limits instead of one each.
+            minute -> requests made in the current clock minute (CMC counts per minute, so a counter per minute is close enough).
+            day/month -> credits used in the current UTC day / month.
+        admit() is exact: counters are incremented first and rolled back if that went over a limit.
+        exhausted() and remaining() read a snapshot, re-read in a store thread once it is SNAPSHOT_SECONDS old -> quote lookups
+        checking OUT_OF_ALL_CREDITS (also on the asyncio loop) never wait on the store. admit(), settle() and minute_wait() are
+        round trips: asyncio code calls them through shared_store.off_loop(). If the store is unreachable, the local buckets
+        of KeyBudget take over.
+    '''
+    SNAPSHOT_SECONDS = 1
+
+    def __init__(self, store, name: str, minute_limit: int = 30, daily_limit: int = 333, monthly_limit: int = 10000,
+                 reserve: float = 0.01):
+        super().__init__(minute_limit, daily_limit, monthly_limit, reserve)  # Capacities, and the fallback when store is down
+        self.store = store
+        self.name = name
+        self._used = (0, 0, 0)  # (minute requests, day credits, month credits) as last seen in the store
+        self._read_at = 0.0
+        self._reading = False  # Snapshot re-read in progress
+
+    def _counters(self) -> tuple:
+        '''Store keys and expiry (seconds) of current minute, day and month counters.'''
+        now = datetime.datetime.utcnow()
+        prefix = 'credits:{}:'.format(self.name)
+        return ((prefix + now.strftime('minute:%Y%m%d%H%M'), 120),
+                (prefix + now.strftime('day:%Y%m%d'), 2 * 86400),
+                (prefix + now.strftime('month:%Y%m'), 32 * 86400))
+
+    def _limits(self) -> tuple:
+        return (self.minute.capacity, self.day.capacity * (1 - self.reserve), self.month.capacity * (1 - self.reserve))
+
+    def _seen(self, used: list) -> None:
+        self._used, self._read_at = tuple(used), time.monotonic()
+
+    def _read(self) -> tuple:
+        '''Counters as last seen. An old snapshot is returned as it is and re-read in background.'''
+        if time.monotonic() - self._read_at > self.SNAPSHOT_SECONDS and self._reading is False:
+            self._reading = True
+            self.store.submit(self._reread)
+        return self._used
+
+    def _reread(self) -> tuple:
+        try:
+            self._seen([int(value or 0) for value in self.store.mget([key for key, _ in self._counters()])])
+        except StoreError as e:
+            print(e)
+            self._read_at = time.monotonic()  # Try again after SNAPSHOT_SECONDS, don't wait for a timeout on every call
+        finally:
+            self._reading = False
+        return self._used
+
+    def admit(self, credits: float = 1, max_wait: float = 0) -> None:
+        deadline = time.monotonic() + max_wait
+        while True:
+            counters = self._counters()
+            amounts = (1, credits, credits)
+            try:
+                used = self.store.incrby_many([(key, amount, ttl) for (key, ttl), amount in zip(counters, amounts)])
+                over = [used_now > limit for used_now, limit in zip(used, self._limits())]
+                if any(over):
+                    self.store.incrby_many([(key, -amount, ttl) for (key, ttl), amount in zip(counters, amounts)])
+                    used = [used_now - amount for used_now, amount in zip(used, amounts)]
+                self._seen(used)
+            except StoreError as e:
+                print(e)
+                return super().admit(credits, max_wait)
+            if not any(over):
+                return
+            if over[1] or over[2]:
+                with self._lock:
+                    self.refused += 1
+                raise OutOfCreditsError('Daily or monthly credit limit reached')
+            wait = self._minute_left()
+            if time.monotonic() + wait > deadline:
+                with self._lock:
+                    self.refused += 1
+                raise OutOfCreditsError('Per minute request limit reached')
+            time.sleep(wait)
+
+    @staticmethod
+    def _minute_left() -> float:
+        now = datetime.datetime.utcnow()
+        return 60 - now.second - now.microsecond / 1e6
+
+    def minute_wait(self) -> float:
+        # Asked right after a refusal -> look at the store, not at the snapshot
+        return self._minute_left() if self._reread()[0] >= self.minute.capacity else 0.0
+
+    def settle(self, reserved: float, actual: float or None) -> None:
+        if actual is None:
+            actual = reserved
+        with self._lock:
+            self.credits_used += actual
+        if actual != reserved:
+            try:
+                self.store.incrby_many([(key, actual - reserved, ttl) for key, ttl in self._counters()[1:]])
+            except StoreError as e:
+                print(e)
+
+    def _set_used(self, used: dict) -> None:
+        '''Overwrites shared counters: {0: minute requests, 1: day credits, 2: month credits}.'''
+        counters = self._counters()
+        try:
+            self.store.set_many([(counters[i][0], str(int(value)).encode('ascii')) for i, value in used.items()], ttl=counters[2][1])
+        except StoreError as e:
+            print(e)
+        self._read_at = 0.0
+
+    def on_error_code(self, error_code) -> None:
+        super().on_error_code(error_code)
+        if error_code in self.MINUTE_LIMIT_ERRORS:
+            self._set_used({0: self.minute.capacity})
+        elif error_code == self.DAILY_LIMIT_ERROR:
+            self._set_used({1: self.day.capacity})
+        elif error_code == self.MONTHLY_LIMIT_ERROR:
+            self._set_used({2: self.month.capacity})
+
+    def reconcile(self, key_info: dict) -> None:
+        super().reconcile(key_info)  # Capacities from the plan
+        usage = key_info['usage']
+        self._set_used({0: self.minute.capacity - usage['current_minute']['requests_left'],
+                        1: usage['current_day']['credits_used'], 2: usage['current_month']['credits_used']})
+
+    def exhausted(self) -> bool:
+        _, day, month = self._read()
+        return min(self.day.capacity * (1 - self.reserve) - day, self.month.capacity * (1 - self.reserve) - month) < 1
+
+    def remaining(self) -> dict:
+        minute, day, month = self._read()
+        return {
+            'minute': int(self.minute.capacity - minute),
+            'day': int(self.day.capacity - day),
+            'month': int(self.month.capacity - month),
+            'credits_left': int(min(self.day.capacity * (1 - self.reserve) - day, self.month.capacity * (1 - self.reserve) - month)),
+        }
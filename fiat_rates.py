@@ -0,0 +1,116 @@
+import time
+import pickle
+import threading
+
+from shared_store import StoreError  # Store outage -> rates are fetched by this process alone
+
+
+class FiatRates(object):
+    ''' Table of fiat exchange rates against USD, used to convert USD quotes into any fiat currency locally.
+        One rate per currency serves every token -> "ETH EUR", "BTC EUR" and "SOL EUR" need one USD quote each plus one EUR rate,
+        instead of a separate CMC request (and cache entry) per token and currency.
+        "fetch_rates" is called with a list of currency symbols and returns ({currency: units per 1 USD}, error).
+        Rates older than "max_age" seconds are not used. A currency that could not be fetched is not retried for "retry_after" seconds.
+        With "shared" (SharedStore of several bot processes) fetched rates are shared, so a rate costs one credit for all of them.
+    '''
+
+    def __init__(self, fetch_rates, max_age: float = 3600, retry_after: float = 300, shared=None):
+        self.fetch_rates = fetch_rates
+        self.MAX_AGE = max_age
+        self.RETRY_AFTER = retry_after
+        self.SHARED = shared
+        self._rates = {'USD': (float('inf'), 1.0)}  # currency -> (timestamp, rate). USD never expires.
+        self._failed = {}  # currency -> timestamp of last failed fetch
+        self._last_requested = {}  # currency -> timestamp. Currencies users actually ask for get refreshed in background.
+        self._lock = threading.Lock()
+
+    def cached_rate(self, currency: str) -> float or None:
+        '''Returns units of "currency" per 1 USD if a fresh rate is known. Never fetches.'''
+        now = time.monotonic()
+        self._last_requested[currency] = now
+        cached = self._rates.get(currency)
+        if cached is not None and now - cached[0] < self.MAX_AGE:
+            return cached[1]
+        return None
+
+    def rate(self, currency: str) -> float or None:
+        '''Returns units of "currency" per 1 USD. Fetches the rate on demand if missing or older than MAX_AGE. None if unavailable.'''
+        cached_rate = self.cached_rate(currency)
+        if cached_rate is not None:
+            return cached_rate
+        now = time.monotonic()
+        if now - self._failed.get(currency, -self.RETRY_AFTER) < self.RETRY_AFTER:
+            return None
+        shared_rate = self._shared_rate(currency)
+        if shared_rate is not None:
+            return shared_rate
+        self.refresh([currency])
+        cached = self._rates.get(currency)
+        if cached is not None and time.monotonic() - cached[0] < self.MAX_AGE:
+            return cached[1]
+        return None
+
+    def refresh(self, currencies: list) -> None:
+        '''Fetches and stores rates for given currencies.'''
+        currencies = [currency for currency in currencies if currency != 'USD']
+        if len(currencies) == 0:
+            return
+        rates, error = self.fetch_rates(currencies)
+        now = time.monotonic()
+        with self._lock:
+            for currency in currencies:
+                if rates is not None and rates.get(currency):
+                    self._rates[currency] = (now, rates[currency])
+                    self._failed.pop(currency, None)
+                else:
+                    self._failed[currency] = now
+        if rates is None:
+            print('Failed to fetch fiat rates for {0}: {1}'.format(currencies, error))
+        elif self.SHARED is not None:
+            stored_at = time.time()
+            try:
+                self.SHARED.set_many([('fiat_rate:' + currency, pickle.dumps((stored_at, rates[currency])))
+                                      for currency in currencies if rates.get(currency)], ttl=self.MAX_AGE)
+            except StoreError as e:
+                print(e)
+
+    def _shared_rate(self, currency: str) -> float or None:
+        '''Rate another process fetched, if fresh. Kept locally with its real age.'''
+        if self.SHARED is None:
+            return None
+        try:
+            data = self.SHARED.get('fiat_rate:' + currency)
+        except StoreError as e:
+            print(e)
+            return None
+        if data is None:
+            return None
+        stored_at, rate = pickle.loads(data)
+        age = time.time() - stored_at
+        if age >= self.MAX_AGE:
+            return None
+        with self._lock:
+            self._rates[currency] = (time.monotonic() - age, rate)
+        return rate
+
+    def active_currencies(self, within_seconds: float) -> list:
+        '''Currencies that users requested during the last "within_seconds".'''
+        now = time.monotonic()
+        return [currency for currency, requested in list(self._last_requested.items()) if now - requested < within_seconds]
+
+    def __len__(self) -> int:
+        return len(self._rates)
+
+
+def convert_quote(token_quote: dict, currency: str, rate: float, source_currency: str = 'USD') -> dict:
+    ''' Returns a copy of CMC token quote (one item of quotes/latest "data") with its "source_currency" quote converted into "currency".
+        Prices, market cap and volume scale with the rate. Percent changes and timestamps stay as they are.
+    '''
+    source = token_quote['quote'][source_currency]
+    converted = dict(source)
+    for field in ('price', 'market_cap', 'volume_24h', 'fully_diluted_market_cap'):
+        if source.get(field) is not None:
+            converted[field] = source[field] * rate
+    result = dict(token_quote)
+    result['quote'] = {currency: converted}
+    return result
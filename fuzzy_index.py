@@ -0,0 +1,144 @@
+import re
+from array import array  # Compact int storage for trigram posting lists
+from bisect import bisect_left
+from collections import Counter  # Counting shared trigrams per key runs in C
+
+from symbol_index import UNRANKED  # Rank given to tokens CMC has not ranked
+
+
+def normalize(text: str) -> str:
+    '''"Shiba Inu", "shiba-inu" and "SHIBA INU" all become "shibainu" -> names, slugs and what users type compare equal.'''
+    return re.sub(r'[\W_]+', '', text.casefold())
+
+
+def trigrams(key: str) -> set:
+    padded = '^' + key + '$'  # Start and end markers -> first and last letters count as much as the middle ones
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    ''' Damerau-Levenshtein distance (optimal string alignment: swapping two neighbouring letters is one edit), bounded:
+        returns max_distance + 1 for anything further apart. Only cells within max_distance of the diagonal are computed,
+        paths leaving that band cost more than max_distance anyway.
+    '''
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+    previous2, previous = None, [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [too_far] * (len(b) + 1)
+        current[0] = row_min = i if i <= max_distance else too_far
+        a_i = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len(b), i + max_distance) + 1):
+            value = previous[j - 1] + (a_i != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and a_i == b[j - 2] and a[i - 2] == b[j - 1] and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous2, previous = previous, current
+    return min(previous[-1], too_far)
+
+
+class FuzzyIndex(object):
+    ''' Resolves misspelled symbols and full names ("bitcion", "ethereum", "shiba inu") to crypto map entries.
+        Keys are symbols, names and slugs of all tokens, normalized to letters and digits. Candidates are keys sharing trigrams
+        with the query, only among keys whose length is within the allowed number of edits. Trigrams are read rarest first, the
+        common ones ("coi", "ken", shared by thousands of keys) only while POSTINGS_BUDGET allows. The MAX_VERIFIED candidates
+        sharing most trigrams are then checked with real edit distance.
+        Allowed edits grow with length: none up to 3 characters (too many real tickers are one letter apart), 1 up to 7, 2 above.
+        Built once when the map is loaded, answers from memory only.
+        Example:
+            index = FuzzyIndex(crypto_entries)
+            index.exact('Ethereum')   -> CryptoEntry(id=1027, symbol='ETH', name='Ethereum', ...)
+            index.search('bitcion')   -> [(CryptoEntry(id=1, symbol='BTC', name='Bitcoin', ...), 1), ...]
+    '''
+    __slots__ = ('_entries', '_keys', '_key_ids', '_key_positions', '_length_starts', '_postings')
+    MAX_VERIFIED = 32  # Candidates checked with edit distance per search. Real matches share most trigrams -> are among the first.
+    POSTINGS_BUDGET = 1000  # Keys read from trigram posting lists per search. The rarest trigram is always read.
+
+    def __init__(self, crypto_entries: list = None):
+        # Position in this tuple is the rank order -> comparing positions compares ranks.
+        self._entries = tuple(sorted(crypto_entries or (), key=lambda entry: entry.rank if entry.rank is not None else UNRANKED))
+        key_positions = {}  # normalized key -> positions of entries having it, best ranked first
+        for position, entry in enumerate(self._entries):
+            for text in (entry.symbol, entry.name, entry.slug):
+                key = normalize(text or '')
+                if key and position not in key_positions.setdefault(key, []):
+                    key_positions[key].append(position)
+        # Key ids are given in order of key length -> keys of one length range are one id range in every posting list.
+        self._keys = sorted(key_positions, key=len)
+        self._key_ids = {key: key_id for key_id, key in enumerate(self._keys)}
+        self._key_positions = [tuple(key_positions[key]) for key in self._keys]
+        self._length_starts = array('i', [0])  # [n] = id of the first key with length >= n
+        for key_id, key in enumerate(self._keys):
+            while len(self._length_starts) <= len(key):
+                self._length_starts.append(key_id)
+        self._length_starts.append(len(self._keys))
+        postings = {}  # trigram -> ids of keys having it, ascending
+        for key_id, key in enumerate(self._keys):
+            for gram in trigrams(key):
+                postings.setdefault(gram, array('i')).append(key_id)
+        self._postings = postings
+
+    def _first_key_id(self, length: int) -> int:
+        return self._length_starts[min(max(length, 0), len(self._length_starts) - 1)]
+
+    @staticmethod
+    def max_edits(key: str) -> int:
+        return 0 if len(key) <= 3 else 1 if len(key) <= 7 else 2
+
+    def exact(self, text: str):
+        '''Best ranked entry whose symbol, name or slug equals "text" after normalization, None if there is none.'''
+        key_id = self._key_ids.get(normalize(text))
+        return self._entries[self._key_positions[key_id][0]] if key_id is not None else None
+
+    def search(self, text: str, limit: int = 5) -> list:
+        ''' Entries whose symbol, name or slug is within max_edits() of "text". Returns up to "limit" (entry, distance) pairs,
+            closest first, then by CMC rank. Each entry appears once, with its closest key.
+        '''
+        query = normalize(text)
+        if not query:
+            return []
+        exact = self._key_ids.get(query)
+        if exact is not None:  # Full name or slug typed right -> nothing to guess
+            return [(self._entries[position], 0) for position in self._key_positions[exact][:limit]]
+        max_distance = self.max_edits(query)
+        if max_distance == 0:
+            return []
+        # Only keys within max_distance of the query length can be within max_distance edits
+        first_id, end_id = self._first_key_id(len(query) - max_distance), self._first_key_id(len(query) + max_distance + 1)
+        grams = []  # (posting list slice of keys with a fitting length) per query trigram
+        for gram in trigrams(query):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                grams.append(posting[bisect_left(posting, first_id):bisect_left(posting, end_id)])
+        grams.sort(key=len)
+        shared = Counter()
+        read = 0
+        for n, posting in enumerate(grams):
+            if n > 0 and read + len(posting) > self.POSTINGS_BUDGET:
+                break  # Common trigrams hardly tell candidates apart anyway
+            shared.update(posting)
+            read += len(posting)
+
+        found = {}  # entry position -> distance
+        for key_id, _ in shared.most_common(self.MAX_VERIFIED):
+            key = self._keys[key_id]
+            distance = edit_distance(query, key, max_distance)
+            if distance > max_distance:
+                continue
+            for position in self._key_positions[key_id]:
+                if distance < found.get(position, max_distance + 1):
+                    found[position] = distance
+        best = sorted(found.items(), key=lambda item: (item[1], item[0]))[:limit]
+        return [(self._entries[position], distance) for position, distance in best]
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -0,0 +1,132 @@
+import time
+import threading
+
+from credit_budget import KeyBudget, OutOfCreditsError  # Live per-key credit accounting
+
+
+class ApiKey(object):
+    '''One CMC API key with its own credit budget.'''
+    __slots__ = ('name', 'key', 'budget', 'quarantined_until', 'quarantine_reason', 'calls', 'errors')
+
+    def __init__(self, name: str, key: str, budget: KeyBudget):
+        self.name = name
+        self.key = key
+        self.budget = budget
+        self.quarantined_until = 0.0  # time.monotonic() value. float('inf') -> until restart.
+        self.quarantine_reason = None
+        self.calls = 0
+        self.errors = 0
+
+    def quarantined(self, now: float = None) -> bool:
+        return (time.monotonic() if now is None else now) < self.quarantined_until
+
+
+class KeyPool(object):
+    ''' Pool of any number of CMC API keys. Every call is routed to the key with most credits left, so load is spread evenly
+        and no key is drained while others sit idle. Keys that return key/limit errors are quarantined for a while:
+            1001, 1002 (invalid / missing key)     -> until restart
+            1008, 1011 (minute / IP rate limit)    -> MINUTE_QUARANTINE seconds
+            1009, 1010 (daily / monthly limit)     -> budget of the key is drained, so it's skipped until its window resets
+        Thread-safe: usable keys are picked under a lock, credits are admitted by the (thread-safe) budgets outside it.
+        Nothing is stored on the class.
+        Example:
+            pool = KeyPool.from_config(API_PROFILES, lambda name: KeyBudget())
+            api_key = pool.acquire(credits=1)
+            response = await client.request('cryptocurrency_quotes_latest', api_key.key, symbol='BTC')
+            pool.release(api_key, reserved=1, actual=response.status.get('credit_count'))
+    '''
+    CONFIG_PREFIX = 'coinmarketcap_api_key'  # configparser lower-cases option names
+    PERMANENT_ERRORS = (1001, 1002)
+    MINUTE_ERRORS = (1008, 1011)
+    MINUTE_QUARANTINE = 60  # seconds
+
+    def __init__(self, api_keys: list):
+        assert len(api_keys) > 0, 'At least one CoinMarketCap API key is required'
+        self.API_KEYS = api_keys
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, api_profiles, make_budget) -> 'KeyPool':
+        ''' Reads every COINMARKETCAP_API_KEY, COINMARKETCAP_API_KEY_2, COINMARKETCAP_API_KEY_<anything> entry from config.
+            Entries set to "None" (or empty) are skipped. "make_budget(name)" creates the budget of each key.
+        '''
+        api_keys = []
+        for name in sorted(api_profiles, key=lambda name: (len(name), name)):
+            if not name.lower().startswith(cls.CONFIG_PREFIX):
+                continue
+            key = api_profiles[name].strip()
+            if key in ('', 'None'):
+                continue
+            api_keys.append(ApiKey(name.upper(), key, make_budget(name.upper())))
+        return cls(api_keys)
+
+    def _usable(self, now: float) -> list:
+        usable = [api_key for api_key in self.API_KEYS if not api_key.quarantined(now) and not api_key.budget.exhausted()]
+        return sorted(usable, key=lambda api_key: api_key.budget.remaining()['credits_left'], reverse=True)
+
+    def acquire(self, credits: float = 1) -> ApiKey:
+        ''' Returns the usable key with most credits left, with "credits" already reserved on its budget.
+            Never waits: raises OutOfCreditsError if no key can take the call right now. Callers that want to queue for the per
+            minute limit wait minute_wait() seconds (with asyncio.sleep) and try again.
+        '''
+        with self._lock:
+            usable = self._usable(time.monotonic())
+        # Budgets are thread-safe on their own. Admitting outside the lock -> a slow shared store holds up only this call.
+        for api_key in usable:
+            if credits == 0:  # Free calls (key_info) don't count towards limits
+                return api_key
+            try:
+                api_key.budget.admit(credits)
+                return api_key
+            except OutOfCreditsError:
+                continue
+        if len(usable) == 0:
+            raise OutOfCreditsError('All API keys are out of credits or quarantined')
+        raise OutOfCreditsError('Per minute request limit reached on all API keys')
+
+    def minute_wait(self) -> float or None:
+        '''Seconds until some usable key may take a request again. None if no key is usable at all (no point in waiting).'''
+        with self._lock:
+            usable = self._usable(time.monotonic())
+        if len(usable) == 0:
+            return None
+        return min(api_key.budget.minute_wait() for api_key in usable)
+
+    def requests_available(self) -> int:
+        '''Requests all usable keys together may make right now without waiting for the per minute limit.'''
+        with self._lock:
+            usable = self._usable(time.monotonic())
+        return sum(api_key.budget.remaining()['minute'] for api_key in usable)
+
+    def release(self, api_key: ApiKey, reserved: float, actual: float or None, error_code=None) -> None:
+        '''Settles credits reserved in acquire() and quarantines the key if CMC answered with a key/limit error.'''
+        api_key.budget.settle(reserved, actual)
+        with self._lock:
+            api_key.calls += 1
+            if error_code is None:
+                return
+            api_key.errors += 1
+            api_key.budget.on_error_code(error_code)
+            if error_code in self.PERMANENT_ERRORS:
+                self._quarantine(api_key, float('inf'), error_code)
+            elif error_code in self.MINUTE_ERRORS:
+                self._quarantine(api_key, time.monotonic() + self.MINUTE_QUARANTINE, error_code)
+
+    def _quarantine(self, api_key: ApiKey, until: float, error_code) -> None:
+        api_key.quarantined_until = max(api_key.quarantined_until, until)
+        api_key.quarantine_reason = error_code
+        print('API key {0} quarantined after CMC error {1}.'.format(api_key.name, error_code))
+
+    def exhausted(self) -> bool:
+        '''True if no key can serve a call right now (all out of credits or quarantined).'''
+        with self._lock:
+            return len(self._usable(time.monotonic())) == 0
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [dict(name=api_key.name, calls=api_key.calls, errors=api_key.errors, quarantined=api_key.quarantined(now),
+                         quarantine_reason=api_key.quarantine_reason, **api_key.budget.remaining()) for api_key in self.API_KEYS]
+
+    def __len__(self) -> int:
+        return len(self.API_KEYS)
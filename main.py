@@ -1,11 +1,24 @@
+import time
+STARTUP_STARTED = time.monotonic()  # Taken before the heavy imports below -> startup times include them.
+
 import os
+import json
+import queue
+import asyncio
 import logging
+import signal
+import threading
+import multiprocessing  # Worker processes of multi-process webhook mode
+from concurrent.futures import Future
 from uuid import uuid4
 
-from telegram import LabeledPrice, ReplyKeyboardMarkup, KeyboardButton, InlineQueryResultArticle, InputTextMessageContent
-from telegram.ext import PreCheckoutQueryHandler, InlineQueryHandler
+from telegram import Chat, LabeledPrice, ReplyKeyboardMarkup, KeyboardButton, InlineQueryResultArticle, InputTextMessageContent
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import PreCheckoutQueryHandler, InlineQueryHandler, CallbackQueryHandler
 from telegram.ext.callbackcontext import CallbackContext
 from telegram.ext.commandhandler import CommandHandler
+from telegram.ext.dispatcher import Dispatcher
 from telegram.ext.filters import Filters
 from telegram.ext.messagehandler import MessageHandler
 from telegram.ext.updater import Updater
@@ -14,20 +27,62 @@ import emoji
 
 from coinmarketcap import CMCPrices
 from config_class import API_PROFILES
+from media_cache import MediaCache
+from send_queue import SendQueue  # Outbound Bot API calls within Telegram flood limits, by priority
+from shared_store import SharedStore, StoreServer  # State shared by bot processes: Redis, or in-repo stand-in
+from update_router import UpdateRouter  # Webhook endpoint handing updates to worker processes
+from profiler import SamplingProfiler  # Stack sampling switched on/off at runtime, see toggle_profiler()
+import tracing  # Per-phase spans of each lookup, slow ones are printed
 
 
 # Bool that controls whether the App will run through Heroku or locally. If False -> runs locally.
 RUN_THROUGH_HEROKU = False
 
+# Webhook mode (RUN_THROUGH_HEROKU) with several processes -> more cores, more throughput. Process 0 receives updates and hands each
+# to a worker process picked by its chat (one chat -> one worker -> updates stay in order), handling its own share too. Quotes, maps,
+# fiat rates and credit counters are shared through a Redis compatible store -> N processes spend the CMC credits of one.
+# Store: REDIS_URL (e.g. Heroku Redis) if set, otherwise an in-repo stand-in (shared_store.StoreServer) started by process 0.
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', '1'))  # 1 -> single process (old behaviour)
+WORKER_INDEX = int(os.environ.get('BOT_WORKER_INDEX', '0'))  # Set by process 0 for the workers it starts. 0 runs background jobs.
+
+# Bool that controls how price lookups run. True -> asyncio pipeline: handler returns right away, lookup waits on CMC without a thread.
+# False -> every lookup occupies a dispatcher worker thread while waiting on CMC (old behaviour).
+USE_ASYNC_PIPELINE = True
+SEND_WORKERS = 8  # Threads of SEND queue making Bot API calls (telegram.Bot calls are blocking).
+
+# Inline mode autocomplete. Telegram sends an inline query on (almost) every keystroke -> candidates come from local data,
+# only the top few get a price, fetched in one batched CMC request and cached.
+INLINE_MAX_RESULTS = 8  # Candidates shown for what was typed so far.
+INLINE_QUOTED_RESULTS = 3  # Best candidates shown with their price. The rest link to their CMC page.
+INLINE_CACHE_TIME = 30  # seconds Telegram may reuse our answer for the same query. CMC updates quotes about once a minute.
+INLINE_HELP_CACHE_TIME = 3600  # seconds. Help answer never changes.
+
+CRYPTO_PAGE_CALLBACK = 'crypto_page:'  # Callback data prefix of /crypto list navigation buttons, followed by page number.
+CRYPTO_PAGE_JUMP = 10  # Pages skipped by the fast forward/back buttons.
+
+# Bool that controls startup. True -> bot takes updates right away while crypto/fiat maps load in background (lookups meanwhile
+# query CMC by symbol). False -> maps are loaded before the bot starts polling (old behaviour).
+LAZY_STARTUP = True
+STARTUP_TIMES = {}  # Startup event -> seconds since process start. Logged and shown by /secret.
+
+# Lookup taking longer than this (update handled -> reply sent) prints its span breakdown: plan, quote, CMC calls, retries, render, send.
+SLOW_REQUEST_SECONDS = 2.0
+# Sampling profiler, off by default. Toggled by /profile (only from chats in ADMIN_CHAT_IDS of config.ini) or `kill -USR1 <pid>`.
+# Stopping it prints the hottest functions and saves folded stacks (flamegraph.pl / speedscope input) to PROFILE_PATH.
+PROFILE_SIGNAL = getattr(signal, 'SIGUSR1', None)  # None on Windows
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profile-{}.folded')  # {} -> time the profile ended
+
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logging.getLogger('apscheduler.executors.default').setLevel(logging.WARNING)  # removes log print everytime a scheduled task was run.
 logger = logging.getLogger(__name__)
 
 PORT = int(os.environ.get('PORT', '8443'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', PORT + 1))  # Prometheus metrics (GET /metrics), next to the webhook port
 
 TELEGRAM_TOKEN = API_PROFILES['TELEGRAM_TOKEN']
 STRIPE_TOKEN = API_PROFILES['STRIPE_TOKEN']
 HEROKU_URL_NAME = API_PROFILES['HEROKU_URL_NAME']
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in API_PROFILES.get('ADMIN_CHAT_IDS', fallback='').split(',') if chat_id.strip().lstrip('-').isdigit()}
 
 DONATE_PRICE = 100  # 2$. Price that appears on /donate command.
 DONATE_MAX_TIP = 150000  # 1500$. Internal, users don't see this.
@@ -39,6 +94,7 @@ DIR_PATH = os.path.dirname(os.path.abspath(__file__))
 DONATE_FULL_PATH = os.path.join(DIR_PATH, 'extras/donate.gif')
 AFTER_DONATE_FULL_PATH = os.path.join(DIR_PATH, 'extras/after_donate.gif')
 OOM_FULL_PATH = os.path.join(DIR_PATH, 'extras/oom.jpg')
+MEDIA_FILE_IDS_PATH = os.path.join(DIR_PATH, 'media_file_ids.json')  # Telegram file_ids of the files above, see MediaCache
 
 EMOJIS = {
     "hello": emoji.emojize(':waving_hand:'),  # Raised Hand with Fingers Splayed
@@ -47,7 +103,55 @@ EMOJIS = {
     "heart": emoji.emojize(':red_heart:'),  # Red Heart
 }
 
-CP = CMCPrices()
+
+def connect_shared_store() -> SharedStore or None:
+    """Store shared by all bot processes, None in single process mode. Process 0 starts the stand-in store if there is no Redis."""
+    if BOT_WORKERS <= 1 or RUN_THROUGH_HEROKU is False:
+        return None
+    url = os.environ.get('SHARED_STORE_URL') or os.environ.get('REDIS_URL')
+    if url is None:
+        global STORE_PROCESS
+        STORE_PROCESS, url = StoreServer.spawn()  # Ends together with this process
+        os.environ['SHARED_STORE_URL'] = url  # Inherited by worker processes started later
+    logger.info('Process %s of %s uses shared store %s', WORKER_INDEX, BOT_WORKERS, url.split('@')[-1])
+    return SharedStore(url)
+
+
+STORE_PROCESS = None
+STORE = connect_shared_store()
+CP = CMCPrices(warm_up_in_background=LAZY_STARTUP, store=STORE, run_jobs=WORKER_INDEX == 0)
+# Every message, answer and edit goes through it. Several processes share the bot's global limit -> each gets its part.
+SEND = SendQueue(SEND_WORKERS, global_rate=SendQueue.GLOBAL_RATE / (BOT_WORKERS if RUN_THROUGH_HEROKU is True else 1))
+MEDIA = MediaCache(MEDIA_FILE_IDS_PATH)
+HANDLER_SECONDS = CP.METRICS.histogram('bot_handler_seconds', 'Time a handler runs in the dispatcher (async lookups: until scheduled)',
+                                       ('handler',))
+LOOKUP_SECONDS = CP.METRICS.histogram('bot_lookup_seconds', 'Price lookup from its update until the reply was sent', ('kind',))
+HANDLER_ERRORS = CP.METRICS.counter('bot_handler_errors_total', 'Updates that caused an error')
+PROFILER = SamplingProfiler()
+
+
+def record_startup_event(event: str) -> None:
+    """Remembers when "event" happened for the first time since process start."""
+    if event in STARTUP_TIMES:
+        return
+    STARTUP_TIMES[event] = time.monotonic() - STARTUP_STARTED
+    logger.info('Startup: %s after %.2f s', event, STARTUP_TIMES[event])
+
+
+def record_first_answer(future: Future) -> None:
+    future.add_done_callback(lambda _: record_startup_event('first message answered'))
+
+
+def queue_reply(update: Update, text: str, priority: int = SendQueue.PRIORITY_NORMAL, **kwargs) -> Future:
+    """Queues a text reply to the message of "update" in SEND. Like Message.reply_text(): quotes the message in groups."""
+    message = update.effective_message
+    if message.chat.type != Chat.PRIVATE:
+        kwargs.setdefault('reply_to_message_id', message.message_id)
+    return SEND.text(message.chat_id, text, priority, **kwargs)
+
+
+def format_startup_times() -> str:
+    return 'Startup: ' + ', '.join('{0} after {1:.2f} s'.format(event, seconds) for event, seconds in STARTUP_TIMES.items())
 
 
 def start(update, context: CallbackContext) -> None:
@@ -56,11 +160,11 @@ def start(update, context: CallbackContext) -> None:
     last_name = update.message.chat.last_name
     keyboard = [[KeyboardButton("/example")], ['/crypto'], ['/fiat'], ['/donate']]
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-    update.message.reply_text('{0} Hey {1} {2}!\n\n'
-                              ' Write a crypto token like "BTC" to get its price in USD and other useful information.'
-                              ' You can specify other fiat currency than USD by adding its symbol after crypto.\n\n'
-                              '{3} Example: "BTC" or "ETH EUR"'.format(EMOJIS['hello'], first_name, last_name, EMOJIS['shrug']),
-                              reply_markup=reply_markup)
+    record_first_answer(queue_reply(update, '{0} Hey {1} {2}!\n\n'
+                                    ' Write a crypto token like "BTC" to get its price in USD and other useful information.'
+                                    ' You can specify other fiat currency than USD by adding its symbol after crypto.\n\n'
+                                    '{3} Example: "BTC" or "ETH EUR"'.format(EMOJIS['hello'], first_name, last_name, EMOJIS['shrug']),
+                                    reply_markup=reply_markup))
 
 
 def example(update, context: CallbackContext) -> None:
@@ -70,7 +174,81 @@ def example(update, context: CallbackContext) -> None:
     keyboard = [['BTC', 'ETH EUR']]
     reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
     text_msg = 'Choose a crypto symbol and (optionally) currency in the menu below!'
-    update.message.reply_text(text_msg, reply_markup=reply_markup)
+    queue_reply(update, text_msg, reply_markup=reply_markup)
+
+
+def parse_crypto_request(text: str) -> tuple[str, str]:
+    """Splits user input like "ETH EUR" into crypto symbol and currency. Currency is "USD" if not given."""
+    split_input = str(text).split(' ', maxsplit=1)
+    if len(split_input) == 2:
+        return split_input[0], split_input[1]
+    return split_input[0], 'USD'
+
+
+def run_price_lookup(update: Update, context: CallbackContext, crypto_symbol: str, currency: str, reply) -> None:
+    """Gets a price quote and hands it over to reply(update, context, crypto_symbol, token_info, status).
+       reply() queues its messages in SEND and returns the Future of the last one. The lookup counts as done once it was sent.
+       With USE_ASYNC_PIPELINE the lookup is scheduled on CP.ASYNC event loop and this function returns immediately.
+       Otherwise the calling thread waits for the lookup and the reply.
+    """
+    trace = tracing.Trace('price', '{0} {1}'.format(crypto_symbol, currency))
+    if USE_ASYNC_PIPELINE is False:
+        with tracing.active(trace):
+            token_info, status = CP.getCryptoPrice(crypto_symbol, currency)
+            with tracing.span('send'):
+                reply(update, context, crypto_symbol, token_info, status).result()
+        LOOKUP_SECONDS.observe(trace.finish(SLOW_REQUEST_SECONDS), 'price')
+        return
+
+    async def lookup_and_reply():
+        with tracing.active(trace):
+            trace_loop_wait(trace)
+            token_info, status = await CP.getCryptoPriceAsync(crypto_symbol, currency)
+            with tracing.span('send'):
+                await asyncio.wrap_future(reply(update, context, crypto_symbol, token_info, status))
+        LOOKUP_SECONDS.observe(trace.finish(SLOW_REQUEST_SECONDS), 'price')
+
+    submit_lookup(update, lookup_and_reply())
+
+
+def run_inline_lookup(update: Update, context: CallbackContext, candidates: list, currency: str) -> None:
+    """Gets prices of the INLINE_QUOTED_RESULTS best autocomplete candidates in one batched lookup and answers the inline query
+       with all candidates. Runs the same way as run_price_lookup().
+    """
+    quoted = candidates[:INLINE_QUOTED_RESULTS]
+    trace = tracing.Trace('inline', '{0} {1}'.format(update.inline_query.query, currency))
+    if USE_ASYNC_PIPELINE is False:
+        with tracing.active(trace):
+            prices = CP.getCryptoPrices(quoted, currency)
+            with tracing.span('send'):
+                answer_inline_candidates(update, context, candidates, prices).result()
+        LOOKUP_SECONDS.observe(trace.finish(SLOW_REQUEST_SECONDS), 'inline')
+        return
+
+    async def lookup_and_reply():
+        with tracing.active(trace):
+            trace_loop_wait(trace)
+            prices = await CP.getCryptoPricesAsync(quoted, currency)
+            with tracing.span('send'):
+                await asyncio.wrap_future(answer_inline_candidates(update, context, candidates, prices))
+        LOOKUP_SECONDS.observe(trace.finish(SLOW_REQUEST_SECONDS), 'inline')
+
+    submit_lookup(update, lookup_and_reply())
+
+
+def trace_loop_wait(trace: tracing.Trace) -> None:
+    """Records time between the handler scheduling a lookup and CP.ASYNC loop starting it -> shows when the loop is overloaded."""
+    trace.add('loop wait', trace.started, time.perf_counter() - trace.started)
+
+
+def submit_lookup(update: Update, coro) -> None:
+    """Schedules lookup coroutine on CP.ASYNC event loop. Errors are logged like errors of handlers."""
+    def log_failure(future):
+        if future.exception() is not None:
+            HANDLER_ERRORS.inc()
+            logger.warning('Update "%s" caused error "%s"', update, future.exception())
+
+    CP.ASYNC.submit(coro).add_done_callback(log_failure)
 
 
 def coinmarketcapHandler(update: Update, context: CallbackContext) -> None:
@@ -78,37 +256,69 @@ def coinmarketcapHandler(update: Update, context: CallbackContext) -> None:
        Ignores casing. Supports only 1 crypto per request. Crypto and fiat must be separated by a whitespace.
        Examples: BTC, ETH EUR, bnb, sol dkk
     """
-    user_message = str(update.message.text)
-    split_input = user_message.split(' ', maxsplit=1)
-    if len(split_input) == 1:
-        crypto_symbol = split_input[0]
-        token_info, status = CP.getCryptoPrice(crypto_symbol)
-    elif len(split_input) == 2:
-        crypto_symbol, currency = split_input[0], split_input[1]
-        token_info, status = CP.getCryptoPrice(crypto_symbol, currency)
+    crypto_symbol, currency = parse_crypto_request(update.message.text)
+    run_price_lookup(update, context, crypto_symbol, currency, send_crypto_price)
+
+
+def send_crypto_price(update: Update, context: CallbackContext, crypto_symbol: str, token_info: str, status) -> Future:
+    """Sends result of coinmarketcapHandler() price lookup to the chat."""
     if status is False:
-        update.message.reply_text(text=token_info, parse_mode='Markdown')
-        oom_img = open(OOM_FULL_PATH, 'rb').read()
-        context.bot.sendPhoto(chat_id=update.message.chat_id, photo=oom_img)
+        queue_reply(update, token_info, SEND.PRIORITY_REPLY, parse_mode='Markdown')
+        sent = send_oom_image(update, context, SEND.PRIORITY_REPLY)
     else:
         if token_info is not None:
-            update.message.reply_text(text=token_info, parse_mode='Markdown', disable_web_page_preview=True)
+            sent = queue_reply(update, token_info, SEND.PRIORITY_REPLY, parse_mode='Markdown', disable_web_page_preview=True)
         else:
-            update.message.reply_text(text=status)
+            sent = queue_reply(update, status, SEND.PRIORITY_REPLY)
+    record_first_answer(sent)
+    return sent
+
+
+def send_oom_image(update: Update, context: CallbackContext, priority: int = SendQueue.PRIORITY_NORMAL) -> Future:
+    """Sends "out of mana" image that goes along with out of credits messages."""
+    chat_id = update.message.chat_id
+    return SEND.call(chat_id, lambda: MEDIA.send(OOM_FULL_PATH, lambda media: context.bot.sendPhoto(chat_id=chat_id, photo=media)), priority)
 
 
 def print_all_cmc_cryptos(update: Update, context: CallbackContext) -> None:
     """Send a message when the command /crypto is issued.
-       Prints all SYMBOLS of crypto tokens listed on Coinmarketcap (for some reason only 10k)
+       Shows first page of crypto tokens listed on Coinmarketcap, best ranked first, with buttons to browse the other pages.
     """
-    crypto_list, status = CP.PrintSupportedCryptos()
-    if status is False:
-        update.message.reply_text(text=crypto_list, parse_mode='Markdown')
-        oom_img = open(OOM_FULL_PATH, 'rb').read()
-        context.bot.sendPhoto(chat_id=update.message.chat_id, photo=oom_img)
-    else:
-        for idx, one_msg in enumerate(crypto_list):
-            update.message.reply_text(one_msg)
+    text, page, page_count = CP.PrintSupportedCryptos(0)
+    queue_reply(update, text, SEND.PRIORITY_BULK, reply_markup=crypto_page_keyboard(page, page_count))
+
+
+def crypto_page_keyboard(page: int, page_count: int) -> InlineKeyboardMarkup or None:
+    """Navigation buttons under a /crypto list page. Button to the page already shown carries no page -> pressing it does nothing."""
+    if page_count <= 1:
+        return None
+
+    def button(label: str, target: int) -> InlineKeyboardButton:
+        target = min(max(target, 0), page_count - 1)
+        return InlineKeyboardButton(label, callback_data=CRYPTO_PAGE_CALLBACK + (str(target) if target != page else ''))
+
+    return InlineKeyboardMarkup([
+        [button('<', page - 1), button('{0}/{1}'.format(page + 1, page_count), page), button('>', page + 1)],
+        [button('<< 1', 0), button('-{}'.format(CRYPTO_PAGE_JUMP), page - CRYPTO_PAGE_JUMP),
+         button('+{}'.format(CRYPTO_PAGE_JUMP), page + CRYPTO_PAGE_JUMP), button('{} >>'.format(page_count), page_count - 1)],
+    ])
+
+
+def crypto_page_callback(update: Update, context: CallbackContext) -> None:
+    """Handles /crypto list navigation buttons: replaces the page in the same message instead of sending a new one."""
+    query = update.callback_query
+    requested = query.data[len(CRYPTO_PAGE_CALLBACK):]
+    SEND.call(None, query.answer, SEND.PRIORITY_REPLY)
+    if requested == '':
+        return
+    text, page, page_count = CP.PrintSupportedCryptos(int(requested))
+
+    def edit():
+        try:
+            return query.edit_message_text(text, reply_markup=crypto_page_keyboard(page, page_count))
+        except BadRequest as e:  # Same button pressed twice quickly -> "Message is not modified"
+            logger.info('Crypto list page not changed: %s', e)
+    SEND.call(update.effective_chat.id if update.effective_chat is not None else None, edit, SEND.PRIORITY_REPLY)
 
 
 def print_all_cmc_fiats(update: Update, context: CallbackContext) -> None:
@@ -117,11 +327,10 @@ def print_all_cmc_fiats(update: Update, context: CallbackContext) -> None:
     """
     fiat_list, status = CP.PrintSupportedFiats()
     if status is False:
-        update.message.reply_text(text=fiat_list, parse_mode='Markdown')
-        oom_img = open(OOM_FULL_PATH, 'rb').read()
-        context.bot.sendPhoto(chat_id=update.message.chat_id, photo=oom_img)
+        queue_reply(update, fiat_list, SEND.PRIORITY_BULK, parse_mode='Markdown')
+        send_oom_image(update, context, SEND.PRIORITY_BULK)
     else:
-        update.message.reply_text(fiat_list)
+        queue_reply(update, fiat_list, SEND.PRIORITY_BULK)
 
 
 def print_cmc_usage_info(update: Update, context: CallbackContext) -> None:
@@ -129,18 +338,42 @@ def print_cmc_usage_info(update: Update, context: CallbackContext) -> None:
        Prints API key details and usage stats.
     """
     key_info = CP.PrintKeyInfo()
-    update.message.reply_text(key_info)
+    queue_reply(update, '{0}\n{1}'.format(key_info, format_startup_times()))
+
+
+def toggle_profiler() -> str:
+    """Starts the sampling profiler, or stops it and returns its report. Used by /profile and PROFILE_SIGNAL."""
+    if PROFILER.running is False:
+        PROFILER.start()
+        logger.info('Sampling profiler started')
+        return 'Profiler started. Send /profile again to stop it.'
+    report = PROFILER.stop(PROFILE_PATH.format(time.strftime('%Y%m%d-%H%M%S')))
+    logger.info(report)
+    return report
+
+
+def profile(update: Update, context: CallbackContext) -> None:
+    """Send a message when the command /profile is issued. Admins only.
+       Toggles the sampling profiler. Stopping it replies with the hottest functions and the latest slow lookups.
+    """
+    if update.message.chat_id not in ADMIN_CHAT_IDS:
+        return
+    text = toggle_profiler()
+    if PROFILER.running is False and len(tracing.SLOW_TRACES) > 0:
+        text += '\n\n' + '\n'.join(trace.format() for trace in list(tracing.SLOW_TRACES)[-3:])
+    queue_reply(update, text[:CP.TELEGRAM_MSG_CHAR_LIMIT])
 
 
 def error(update: Update, context: CallbackContext) -> None:
     """Log Errors caused by Updates."""
+    HANDLER_ERRORS.inc()
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
 
 def pre_checkout_handler(update: Update, context: CallbackContext) -> None:
     """https://core.telegram.org/bots/api#answerprecheckoutquery"""
     query = update.pre_checkout_query
-    query.answer(ok=True)
+    SEND.call(None, lambda: query.answer(ok=True), SEND.PRIORITY_REPLY)
 
 
 def donate(update: Update, context: CallbackContext) -> None:
@@ -148,8 +381,9 @@ def donate(update: Update, context: CallbackContext) -> None:
        Currently uses STRIPE as a payment provider. For testing purposes, use TEST STRIPE token defined at the top of this file'''
     first_name = update.message.chat.first_name
     last_name = update.message.chat.last_name
-    context.bot.send_invoice(
-        chat_id=update.message.chat_id,
+    chat_id = update.message.chat_id
+    SEND.call(chat_id, lambda: context.bot.send_invoice(
+        chat_id=chat_id,
         title="Cheers {0} {1} {2}".format(first_name, last_name, EMOJIS['heart']),
         description="If you like this bot feel free to buy me a coffee.",
         payload="donation",
@@ -160,17 +394,16 @@ def donate(update: Update, context: CallbackContext) -> None:
         max_tip_amount=DONATE_MAX_TIP,
         suggested_tip_amounts=DONATE_SUGGESTED_TIPS,
         start_parameter=None,
-    )
-    donate_gif = open(DONATE_FULL_PATH, 'rb').read()
-    context.bot.sendAnimation(chat_id=update.message.chat_id, animation=donate_gif)
+    ))
+    SEND.call(chat_id, lambda: MEDIA.send(DONATE_FULL_PATH, lambda media: context.bot.sendAnimation(chat_id=chat_id, animation=media)))
 
 
 def successful_payment_callback(update: Update, context: CallbackContext) -> None:
     '''A reponse that user sees when /donate'ion was successful.
        Currently sends a text message and GIF.'''
-    update.message.reply_text('Thank you for the donation! {0} {0} {0}'.format(EMOJIS['rocket']))
-    after_donate_gif = open(AFTER_DONATE_FULL_PATH, 'rb').read()
-    context.bot.sendAnimation(chat_id=update.message.chat_id, animation=after_donate_gif)
+    chat_id = update.message.chat_id
+    queue_reply(update, 'Thank you for the donation! {0} {0} {0}'.format(EMOJIS['rocket']))
+    SEND.call(chat_id, lambda: MEDIA.send(AFTER_DONATE_FULL_PATH, lambda media: context.bot.sendAnimation(chat_id=chat_id, animation=media)))
 
 
 def inline_query(update: Update, context: CallbackContext) -> None:
@@ -192,61 +425,176 @@ def inline_query(update: Update, context: CallbackContext) -> None:
                    description='Sends help message on how to use the bot',
                    input_message_content=InputTextMessageContent(reply_text))]
 
-        update.inline_query.answer(results)
+        SEND.call(None, lambda: update.inline_query.answer(results, cache_time=INLINE_HELP_CACHE_TIME), SEND.PRIORITY_REPLY)
     else:
-        split_input = query.split(' ', maxsplit=1)
-        if len(split_input) == 1:
-            crypto_symbol = split_input[0]
-            token_info, status = CP.getCryptoPrice(crypto_symbol)
-        elif len(split_input) == 2:
-            crypto_symbol, currency = split_input[0], split_input[1]
-            token_info, status = CP.getCryptoPrice(crypto_symbol, currency)
-        if status is False:
-            update.message.reply_text(text=token_info, parse_mode='Markdown')
-            oom_img = open(OOM_FULL_PATH, 'rb').read()
-            context.bot.sendPhoto(chat_id=update.message.chat_id, photo=oom_img)
+        crypto_symbol, currency = parse_crypto_request(query)
+        candidates = CP.autocomplete(crypto_symbol, INLINE_MAX_RESULTS)
+        if len(candidates) == 0:  # Crypto map not loaded yet or nothing starts with it -> plain lookup of what was typed
+            run_price_lookup(update, context, crypto_symbol, currency, answer_inline_price)
         else:
-            if token_info is not None:
-                reply_text = token_info
-            else:
-                reply_text = '{} - Token not found on CoinMarketCap.'.format(crypto_symbol)
+            run_inline_lookup(update, context, candidates, currency)
 
-        results = [InlineQueryResultArticle(id=str(uuid4()),
-                   title="Get crypto price",
-                   description='Shows latest crypto price in chat.',
-                   input_message_content=InputTextMessageContent(reply_text, parse_mode='Markdown', disable_web_page_preview=True))]
 
-        update.inline_query.answer(results)
+def answer_inline_price(update: Update, context: CallbackContext, crypto_symbol: str, token_info: str, status) -> Future:
+    """Answers inline query with result of inline_query() price lookup."""
+    if status is False or token_info is not None:
+        reply_text = token_info  # Quote or "out of mana" message
+    else:
+        reply_text = '{} - Token not found on CoinMarketCap.'.format(crypto_symbol)
+
+    results = [InlineQueryResultArticle(id=str(uuid4()),
+               title="Get crypto price",
+               description='Shows latest crypto price in chat.',
+               input_message_content=InputTextMessageContent(reply_text, parse_mode='Markdown', disable_web_page_preview=True))]
+
+    sent = SEND.call(None, lambda: update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME), SEND.PRIORITY_REPLY)
+    record_first_answer(sent)
+    return sent
+
+
+def answer_inline_candidates(update: Update, context: CallbackContext, candidates: list, prices: list) -> Future:
+    """Answers inline query with autocomplete candidates. The first len(prices) carry their price, the rest a link to their CMC page."""
+    results = []
+    for i, entry in enumerate(candidates):
+        title = '{0} ({1})'.format(entry.name, entry.symbol)
+        if i < len(prices):
+            token_info, status = prices[i]
+            reply_text = token_info if status is False or token_info is not None else '{0} - {1}'.format(title, status)
+            content = InputTextMessageContent(reply_text, parse_mode='Markdown', disable_web_page_preview=True)
+            description = 'Shows latest crypto price in chat.'
+        else:
+            content = InputTextMessageContent('{0}\n{1}{2}'.format(title, CP.CMC_URL, entry.slug), disable_web_page_preview=True)
+            rank = 'CMC rank #{}. '.format(entry.rank) if entry.rank is not None else ''
+            description = rank + 'Type its symbol to get the price.'
+        results.append(InlineQueryResultArticle(id=str(entry.id), title=title, description=description, input_message_content=content))
+
+    sent = SEND.call(None, lambda: update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME), SEND.PRIORITY_REPLY)
+    record_first_answer(sent)
+    return sent
 
 
-def main() -> None:
-    """Start the Telegram bot."""
-    updater = Updater(TELEGRAM_TOKEN, use_context=True)
+def add_handlers(dp: Dispatcher) -> None:
+    """Registers all bot handlers. Used by main() and by benchmarks/bench_e2e.py, which drives them against fake services."""
+    def timed(name: str, callback):
+        return HANDLER_SECONDS.time(name)(callback)
 
-    # Get the dispatcher to register handlers
-    dp = updater.dispatcher
+    CP.METRICS.gauge('bot_update_queue_depth', 'Updates waiting for the dispatcher', lambda: dp.update_queue.qsize())
+    CP.METRICS.gauge('telegram_send_queue_depth', 'Bot API calls waiting in the send queue', lambda: SEND.queued)
+    CP.METRICS.counter_callback('telegram_send_calls_total', 'Send queue results: sent calls, texts merged into another message, '
+                                '429 replies, failed calls', lambda: {(result,): count for result, count in SEND.stats().items()
+                                                                      if result != 'queued'}, ('result',))
+    SEND.start(dp.bot)
 
     # Command handlers.
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("donate", donate, run_async=True))
-    dp.add_handler(CommandHandler("example", example))
-    dp.add_handler(CommandHandler("crypto", print_all_cmc_cryptos, run_async=True))
-    dp.add_handler(CommandHandler("fiat", print_all_cmc_fiats, run_async=True))
-    dp.add_handler(CommandHandler("secret", print_cmc_usage_info, run_async=True))
-
-    # Inline query handler
-    dp.add_handler(InlineQueryHandler(inline_query, run_async=True))
+    dp.add_handler(CommandHandler("start", timed('start', start)))
+    dp.add_handler(CommandHandler("donate", timed('donate', donate), run_async=True))
+    dp.add_handler(CommandHandler("example", timed('example', example)))
+    dp.add_handler(CommandHandler("crypto", timed('crypto', print_all_cmc_cryptos), run_async=True))
+    dp.add_handler(CallbackQueryHandler(timed('crypto_page', crypto_page_callback), pattern='^' + CRYPTO_PAGE_CALLBACK))
+    dp.add_handler(CommandHandler("fiat", timed('fiat', print_all_cmc_fiats), run_async=True))
+    dp.add_handler(CommandHandler("secret", timed('secret', print_cmc_usage_info), run_async=True))
+    dp.add_handler(CommandHandler("profile", profile, run_async=True))
+
+    # Inline query handler. Price lookup handlers don't need own threads when async pipeline is used -> they return right away.
+    dp.add_handler(InlineQueryHandler(timed('inline', inline_query), run_async=not USE_ASYNC_PIPELINE))
 
     # General chat message handler.
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, coinmarketcapHandler, run_async=True))
+    dp.add_handler(MessageHandler(Filters.text & ~Filters.command, timed('message', coinmarketcapHandler), run_async=not USE_ASYNC_PIPELINE))
 
     # Payment processing handlers.
-    dp.add_handler(PreCheckoutQueryHandler(pre_checkout_handler))
-    dp.add_handler(MessageHandler(Filters._SuccessfulPayment(), successful_payment_callback))
+    dp.add_handler(PreCheckoutQueryHandler(timed('pre_checkout', pre_checkout_handler)))
+    dp.add_handler(MessageHandler(Filters._SuccessfulPayment(), timed('successful_payment', successful_payment_callback)))
 
     # Error logging
     dp.add_error_handler(error)
 
+
+def start_process_services() -> None:
+    """Metrics endpoint and profiler signal of this process. Worker processes use the ports after METRICS_PORT."""
+    try:
+        CP.METRICS.serve(METRICS_PORT + WORKER_INDEX)
+    except OSError as e:  # Port taken -> run without metrics rather than not at all
+        logger.warning('Metrics endpoint not started on port %s: %s', METRICS_PORT + WORKER_INDEX, e)
+    if PROFILE_SIGNAL is not None:
+        signal.signal(PROFILE_SIGNAL, lambda signum, frame: toggle_profiler())
+
+
+def run_worker(updates: multiprocessing.Queue) -> None:
+    """Worker process of multi-process mode: handles updates UpdateRouter of process 0 puts into "updates" (JSON bytes).
+       Exits when it gets None or process 0 is gone.
+    """
+    updater = Updater(TELEGRAM_TOKEN, use_context=True)
+    dispatcher = updater.dispatcher
+    add_handlers(dispatcher)
+    start_process_services()
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    parent = multiprocessing.parent_process()
+    while parent is None or parent.is_alive():
+        try:
+            body = updates.get(timeout=1)
+        except queue.Empty:
+            continue
+        if body is None:
+            break
+        dispatcher.update_queue.put(Update.de_json(json.loads(body), updater.bot))
+    dispatcher.stop()
+    SEND.stop()
+
+
+def run_workers(updater: Updater) -> None:
+    """Process 0 of multi-process mode: starts BOT_WORKERS - 1 worker processes and the webhook that feeds them. Returns on SIGTERM/SIGINT."""
+    context = multiprocessing.get_context('spawn')  # No fork: this process already runs threads
+    worker_queues, workers = [None], []
+    for index in range(1, BOT_WORKERS):
+        worker_queues.append(context.Queue())
+        os.environ['BOT_WORKER_INDEX'] = str(index)  # Read by the worker when it imports this module
+        workers.append(context.Process(target=run_worker, args=(worker_queues[index],), name='bot-worker-{}'.format(index), daemon=True))
+        workers[-1].start()
+    os.environ['BOT_WORKER_INDEX'] = str(WORKER_INDEX)
+
+    dispatcher = updater.dispatcher
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    router = UpdateRouter(dispatcher.update_queue, worker_queues, updater.bot)
+    router.start(CP.ASYNC, '0.0.0.0', PORT, TELEGRAM_TOKEN)
+    updater.bot.set_webhook('https://{0}.herokuapp.com/{1}'.format(HEROKU_URL_NAME, TELEGRAM_TOKEN))
+    record_startup_event('accepting updates')
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    while not stop.wait(1):
+        for index, worker in enumerate(workers, start=1):
+            if not worker.is_alive():  # Its chats would go unanswered -> start it again
+                logger.warning('Worker %s exited with code %s, restarting it', index, worker.exitcode)
+                os.environ['BOT_WORKER_INDEX'] = str(index)
+                workers[index - 1] = context.Process(target=run_worker, args=(worker_queues[index],), name=worker.name, daemon=True)
+                workers[index - 1].start()
+                os.environ['BOT_WORKER_INDEX'] = str(WORKER_INDEX)
+    logger.info('Stopping: updates routed per worker %s', router.routed)
+    router.stop(CP.ASYNC)
+    for worker_queue in worker_queues[1:]:
+        worker_queue.put(None)
+    for worker in workers:
+        worker.join(10)
+    dispatcher.stop()
+    SEND.stop()
+
+
+def main() -> None:
+    """Start the Telegram bot."""
+    updater = Updater(TELEGRAM_TOKEN, use_context=True)
+    add_handlers(updater.dispatcher)
+    start_process_services()
+
+    def wait_for_warm_up():
+        CP.READY.wait()
+        record_startup_event('maps loaded')
+    threading.Thread(target=wait_for_warm_up, name='startup-timer', daemon=True).start()
+
+    if RUN_THROUGH_HEROKU is True and BOT_WORKERS > 1:
+        # Cloud running, several processes
+        run_workers(updater)
+        return
     if RUN_THROUGH_HEROKU is True:
         # Cloud running
         updater.start_webhook(listen="0.0.0.0",
@@ -256,8 +604,10 @@ def main() -> None:
     else:
         # Local running
         updater.start_polling()  # NOTE: Run this for local code running.
+    record_startup_event('accepting updates')
 
     updater.idle()
+    SEND.stop()  # Replies still queued go out before the process ends
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+import time
+from collections import namedtuple
+
+from symbol_index import SymbolIndex  # Prebuilt hashed symbol/fiat lookup tables
+from prefix_index import PrefixIndex  # Ranked autocomplete over symbols and names
+from fuzzy_index import FuzzyIndex  # Typos and full names -> tokens
+
+
+# What changed between two crypto maps, by CMC id. "changed": same id, different symbol/name/slug/rank.
+MapDiff = namedtuple('MapDiff', ['added', 'removed', 'changed', 'fiats_added', 'fiats_removed'])
+
+
+def diff_maps(old_entries, new_entries, old_fiats, new_fiats) -> MapDiff:
+    ''' Compares crypto maps (lists of CryptoEntry) and fiat maps (lists of symbols). A missing map (None) on either side
+        counts as empty. Example:
+            diff_maps(old.crypto_entries, new_entries, old.fiat_map, new_fiats)
+            -> MapDiff(added=[CryptoEntry(...)], removed=[], changed=[CryptoEntry(...)], fiats_added=[], fiats_removed=[])
+    '''
+    old_by_id = {entry.id: entry for entry in old_entries or ()}
+    new_by_id = {entry.id: entry for entry in new_entries or ()}
+    added = [entry for cmc_id, entry in new_by_id.items() if cmc_id not in old_by_id]
+    removed = [entry for cmc_id, entry in old_by_id.items() if cmc_id not in new_by_id]
+    changed = [entry for cmc_id, entry in new_by_id.items() if cmc_id in old_by_id and old_by_id[cmc_id] != entry]
+    old_fiats, new_fiats = set(old_fiats or ()), set(new_fiats or ())
+    return MapDiff(added, removed, changed, sorted(new_fiats - old_fiats), sorted(old_fiats - new_fiats))
+
+
+class MapSnapshot(object):
+    ''' Crypto and fiat maps plus everything derived from them, built together and never modified afterwards.
+        CMCPrices keeps the current one in a single attribute: a refresh builds a new snapshot off the request path and replaces
+        the reference in one assignment. A request takes the reference once and keeps using that snapshot -> it never sees
+        the symbol index of one map and the autocomplete of another, and reading needs no lock.
+        "pages" is a function building /crypto list pages from the crypto map (CMCPrices.build_crypto_pages).
+        Crypto parts of "previous" are reused when its crypto map is the very same list (symbol tables, pages, prefix and fuzzy
+        indexes, top ids) -> a fiat-only change rebuilds just the fiat table.
+        Example:
+            maps = MapSnapshot(crypto_entries, fiat_map, build_pages, autocomplete_limit=10, top_n=200)
+            maps.symbol_index.lookup('btc'), maps.prefix_index.complete('eth'), maps.crypto_pages[0]
+    '''
+    __slots__ = ('crypto_entries', 'fiat_map', 'crypto_map', 'slug_map', 'crypto_pages', 'symbol_index', 'prefix_index',
+                 'fuzzy_index', 'top_ranked_ids', 'built_at')
+
+    def __init__(self, crypto_entries: list = None, fiat_map: list = None, pages=None, autocomplete_limit: int = 10,
+                 top_n: int = 0, previous=None):
+        self.crypto_entries = tuple(crypto_entries) if crypto_entries is not None else None
+        self.fiat_map = tuple(fiat_map) if fiat_map is not None else None
+        if previous is not None and crypto_entries is not None and crypto_entries is previous.crypto_entries:
+            self.symbol_index = previous.symbol_index.with_fiats(self.fiat_map)
+            self.crypto_map, self.slug_map, self.crypto_pages = previous.crypto_map, previous.slug_map, previous.crypto_pages
+            self.prefix_index, self.fuzzy_index, self.top_ranked_ids = previous.prefix_index, previous.fuzzy_index, previous.top_ranked_ids
+        else:
+            self.symbol_index = SymbolIndex(self.crypto_entries, self.fiat_map)
+            entries = self.crypto_entries or ()
+            self.crypto_map = tuple(entry.symbol for entry in entries) if crypto_entries is not None else None
+            self.slug_map = tuple(entry.slug for entry in entries) if crypto_entries is not None else None
+            self.crypto_pages = tuple(pages(entries)) if pages is not None and crypto_entries is not None else ()
+            self.prefix_index = PrefixIndex(self.crypto_entries, limit=autocomplete_limit)
+            self.fuzzy_index = FuzzyIndex(self.crypto_entries)
+            self.top_ranked_ids = self._top_ranked_ids(entries, top_n)
+        self.built_at = time.time()
+
+    @staticmethod
+    def _top_ranked_ids(crypto_entries, top_n: int) -> tuple:
+        '''CMC ids of "top_n" best ranked tokens.'''
+        ranked = sorted((entry for entry in crypto_entries if entry.rank is not None and entry.id is not None), key=lambda entry: entry.rank)
+        return tuple(entry.id for entry in ranked[:top_n])
+
+    @property
+    def has_crypto_map(self) -> bool:
+        return self.crypto_entries is not None
+
+    def __len__(self) -> int:
+        return len(self.crypto_entries or ())
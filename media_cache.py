@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+
+from telegram.error import BadRequest  # Telegram refuses a file_id (e.g. bot token changed)
+
+
+class MediaCache(object):
+    ''' Sends bot media (images, GIFs) by Telegram file_id instead of uploading the file on every call.
+        First send of a file uploads its bytes, Telegram answers with a file_id that is remembered and used from then on.
+        File ids are saved into a json file -> survive restarts. File bytes are read from disk once and kept in memory, used for
+        the first upload and as a fallback when Telegram doesn't accept a saved file_id anymore.
+        Example:
+            MEDIA = MediaCache('media_file_ids.json')
+            MEDIA.send('extras/oom.jpg', lambda media: context.bot.sendPhoto(chat_id=chat_id, photo=media))
+    '''
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self._file_ids = {}  # file name -> Telegram file_id
+        self._bytes = {}  # file path -> file content
+        self._lock = threading.Lock()
+        self.sent_by_id = 0
+        self.uploads = 0
+        try:
+            with open(cache_path, 'r') as f:
+                self._file_ids = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print('Failed to load media file ids from {0}: {1}'.format(cache_path, e))
+
+    def send(self, file_path: str, send_media):
+        ''' Calls "send_media(media)" with the file_id of "file_path" if known, otherwise with its bytes.
+            Remembers the file_id from the returned telegram.Message. Returns that message.
+        '''
+        name = os.path.basename(file_path)  # Key without directory -> cache stays valid when the bot is moved
+        file_id = self._file_ids.get(name)
+        if file_id is not None:
+            try:
+                message = send_media(file_id)
+                self.sent_by_id += 1
+                return message
+            except BadRequest as e:
+                print('Telegram refused cached file_id of {0}, uploading it again: {1}'.format(name, e))
+                with self._lock:
+                    self._file_ids.pop(name, None)
+        message = send_media(self._read(file_path))
+        self.uploads += 1
+        file_id = self.file_id_of(message)
+        if file_id is not None:
+            with self._lock:
+                self._file_ids[name] = file_id
+                self._save()
+        return message
+
+    def _read(self, file_path: str) -> bytes:
+        content = self._bytes.get(file_path)
+        if content is None:
+            with open(file_path, 'rb') as f:
+                content = f.read()
+            self._bytes[file_path] = content
+        return content
+
+    @staticmethod
+    def file_id_of(message) -> str or None:
+        '''file_id of the media in a sent telegram.Message. Photos come in several sizes -> the largest one.'''
+        attachment = getattr(message, 'effective_attachment', None)
+        if isinstance(attachment, list):
+            attachment = attachment[-1] if len(attachment) > 0 else None
+        return getattr(attachment, 'file_id', None)
+
+    def _save(self) -> None:
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._file_ids, f, indent=2)
+            os.replace(tmp_path, self.cache_path)  # Never leaves a half written file behind
+        except Exception as e:
+            print('Failed to save media file ids to {0}: {1}'.format(self.cache_path, e))
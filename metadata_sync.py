@@ -0,0 +1,124 @@
+import os
+import gzip
+import threading
+
+from botocore.exceptions import ClientError  # Every S3 error
+
+from aws_s3 import AWS_S3  # Our custom made Amazon AWS S3 client
+from token_store import TokenInfoStore  # SQLite store of token metadata
+
+
+class MetadataSync(object):
+    ''' Keeps token metadata store in sync with its copy in amazon AWS S3. Meant to run from background jobs only.
+            push() -> uploads a gzip compressed snapshot of the store, but only once "min_new_tokens" were added since the last
+                      sync and only if the content (SHA-256 over all tokens) differs from what S3 already has.
+            pull() -> conditional download with the ETag of the last synced object: an unchanged object costs one request with
+                      no body ("304 Not Modified"). A changed one is merged into the store, tokens added locally are kept.
+        What was synced last (ETag, content hash, token count) is kept in the store itself -> survives restarts with the store.
+        If the snapshot doesn't exist in S3 yet, pull() imports the old crypto_info.pickle from S3 once ("legacy_filename").
+        Nothing is uploaded before one pull() succeeded -> a fresh dyno never overwrites S3 with its almost empty store.
+    '''
+
+    def __init__(self, aws: AWS_S3, store: TokenInfoStore, aws_filename: str = 'crypto_info.db.gz', min_new_tokens: int = 10,
+                 legacy_filename: str = None, legacy_path: str = None, compress_level: int = 6):
+        self.aws = aws
+        self.store = store
+        self.aws_filename = aws_filename
+        self.min_new_tokens = min_new_tokens
+        self.legacy_filename = legacy_filename
+        self.legacy_path = legacy_path
+        self.compress_level = compress_level
+        self._lock = threading.Lock()  # push() and pull() run from different scheduler threads
+        self.pulled = False
+        self.uploads = 0
+        self.skipped_uploads = 0
+        self.downloads = 0
+        self.not_modified = 0
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+
+    def _synced_count(self) -> int:
+        return int(self.store.get_meta('s3_count') or 0)
+
+    def _remember(self, etag: str, content_hash: str or None, count: int) -> None:
+        self.store.set_meta('s3_etag', etag)
+        self.store.set_meta('s3_sha256', content_hash or '')
+        self.store.set_meta('s3_count', str(count))
+
+    def push(self, force: bool = False) -> bool:
+        '''Uploads the store if it changed enough since the last sync. Returns True if something was uploaded.'''
+        with self._lock:
+            if self.pulled is False:
+                self._pull()
+            count = len(self.store)
+            if force is False and count - self._synced_count() < self.min_new_tokens:
+                return False
+            content_hash = self.store.content_hash()
+            if content_hash == self.store.get_meta('s3_sha256'):
+                self.skipped_uploads += 1
+                self.store.set_meta('s3_count', str(count))
+                return False
+            body = self._compressed_snapshot()
+            etag = self.aws.put_object(self.aws_filename, body, metadata={'sha256': content_hash, 'tokens': str(count)})
+            self._remember(etag, content_hash, count)
+            self.uploads += 1
+            self.bytes_uploaded += len(body)
+            print('Uploaded {0} ({1} tokens, {2} KB) to AWS.'.format(self.aws_filename, count, len(body) // 1024))
+            return True
+
+    def pull(self) -> int:
+        '''Merges the S3 copy into the store if it changed since the last sync. Returns how many tokens were added.'''
+        with self._lock:
+            return self._pull()
+
+    def _pull(self) -> int:
+        try:
+            body, etag, metadata = self.aws.get_object_if_changed(self.aws_filename, self.store.get_meta('s3_etag'))
+        except ClientError as e:
+            if not AWS_S3.is_missing(e):
+                raise
+            self.pulled = True
+            return self._pull_legacy()
+        if body is None:
+            self.not_modified += 1
+            self.pulled = True
+            return 0
+        self.downloads += 1
+        self.bytes_downloaded += len(body)
+        tmp_path = self.store.path + '.download'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(gzip.decompress(body))
+            added = self.store.merge_from(tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Content hash and count of what S3 has -> push() uploads only once the store holds more than that.
+        self._remember(etag, metadata.get('sha256'), int(metadata.get('tokens', 0)))
+        self.pulled = True
+        print('Downloaded {0} from AWS: {1} new tokens, {2} in total.'.format(self.aws_filename, added, len(self.store)))
+        return added
+
+    def _pull_legacy(self) -> int:
+        if self.legacy_filename is None or self.store.get_meta('migrated_' + os.path.basename(self.legacy_path)) is not None:
+            return 0
+        try:
+            self.aws.download_file(self.legacy_filename, self.legacy_path)
+        except ClientError as e:
+            print('Failed to download {0} from AWS: {1}'.format(self.legacy_filename, e))
+            return 0
+        return self.store.migrate_pickle(self.legacy_path)
+
+    def _compressed_snapshot(self) -> bytes:
+        tmp_path = self.store.path + '.upload'
+        try:
+            self.store.snapshot(tmp_path)
+            with open(tmp_path, 'rb') as f:
+                return gzip.compress(f.read(), compresslevel=self.compress_level, mtime=0)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def stats(self) -> dict:
+        return {'uploads': self.uploads, 'skipped_uploads': self.skipped_uploads, 'downloads': self.downloads,
+                'not_modified': self.not_modified, 'bytes_uploaded': self.bytes_uploaded, 'bytes_downloaded': self.bytes_downloaded}
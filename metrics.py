@@ -0,0 +1,187 @@
+import time
+import threading
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Scrape endpoint, runs in its own daemon thread
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_string(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = ['{0}="{1}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    '''Monotonic counter, one value per combination of label values. inc() costs a dict update under a lock.'''
+    __slots__ = ('name', 'help', 'labelnames', '_values', '_lock')
+    KIND = 'counter'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, _label_string(self.labelnames, labels), value) for labels, value in values]
+
+
+class Histogram(object):
+    ''' Distribution of observed values (seconds) in cumulative buckets, Prometheus style. observe() is a bisect and two
+        additions under a lock -> cheap enough for every update and every CMC call.
+    '''
+    __slots__ = ('name', 'help', 'labelnames', 'buckets', '_series', '_lock')
+    KIND = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [count per bucket (last one is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        '''Decorator observing how long the decorated function runs, exceptions included.'''
+        def decorator(function):
+            @wraps(function)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return timed
+        return decorator
+
+    def samples(self) -> list:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        samples = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', _label_string(self.labelnames, labels, 'le="{}"'.format(_number(bound))), cumulative))
+            samples.append((self.name + '_sum', _label_string(self.labelnames, labels), total))
+            samples.append((self.name + '_count', _label_string(self.labelnames, labels), cumulative))
+        return samples
+
+
+class Callback(object):
+    ''' Value computed only when metrics are scraped: credits left, cache sizes, queue depths. Nothing is done on the hot path.
+        "read()" returns a number, or {label values tuple: number} when there are labels.
+    '''
+    __slots__ = ('name', 'help', 'labelnames', 'read', 'KIND')
+
+    def __init__(self, name: str, help: str, read, labelnames: tuple = (), kind: str = 'gauge'):
+        self.name, self.help, self.labelnames, self.read, self.KIND = name, help, tuple(labelnames), read, kind
+
+    def samples(self) -> list:
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, _label_string(self.labelnames, labels), value) for labels, value in values.items() if value is not None]
+
+
+class Metrics(object):
+    ''' Registry of bot metrics in Prometheus text format, served over plain HTTP from a daemon thread.
+        Hot path code only increments counters and observes histograms. Everything that can be read from existing state (credits
+        left, cache counters, queue depth) is a Callback evaluated at scrape time.
+        Example:
+            METRICS = Metrics()
+            calls = METRICS.counter('cmc_calls_total', 'CMC API calls', ('endpoint',))
+            calls.inc('quotes')
+            METRICS.gauge('quote_cache_size', 'Quotes in memory', lambda: len(cache))
+            METRICS.serve(9100)  # curl localhost:9100/metrics
+    '''
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # seconds
+
+    def __init__(self):
+        self._metrics = {}  # name -> metric, in registration order
+        self._lock = threading.Lock()
+        self.server = None
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric  # Registering a name again (e.g. handlers added twice) replaces the old one
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = None) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets or self.DEFAULT_BUCKETS))
+
+    def gauge(self, name: str, help: str, read, labelnames: tuple = ()) -> Callback:
+        return self._register(Callback(name, help, read, labelnames, 'gauge'))
+
+    def counter_callback(self, name: str, help: str, read, labelnames: tuple = ()) -> Callback:
+        '''Counter kept somewhere else (e.g. QuoteCache.hits), read at scrape time.'''
+        return self._register(Callback(name, help, read, labelnames, 'counter'))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:  # One broken callback must not take the whole endpoint down
+                print('Metric {0} failed: {1}'.format(metric.name, e))
+                continue
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.KIND))
+            lines.extend('{0}{1} {2}'.format(name, labels, _number(value)) for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+        '''Starts GET /metrics on "port" in a daemon thread. Returns the server (server.server_address has the real port if 0 was given).'''
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # Scrapes every few seconds would flood the log
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+        print('Metrics served on http://{0}:{1}/metrics'.format(host, self.server.server_address[1]))
+        return self.server
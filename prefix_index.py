@@ -0,0 +1,92 @@
+import heapq
+from array import array  # Compact int storage: one machine int per key instead of a Python int object
+from bisect import bisect_left, bisect_right
+
+from symbol_index import UNRANKED  # Rank given to tokens CMC has not ranked
+
+
+class PrefixIndex(object):
+    ''' Autocomplete over CoinMarketCap crypto map: best ranked tokens whose symbol or name (or a word of the name) starts with
+        what the user typed so far. Built once when the map is loaded, answers from memory only.
+        Works like a trie flattened into one sorted list of keys: all keys under a prefix are one contiguous slice, found with
+        two binary searches. Prefixes with many keys under them (short ones like "b", or common words like "coin") get their
+        best candidates precomputed at build time -> no lookup ever ranks more than HEAVY_RANGE keys.
+        Ranking: CMC rank, with an exact symbol/name match never lower than 2nd.
+        Example:
+            index = PrefixIndex(crypto_entries)
+            index.complete('eth', 3)  -> [CryptoEntry(id=1027, symbol='ETH', name='Ethereum', ...), ...]
+    '''
+    __slots__ = ('_entries', '_keys', '_positions', '_top', 'limit', 'key_count')
+    HEAVY_RANGE = 64  # Prefixes with more keys under them get precomputed candidates.
+    MAX_KEY_LENGTH = 64  # Longer names are cut, nobody types that much into an inline query.
+
+    def __init__(self, crypto_entries: list = None, limit: int = 10):
+        self.limit = limit  # Most candidates complete() can return
+        # Position in this tuple is the rank order -> comparing positions compares ranks.
+        self._entries = tuple(sorted(crypto_entries or (), key=lambda entry: entry.rank if entry.rank is not None else UNRANKED))
+        pairs = set()
+        for position, entry in enumerate(self._entries):
+            name = (entry.name or '').casefold()
+            for key in [(entry.symbol or '').casefold(), name] + name.split()[1:]:
+                if key:
+                    pairs.add((key[:self.MAX_KEY_LENGTH], position))
+        pairs = sorted(pairs)
+        self._keys = [key for key, _ in pairs]
+        self._positions = array('l', [position for _, position in pairs])
+        self.key_count = len(self._keys)
+        self._top = self._precompute_heavy_prefixes()
+
+    def _precompute_heavy_prefixes(self) -> dict:
+        ''' Best candidates for every prefix with more than HEAVY_RANGE keys under it. A long prefix can only be heavy if its shorter
+            prefixes are too -> stops at the first length without any heavy prefix.
+        '''
+        top = {}
+        length = 1
+        while True:
+            heavy_found = False
+            start = 0
+            while start < self.key_count:
+                if len(self._keys[start]) < length:  # Key is shorter than the prefixes of this length -> under none of them
+                    start += 1
+                    continue
+                prefix = self._keys[start][:length]
+                end = bisect_right(self._keys, prefix + '\U0010ffff', start)
+                if end - start > self.HEAVY_RANGE:
+                    top[prefix] = self._rank_slice(prefix, start, end, self.limit)
+                    heavy_found = True
+                start = end
+            if heavy_found is False:
+                return top
+            length += 1
+
+    def _rank_slice(self, prefix: str, start: int, end: int, limit: int) -> tuple:
+        ''' Positions of best "limit" entries among keys[start:end], by CMC rank. Keys equal to prefix sort first in the slice ->
+            exact matches. Best ranked exact match is moved up to 2nd place if it's lower: typing "et" shows Ethereum first and
+            token "ET" right after it, not 40 better ranked tokens starting with "et" in between.
+        '''
+        exact_end = bisect_right(self._keys, prefix, start, end)
+        best = heapq.nsmallest(limit, set(self._positions[start:end]))
+        if exact_end > start:
+            exact = min(self._positions[start:exact_end])
+            if exact not in best[:2]:
+                best = best[:1] + [exact] + [position for position in best[1:] if position != exact]
+        return tuple(best[:limit])
+
+    def complete(self, text: str, limit: int = None) -> list:
+        '''Returns up to "limit" (default: self.limit) best candidates for a typed prefix, case insensitive. Empty list if none.'''
+        limit = self.limit if limit is None else min(limit, self.limit)
+        prefix = text.strip().casefold()[:self.MAX_KEY_LENGTH]
+        if not prefix or limit <= 0:
+            return []
+        positions = self._top.get(prefix)
+        if positions is None:
+            start = bisect_left(self._keys, prefix)
+            end = bisect_right(self._keys, prefix + '\U0010ffff', start)
+            if start == end:
+                return []
+            positions = self._rank_slice(prefix, start, end, limit)
+        return [self._entries[position] for position in positions[:limit]]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+
+class SamplingProfiler(object):
+    ''' Statistical profiler that can be switched on and off while the bot runs: a daemon thread looks at the stack of every other
+        thread each "interval" seconds (sys._current_frames) and counts how often each stack was seen. Costs nothing while stopped.
+        Waiting counts as much as computing -> shows where requests spend wall time, CMC and Telegram waits included.
+        Result: folded stacks ("thread;outer;inner count" lines, input of flamegraph.pl and speedscope) and a top list.
+        Example:
+            PROFILER = SamplingProfiler()
+            PROFILER.start()
+            ...
+            print(PROFILER.stop('profile.folded'))  # top functions, full stacks saved to the file
+    '''
+    INTERVAL = 0.005  # seconds between samples
+    MAX_DEPTH = 80  # frames kept per stack, innermost first
+    IDLE_FUNCTIONS = ('idle', 'select')  # Innermost frames of an idle thread: main thread in Updater.idle(), event loop with nothing ready
+    SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))  # Threads without a frame of bot's own code are idle library workers
+
+    def __init__(self, interval: float = None):
+        self.interval = interval or self.INTERVAL
+        self.stacks = Counter()  # (thread name, frame labels outermost first) -> samples
+        self.samples = 0
+        self.started = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._labels = {}  # code object -> "function (file.py:line)"
+        self._own_labels = set()  # labels of bot's own functions
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.stacks, self.samples, self.started = Counter(), 0, time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self, path: str = None) -> str:
+        '''Stops sampling. Saves folded stacks to "path" if given. Returns a short report.'''
+        if not self.running:
+            return 'Profiler is not running.'
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if path is not None:
+            self.save(path)
+        return self.report() + ('\nFolded stacks saved to {}'.format(path) if path is not None else '')
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            if code.co_filename.startswith(self.SOURCE_DIR):
+                self._own_labels.add(label)
+        return label
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.MAX_DEPTH:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if self._is_idle(stack):
+                    continue
+                self.stacks[(names.get(thread_id, str(thread_id)), tuple(self._label(code) for code in reversed(stack)))] += 1
+            self.samples += 1
+
+    def _is_idle(self, stack: list) -> bool:
+        ''' Thread waiting for work: pool workers and dispatcher on their queues, event loop in select() with nothing scheduled.
+            Thread waiting inside bot's code (e.g. handler waiting for a CMC reply) is busy -> waiting shows up in the profile.
+        '''
+        if len(stack) == 0 or stack[0].co_name in self.IDLE_FUNCTIONS:
+            return True
+        return not any(code.co_filename.startswith(self.SOURCE_DIR) for code in stack)
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for (thread, stack), count in self.stacks.most_common():
+                f.write('{0};{1} {2}\n'.format(thread, ';'.join(stack), count))
+
+    def report(self, top: int = 15) -> str:
+        ''' Bot functions seen most often, by "total": anywhere on the stack. "self": innermost bot function of the stack, i.e.
+            library code it called (HTTP, locks, waiting for a reply) is counted to it. Percentages are of all busy samples.
+        '''
+        busy = sum(self.stacks.values())
+        if busy == 0:
+            return 'Profiler: no busy samples in {0} rounds.'.format(self.samples)
+        own, total = Counter(), Counter()
+        for (_, stack), count in self.stacks.items():
+            own[next((label for label in reversed(stack) if label in self._own_labels), stack[-1])] += count
+            for label in set(stack):
+                total[label] += count
+        seconds = time.monotonic() - self.started if self.started is not None else 0
+        lines = ['Profiler: {0} rounds in {1:.1f} s, {2} busy thread samples.'.format(self.samples, seconds, busy), 'self  total  function']
+        for label, count in [(label, count) for label, count in total.most_common() if label in self._own_labels][:top]:
+            lines.append('{0:4.0%} {1:5.0%}  {2}'.format(own[label] / busy, count / busy, label))
+        return '\n'.join(lines)
@@ -0,0 +1,304 @@
+import time
+import pickle
+import asyncio
+import threading
+from collections import OrderedDict  # Keeps insertion/access order -> cheap LRU eviction
+from concurrent.futures import ThreadPoolExecutor  # Background refreshes of stale quotes
+
+from shared_store import StoreError, off_loop  # Store outage -> cache works as a plain local cache
+
+
+class QuoteCache(object):
+    ''' Bounded in-process cache for CoinMarketCap quotes, keyed by (token, convert currency).
+        CMC refreshes its quotes roughly once per minute, so asking again for BTC/USD a second later only burns a credit.
+        Entry lifetime:
+            age < ttl                  -> fresh. Served from memory ("hit").
+            ttl <= age < ttl + stale   -> stale. Served from memory right away ("stale hit") and refreshed in background.
+            older / not cached         -> fetched synchronously through loader ("miss").
+        Least recently used entries are evicted when the cache grows above max_size.
+        Loaders follow the same convention as CMCPrices fetch methods: they return (value, error), value is None on failure.
+        Failed loads are never cached. Works from plain threads (get) and from asyncio code (get_async).
+        With "shared" (SharedStore of several bot processes) the cache has a second level: a quote loaded by one process is
+        stored there too, a local miss looks there before calling CMC, and only one process at a time loads a missing or stale
+        quote while the others wait for its result -> N processes spend the credits of one. Store calls are short blocking
+        round trips in get(). The *_async() methods run them in store threads -> the event loop never waits on the store.
+    '''
+    LOAD_LOCK_SECONDS = 15  # Longest a process may hold the right to load a quote. Others load it themselves after that.
+    LOAD_POLL_SECONDS = 0.05  # How often processes waiting for a quote look at the store
+
+    def __init__(self, ttl: float = 60, stale_ttl: float = 240, max_size: int = 5000, refresh_workers: int = 2, shared=None):
+        self.TTL = ttl
+        self.STALE_TTL = stale_ttl
+        self.MAX_SIZE = max_size
+        self.SHARED = shared
+        self._entries = OrderedDict()  # key -> (timestamp, value)
+        self._refreshing = set()  # keys with a background refresh in progress -> never refreshed twice at once
+        self._refresh_tasks = set()  # asyncio refresh tasks. The loop keeps only weak references -> kept here until done.
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='quote-refresh')
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.shared_hits = 0  # Local misses answered by a quote another process loaded
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    def _lookup(self, key) -> tuple:
+        '''Returns (cached value or None, whether caller must start a background refresh). Updates counters.'''
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                age = now - cached[0]
+                if age < self.TTL:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached[1], False
+                if age < self.TTL + self.STALE_TTL:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    start_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return cached[1], start_refresh
+            self.misses += 1
+            return None, False
+
+    def get(self, key, loader) -> tuple:
+        '''Returns (value, error) for key. Uses cached value if possible, otherwise calls loader() and caches its result.'''
+        value, start_refresh = self._lookup(key)
+        if start_refresh is True:
+            self._executor.submit(self._refresh, key, loader)
+        if value is None:
+            value = self._shared_lookup(key)
+        if value is not None:
+            return value, None
+        claimed = self._claim(key)
+        if claimed is False:
+            while True:  # Another process is loading it
+                value, loading = self._shared_poll(key)
+                if value is not None:
+                    return value, None
+                if loading is False:
+                    break
+                time.sleep(self.LOAD_POLL_SECONDS)
+        try:
+            value, error = loader()
+        finally:
+            if claimed is True:
+                self._unclaim(key)
+        if value is not None:
+            self.put(key, value)
+        return value, error
+
+    async def get_async(self, key, loader) -> tuple:
+        ''' Same as get() for asyncio code: "loader" is a coroutine function, background refreshes run as tasks in the same loop
+            and store calls run in store threads.
+        '''
+        value, start_refresh = self._lookup(key)
+        if start_refresh is True:
+            task = asyncio.ensure_future(self._refresh_async(key, loader))
+            self._refresh_tasks.add(task)
+            task.add_done_callback(self._refresh_tasks.discard)
+        if value is None:
+            value = await off_loop(self.SHARED, self._shared_lookup, key)
+        if value is not None:
+            return value, None
+        claimed = await off_loop(self.SHARED, self._claim, key)
+        if claimed is False:
+            while True:
+                value, loading = await off_loop(self.SHARED, self._shared_poll, key)
+                if value is not None:
+                    return value, None
+                if loading is False:
+                    break
+                await asyncio.sleep(self.LOAD_POLL_SECONDS)
+        try:
+            value, error = await loader()
+            if value is not None:
+                await self.put_many_async([(key, value)])  # Stored before the claim goes -> waiting processes find it
+        finally:
+            if claimed is True:
+                self.SHARED.submit(self._unclaim, key)  # Nothing to wait for, also when cancelled
+        return value, error
+
+    # --- Second level: quotes shared by all bot processes ---
+
+    @staticmethod
+    def _shared_name(key) -> str:
+        return 'quote:' + ':'.join(map(str, key)) if isinstance(key, tuple) else 'quote:' + str(key)
+
+    def _shared_entry(self, data: bytes, key, max_age: float):
+        '''Quote from stored bytes if younger than "max_age". Copied into local cache with its real age.'''
+        if data is None:
+            return None
+        stored_at, value = pickle.loads(data)
+        age = time.time() - stored_at
+        if age >= max_age:
+            return None
+        self.put(key, value, timestamp=time.monotonic() - age, share=False)
+        return value
+
+    def _shared_get(self, key, max_age: float):
+        '''Quote of "key" another process stored, if younger than "max_age". None if there is none or no store.'''
+        if self.SHARED is None:
+            return None
+        try:
+            return self._shared_entry(self.SHARED.get(self._shared_name(key)), key, max_age)
+        except StoreError as e:
+            print(e)
+            return None
+
+    def _shared_lookup(self, key):
+        '''Fresh quote of "key" loaded by another process, or None. Counted as a shared hit instead of a miss.'''
+        value = self._shared_get(key, self.TTL)
+        if value is not None:
+            with self._lock:
+                self.misses -= 1
+                self.shared_hits += 1
+        return value
+
+    def _shared_poll(self, key) -> tuple:
+        '''(quote or None, whether some process still holds the right to load it).'''
+        name = self._shared_name(key)
+        try:
+            data, lock = self.SHARED.mget([name, 'lock:' + name])
+            return self._shared_entry(data, key, self.TTL), lock is not None
+        except StoreError as e:
+            print(e)
+            return None, False
+
+    def _claim(self, key) -> bool or None:
+        '''Right to load "key" for all processes: True -> got it, False -> another process has it, None -> no store (load anyway).'''
+        if self.SHARED is None:
+            return None
+        try:
+            return self.SHARED.set('lock:' + self._shared_name(key), b'1', ttl=self.LOAD_LOCK_SECONDS, nx=True)
+        except StoreError as e:
+            print(e)
+            return None
+
+    def _unclaim(self, key) -> None:
+        try:
+            self.SHARED.delete('lock:' + self._shared_name(key))
+        except StoreError as e:
+            print(e)
+
+    def _peek_local(self, key, max_age: float):
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is None or time.monotonic() - cached[0] >= max_age:
+            return None
+        return cached[1]
+
+    def peek(self, key, max_age: float = None):
+        '''Returns cached value without loading or touching counters. None if missing or older than max_age (default: ttl + stale).'''
+        max_age = self.TTL + self.STALE_TTL if max_age is None else max_age
+        value = self._peek_local(key, max_age)
+        return value if value is not None else self._shared_get(key, max_age)
+
+    async def peek_async(self, key, max_age: float = None):
+        '''peek() for asyncio code.'''
+        max_age = self.TTL + self.STALE_TTL if max_age is None else max_age
+        value = self._peek_local(key, max_age)
+        if value is None and self.SHARED is not None:
+            value = await self.SHARED.run_async(self._shared_get, key, max_age)
+        return value
+
+    def put(self, key, value, timestamp: float = None, share: bool = True) -> None:
+        '''Stores value for key. Also used by background jobs to fill the cache ahead of user requests.'''
+        self.put_many([(key, value)], timestamp, share)
+
+    def put_many(self, items: list, timestamp: float = None, share: bool = True) -> None:
+        '''put() of [(key, value)], with one store round trip for all of them.'''
+        timestamp = self._put_local(items, timestamp)
+        if self.SHARED is not None and share is True:
+            self._put_shared(items, timestamp)
+
+    async def put_many_async(self, items: list) -> None:
+        '''put_many() for asyncio code: cached here right away, copied to the store from a store thread.'''
+        timestamp = self._put_local(items)
+        if self.SHARED is not None:
+            await self.SHARED.run_async(self._put_shared, items, timestamp)
+
+    def _put_local(self, items: list, timestamp: float = None) -> float:
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (timestamp, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.MAX_SIZE:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return timestamp
+
+    def _put_shared(self, items: list, timestamp: float) -> None:
+        stored_at = time.time() - (time.monotonic() - timestamp)
+        try:
+            self.SHARED.set_many([(self._shared_name(key), pickle.dumps((stored_at, value), protocol=pickle.HIGHEST_PROTOCOL))
+                                  for key, value in items], ttl=self.TTL + self.STALE_TTL)
+        except StoreError as e:
+            print(e)
+
+    def _refresh_claim(self, key) -> bool:
+        ''' Whether this process should refresh stale "key" itself. Not if another process already has a fresh quote (it's
+            copied in) or is loading one right now (the stale quote is served meanwhile).
+        '''
+        if self.SHARED is None:
+            return True
+        if self._shared_get(key, self.TTL) is not None or self._claim(key) is False:
+            with self._lock:
+                self._refreshing.discard(key)
+            return False
+        return True
+
+    def _refresh(self, key, loader) -> None:
+        if self._refresh_claim(key) is False:
+            return
+        try:
+            value, error = loader()
+        except Exception as e:
+            value, error = None, e
+        self._refresh_done(key, value, error)
+
+    async def _refresh_async(self, key, loader) -> None:
+        if await off_loop(self.SHARED, self._refresh_claim, key) is False:
+            return
+        try:
+            value, error = await loader()
+        except Exception as e:
+            value, error = None, e
+        await off_loop(self.SHARED, self._refresh_done, key, value, error)
+
+    def _refresh_done(self, key, value, error) -> None:
+        if value is not None:
+            self.put(key, value)
+        if self.SHARED is not None:
+            self._unclaim(key)
+        with self._lock:
+            self._refreshing.discard(key)
+            if value is not None:
+                self.refreshes += 1
+            else:
+                self.refresh_errors += 1
+        if value is None:
+            print('Background refresh of quote {0} failed: {1}'.format(key, error))
+
+    def stats(self) -> dict:
+        '''Hit/miss counters. Every hit or stale hit is a CMC credit that was not spent.'''
+        with self._lock:
+            served = self.hits + self.stale_hits + self.shared_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.stale_hits + self.shared_hits) / served if served else 0.0,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,116 @@
+from bisect import bisect_left, bisect_right
+from math import ceil, floor, log10
+
+
+def round_nonzero(number, digits_to_keep: int = 2) -> str:
+    ''' Rounds a number for a print, keeping its first NON-ZERO digits. Returns a string.
+        Example: 0.00005412323132 -> '0.000054', 1234.5678 -> '1234.57'
+        Numbers below 1 keep "digits_to_keep" significant digits (cut, not rounded), others "digits_to_keep" decimals.
+        Works with arithmetic only: position of the first non-zero digit is log10 of the number, the digits are cut from its exact
+        integer ratio -> same output as printing 99 decimals and searching it with a regex, for a fraction of the cost.
+    '''
+    if number == 0:
+        return str(number)
+    number = float(number)
+    n = abs(number)
+    if n >= 1:
+        return repr(round(number, digits_to_keep))
+    decimals = digits_to_keep - 1 - floor(log10(n))  # 0.000054 -> 1st non-zero digit is 5th decimal -> keep 6 decimals
+    numerator, denominator = n.as_integer_ratio()  # Exact value of the float -> cutting digits never rounds anything up
+    digits = numerator * 10 ** decimals // denominator
+    if digits < 10 ** (digits_to_keep - 1):  # log10() rounded up, number is just below a power of 10
+        decimals += 1
+        digits = numerator * 10 ** decimals // denominator
+    elif digits >= 10 ** digits_to_keep:  # log10() rounded down
+        decimals -= 1
+        digits //= 10
+    if number < 0:
+        return repr(-(digits / 10 ** decimals))  # Negative numbers always printed as a float: -0.1, -5.4e-05
+    return '0.' + str(digits).rjust(decimals, '0')
+
+
+def ceil_rounded(number, digits_to_keep: int = 2) -> int:
+    '''ceil() of round_nonzero(number). Market cap and volume are printed as whole numbers.'''
+    number = float(number)
+    if abs(number) >= 1:
+        return ceil(round(number, digits_to_keep))
+    return 1 if number > 0 else 0  # Anything between 0 and 1 keeps a non-zero digit -> rounds up to 1
+
+
+class QuoteRenderer(object):
+    ''' Formats CMC token quotes into Telegram messages (Markdown).
+        Message layout is one format string, filled in once per currency and then reused -> rendering a quote is a single
+        %-formatting of a tuple. Emoji for 24h change is a bisect over thresholds instead of an if/elif cascade.
+        render_many() formats several quotes in one go: multi-symbol replies, batched inline answers.
+        Example:
+            renderer = QuoteRenderer(CMC_URL, EMOJIS)
+            renderer.render(token_quote, 'USD', 'bitcoin')  -> '\\n[Bitcoin (BTC)](https://coinmarketcap.com/currencies/bitcoin)...'
+    '''
+    DIGITS_TO_KEEP = 2
+    # Filled in by render(), in this order: status line, name, symbol, CMC url, project link, price, market cap, volume, 24h change,
+    # its emoji, last updated. Positional %-formatting of a tuple is several times cheaper than str.format() with keywords here.
+    TEMPLATE = ('%s\n[%s (%s)](%s)%s'
+                'Price:                  *%s* {currency}\n'
+                'Market Cap:     %s {currency}\n'
+                'Volume 24h:    %s {currency}\n'
+                'Pct.Ch. 24h:      %s%% %s\n'
+                'Last Updated: %s UTC+0\n\n'
+                '[Powered by @crypto_price_finder_bot](https://t.me/crypto_price_finder_bot){tree}')
+    PROJECT_LINK = '         [Project page]({})\n\n'
+    STATUS_LINE = '_Currency {0} was not found. Used default {1} instead._\n'
+    # 24h change -> emoji. Growth of 2% or more: thresholds where the emoji changes, from the lowest one up. Same for drops.
+    GROWTH_THRESHOLDS = (2, 15, 25, 50)
+    DROP_THRESHOLDS = (-50, -25, -15, -2)
+
+    def __init__(self, cmc_url: str, emojis: dict):
+        self.cmc_url = cmc_url
+        self.zzz = emojis['zzz']
+        self.growth = (emojis['thumbs_up'], emojis['rocket'], emojis['rocket'] * 2, emojis['rocket'] * 3)
+        self.drops = (emojis['red_triangle'] * 3, emojis['red_triangle'] * 2, emojis['red_triangle'], emojis['thumbs_down'])
+        self.tree = emojis['tree']
+        self._templates = {}  # currency -> TEMPLATE with currency and constant emojis filled in
+
+    def template(self, currency: str) -> str:
+        template = self._templates.get(currency)
+        if template is None:
+            escaped = currency.replace('%', '%%')  # Blind queries may pass any currency text the user typed
+            template = self._templates[currency] = self.TEMPLATE.replace('{currency}', escaped).replace('{tree}', self.tree)
+        return template
+
+    def change_emoji(self, change: float) -> str:
+        if change >= 2:
+            return self.growth[bisect_right(self.GROWTH_THRESHOLDS, change) - 1]
+        if change >= -2:
+            return self.zzz
+        return self.drops[bisect_left(self.DROP_THRESHOLDS, change)]
+
+    def render(self, token_quote: dict, currency: str, slug: str, project_url: str = '', old_currency: str = None) -> str:
+        ''' One quote ("data" item of CMC quotes/latest) in "currency" as a message.
+            "old_currency" is the currency the user asked for if it was not found and "currency" was used instead.
+        '''
+        values = token_quote['quote'][currency]
+        digits = self.DIGITS_TO_KEEP
+        change = values['percent_change_24h']
+        if abs(change) >= 1:
+            change = round(float(change), digits)
+            change_text = repr(change)
+        else:
+            change_text = round_nonzero(change, digits)
+        return self.template(currency) % (
+            self.STATUS_LINE.format(old_currency, currency) if old_currency is not None else '',
+            token_quote['name'],
+            token_quote['symbol'],
+            self.cmc_url + slug,
+            self.PROJECT_LINK.format(project_url) if len(project_url) > 0 else '\n\n',
+            round_nonzero(values['price'], digits),
+            format(ceil_rounded(values['market_cap'], digits), ','),
+            format(ceil_rounded(values['volume_24h'], digits), ','),
+            change_text,
+            self.change_emoji(change),  # Anything between -1 and 1 is "zzz", no matter how it is rounded
+            values['last_updated'][:-5].partition('T')[2],  # '2021-05-01T12:34:56.000Z' -> '12:34:56'
+        )
+
+    def render_many(self, quotes: list) -> list:
+        '''Renders [(token_quote, currency, slug, project_url, old_currency)] -> list of messages in the same order.'''
+        render = self.render
+        return [render(*quote) for quote in quotes]
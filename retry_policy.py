@@ -0,0 +1,165 @@
+import time
+import random
+import asyncio
+
+from coinmarketcapapi import CoinMarketCapAPIError  # 3rd party 1:1 wrapper to CoinMarketCap API
+
+from cmc_async import CMCTransportError  # CMC could not be reached at all
+from credit_budget import OutOfCreditsError  # Call refused locally by credit accounting
+import tracing  # Backoff waits show up in request traces
+
+
+class CircuitOpenError(CoinMarketCapAPIError):
+    '''Raised without calling CMC while circuit breaker is open (CMC looks down). Handled like any other failed CMC request.'''
+
+    def __init__(self, message: str):
+        Exception.__init__(self, message)
+        self.rep = None
+
+
+def error_code_of(error: Exception) -> int or None:
+    ''' CMC error code of a failed request: 1001-1011 for API key/plan/limit errors, HTTP status (400, 500, ...) for others,
+        999 when the reply was not JSON at all (e.g. an HTML error page of a proxy). None for errors without a CMC reply.
+    '''
+    rep = getattr(error, 'rep', None)
+    if rep is None:
+        return None
+    code = rep.status.get('error_code')
+    if isinstance(code, str):  # "999 [LOCAL_JSON_DECODE_ERROR]"
+        digits = code.split(' ', 1)[0]
+        return int(digits) if digits.isdigit() else None
+    return code
+
+
+def http_status_of(error: Exception) -> int or None:
+    '''HTTP status of the reply that caused the error. None if CMC could not be reached.'''
+    return getattr(getattr(error, 'rep', None), 'http_status', None)
+
+
+class CircuitBreaker(object):
+    ''' Fails fast when CMC is down, instead of letting every request wait for its own timeout.
+            closed     -> calls go through. "failure_threshold" outage failures in a row open the circuit.
+            open       -> calls fail immediately with CircuitOpenError for "reset_timeout" seconds.
+            half-open  -> one probe call is let through. Success closes the circuit, failure opens it again.
+        Only outage failures count (connection errors, timeouts, HTTP 5xx) -> a misspelled symbol never opens the circuit.
+        Only used from one asyncio loop, so it needs no locking.
+    '''
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self) -> bool:
+        '''Raises CircuitOpenError if the call may not go. True -> the call is the half-open probe.'''
+        state = self.state
+        if state == 'open' or (state == 'half-open' and self.probe_in_flight):
+            raise CircuitOpenError('CoinMarketCap looks down, not calling it for a while')
+        if state == 'half-open':
+            self.probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        '''Probe never reached CMC (refused locally, e.g. out of credits) -> state stays, the next call may probe.'''
+        self.probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures, self.opened_at, self.probe_in_flight = 0, None, False
+
+    def record_failure(self, outage: bool) -> None:
+        was_probe, self.probe_in_flight = self.probe_in_flight, False
+        if outage is False:
+            if was_probe is True:  # CMC answered, so it is up again
+                self.failures, self.opened_at = 0, None
+            return
+        self.failures += 1
+        if was_probe is True or self.failures >= self.failure_threshold:
+            if self.opened_at is None or was_probe is True:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+            print('CMC circuit breaker opened after {} failures.'.format(self.failures))
+
+
+class RetryPolicy(object):
+    ''' One retry policy for every CMC call: exponential backoff with full jitter, retries only for errors that can succeed
+        on a second try, an overall deadline per call and a circuit breaker. Waiting happens with asyncio.sleep -> no thread is parked.
+        Classified by CMC error code, then by HTTP status of the reply:
+        Retried:     connection errors/timeouts, HTTP 429/5xx, non-JSON replies (999), rate limits 1008-1011 (KeyPool then
+                     routes the retry to another key or refuses it right away if there is none).
+        Not retried: invalid/missing key (1001, 1002), plan and permission errors (1003-1007), bad request like an unknown
+                     symbol (400), calls refused locally (out of credits, circuit open).
+    '''
+    RETRYABLE_CODES = {429, 500, 502, 503, 504, 999, 1008, 1009, 1010, 1011}
+    OUTAGE_CODES = {500, 502, 503, 504, 999}
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4, deadline: float = 8,
+                 breaker: CircuitBreaker = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.retries = 0
+        self.gave_up = 0
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (OutOfCreditsError, CircuitOpenError)):
+            return False
+        if isinstance(error, (CMCTransportError, asyncio.TimeoutError)):
+            return True
+        return error_code_of(error) in self.RETRYABLE_CODES or http_status_of(error) in self.RETRYABLE_CODES
+
+    def is_outage(self, error: Exception) -> bool:
+        if isinstance(error, (CMCTransportError, asyncio.TimeoutError)):
+            return True
+        return error_code_of(error) in self.OUTAGE_CODES or (http_status_of(error) or 0) >= 500
+
+    def backoff(self, attempt: int) -> float:
+        '''Full jitter: random delay between 0 and base_delay * 2^attempt (capped at max_delay).'''
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, attempt_fn):
+        ''' Runs coroutine function "attempt_fn" until it succeeds, fails with non-retryable error, runs out of attempts or
+            would not finish before the deadline. Re-raises the last error.
+        '''
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            probe = self.breaker.before_call()
+            try:
+                result = await asyncio.wait_for(attempt_fn(), timeout=max(0.01, deadline - time.monotonic()))
+            except (CoinMarketCapAPIError, asyncio.TimeoutError) as e:
+                if isinstance(e, (OutOfCreditsError, CircuitOpenError)):
+                    if probe is True:
+                        self.breaker.release_probe()
+                else:
+                    self.breaker.record_failure(self.is_outage(e))
+                attempt += 1
+                delay = self.backoff(attempt)
+                if not self.is_retryable(e) or attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    self.gave_up += 1
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise CMCTransportError('No reply from CMC within {} seconds'.format(self.deadline))
+                    raise
+                self.retries += 1
+                with tracing.span('retry backoff'):
+                    await asyncio.sleep(delay)
+                continue
+            except BaseException:  # Cancelled, or a bug -> CMC told nothing either
+                if probe is True:
+                    self.breaker.release_probe()
+                raise
+            self.breaker.record_success()
+            return result
@@ -0,0 +1,273 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from telegram.error import RetryAfter  # 429 Too Many Requests, carries the wait Telegram asks for
+
+
+class TokenBucket(object):
+    '''"rate" sends per second, up to "burst" of them saved up. pause() -> no sends at all until the pause is over.'''
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait(self, now: float) -> float:
+        '''Seconds until the next send may go, 0 if it may go now.'''
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens, self.updated = 1, self.paused_until  # One send when the pause ends, no burst -> not right into another 429
+
+    def full(self, now: float) -> bool:
+        return now >= self.paused_until and self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Send(object):
+    '''One queued Bot API call. Text messages keep their parts (text, kwargs) so neighbours can be merged into one message.'''
+    __slots__ = ('key', 'chat_id', 'priority', 'seq', 'call', 'text', 'kwargs', 'futures', 'attempts')
+
+    def __init__(self, key, chat_id, priority: int, seq: int, call=None, text: str = None, kwargs: dict = None):
+        self.key = key
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.call = call
+        self.text = text
+        self.kwargs = kwargs
+        self.futures = [Future()]
+        self.attempts = 0
+
+
+class SendQueue(object):
+    ''' Outbound Telegram Bot API calls, sent by "workers" threads within Telegram's flood limits instead of straight from handlers:
+        about 30 messages per second in total and 1 per second per chat (20 per minute in groups), with short bursts allowed.
+        Going over them gets 429 "retry after N" replies -> messages late or lost.
+        - Token buckets: one for all chats, one per chat. A message waits until both have a token.
+        - Priority: PRIORITY_REPLY (quotes, inline answers, buttons) goes before PRIORITY_NORMAL before PRIORITY_BULK (long lists).
+        - One call in flight per chat, the rest of that chat's queue in order -> a text and the image sent after it arrive in order.
+        - Texts queued for the same chat with the same options (no keyboard) are sent as one message, up to MAX_TEXT_LENGTH.
+        - 429 -> the call goes back to the front of its chat's queue and the chat pauses for Telegram's "retry_after".
+        Calls without a chat (inline query and callback query answers) are not messages: no rate limit, only a global pause.
+        Every call returns a concurrent.futures.Future of its result. Errors are printed and set on the future.
+        Example:
+            SEND = SendQueue()
+            SEND.start(updater.bot)
+            SEND.text(chat_id, 'BTC: 1 USD', SEND.PRIORITY_REPLY, parse_mode='Markdown')
+            SEND.call(chat_id, lambda: bot.send_photo(chat_id=chat_id, photo=file_id), SEND.PRIORITY_REPLY)
+            SEND.call(None, lambda: update.inline_query.answer(results), SEND.PRIORITY_REPLY)
+    '''
+    PRIORITY_REPLY, PRIORITY_NORMAL, PRIORITY_BULK = 0, 1, 2
+    GLOBAL_RATE = 30  # messages per second, all chats together
+    GLOBAL_BURST = 30
+    CHAT_RATE = 1  # messages per second to one private chat
+    GROUP_RATE = 20 / 60  # messages per second to one group or channel (negative chat id)
+    CHAT_BURST = 3  # e.g. a quote, its "out of mana" image and one more go out right away
+    MAX_TEXT_LENGTH = 4096  # Longest message Telegram takes -> merged texts never get longer
+    MERGE_SEPARATOR = '\n\n'
+    MAX_ATTEMPTS = 4  # 429 replies a call may get before it fails
+    PRUNE_SECONDS = 60  # How often buckets of chats that have been quiet long enough are dropped
+
+    def __init__(self, workers: int = 8, global_rate: float = None):
+        self.workers = workers
+        self.bot = None
+        self._lock = threading.Condition()
+        self._chats = {}  # key (chat id, or unique key of a call without chat) -> deque of _Send, oldest first
+        self._ready = []  # heap of (priority, seq, key): chats with something queued and no call in flight
+        self._busy = set()  # keys with a call in flight
+        self._buckets = {}  # chat id -> TokenBucket
+        now = time.monotonic()
+        self._global = TokenBucket(global_rate or self.GLOBAL_RATE, self.GLOBAL_BURST, now)
+        self._pruned = now
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopping = False
+        self.queued = 0  # calls waiting, merged ones counted separately
+        self.sent = 0
+        self.merged = 0  # texts sent as part of another message
+        self.retried = 0  # 429 replies
+        self.failed = 0
+
+    def start(self, bot) -> None:
+        '''Sets the bot text() sends with and starts the sending threads (once).'''
+        self.bot = bot
+        with self._lock:
+            if len(self._threads) > 0:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name='telegram-send-{}'.format(i), daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        '''Sends what is queued (as long as it takes at most "timeout" seconds), then stops the threads.'''
+        with self._lock:
+            self._stopping = True
+            self._lock.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def text(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> Future:
+        '''Queues bot.send_message(chat_id=chat_id, text=text, **kwargs). Future of the sent telegram.Message (shared, if merged).'''
+        return self._put(_Send(chat_id, chat_id, priority, next(self._seq), text=text, kwargs=kwargs))
+
+    def call(self, chat_id: int or None, call, priority: int = PRIORITY_NORMAL) -> Future:
+        '''Queues any Bot API call, "call()" makes it. "chat_id": chat it sends to, None if it sends no message (answers).'''
+        seq = next(self._seq)
+        return self._put(_Send(chat_id if chat_id is not None else ('call', seq), chat_id, priority, seq, call=call))
+
+    def _put(self, item: _Send) -> Future:
+        with self._lock:
+            chat = self._chats.get(item.key)
+            if chat is None:
+                chat = self._chats[item.key] = deque()
+            chat.append(item)
+            if len(chat) == 1 and item.key not in self._busy:
+                heapq.heappush(self._ready, (item.priority, item.seq, item.key))
+            self.queued += 1
+            self._lock.notify()
+        return item.futures[0]
+
+    def _bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.GROUP_RATE if chat_id < 0 else self.CHAT_RATE
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.CHAT_BURST, now)
+        return bucket
+
+    def _wait(self, item: _Send, now: float) -> float:
+        if item.chat_id is None:
+            return max(0.0, self._global.paused_until - now)
+        return max(self._global.wait(now), self._bucket(item.chat_id, now).wait(now))
+
+    def _can_merge(self, first: _Send, second: _Send) -> bool:
+        return (first.text is not None and second.text is not None and first.kwargs == second.kwargs
+                and 'reply_markup' not in first.kwargs
+                and len(first.text) + len(self.MERGE_SEPARATOR) + len(second.text) <= self.MAX_TEXT_LENGTH)
+
+    def _next(self) -> _Send or None:
+        '''Waits for the best call that may go now and takes it (tokens, merged neighbours). None -> stop.'''
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                if now - self._pruned > self.PRUNE_SECONDS:
+                    self._prune(now)
+                delay, blocked, item = None, [], None
+                while len(self._ready) > 0:  # Best first. Chats out of tokens are skipped, they don't hold up the others.
+                    entry = heapq.heappop(self._ready)
+                    wait = self._wait(self._chats[entry[2]][0], now)
+                    if wait <= 0:
+                        item = self._chats[entry[2]].popleft()
+                        break
+                    blocked.append(entry)
+                    delay = wait if delay is None else min(delay, wait)
+                for entry in blocked:
+                    heapq.heappush(self._ready, entry)
+                if item is not None:
+                    return self._take(item, now)
+                if self._stopping and len(self._ready) == 0 and len(self._busy) == 0:
+                    self._lock.notify_all()
+                    return None
+                self._lock.wait(delay)
+
+    def _take(self, item: _Send, now: float) -> _Send:
+        chat = self._chats[item.key]
+        if item.chat_id is not None:
+            self._global.take(now)
+            self._bucket(item.chat_id, now).take(now)
+        self._busy.add(item.key)
+        self.queued -= 1
+        while len(chat) > 0 and self._can_merge(item, chat[0]):
+            following = chat.popleft()
+            item.text += self.MERGE_SEPARATOR + following.text
+            item.futures.extend(following.futures)
+            self.queued -= 1
+            self.merged += 1
+        return item
+
+    def _finish(self, item: _Send) -> None:
+        '''Call is done (or goes back to the queue) -> next one of its chat may go.'''
+        with self._lock:
+            self._busy.discard(item.key)
+            chat = self._chats[item.key]
+            if len(chat) > 0:
+                heapq.heappush(self._ready, (chat[0].priority, chat[0].seq, item.key))
+            else:
+                del self._chats[item.key]
+            self._lock.notify_all()
+
+    def _prune(self, now: float) -> None:
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items() if chat_id not in self._chats and bucket.full(now)]:
+            del self._buckets[chat_id]
+        self._pruned = now
+
+    def _send(self, item: _Send):
+        if item.text is not None:
+            return self.bot.send_message(chat_id=item.chat_id, text=item.text, **item.kwargs)
+        return item.call()
+
+    def _run(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            try:
+                result = self._send(item)
+            except RetryAfter as e:
+                self._retry(item, e)
+                continue
+            except Exception as e:
+                self.failed += 1
+                print('Telegram call to chat {0} failed: {1!r}'.format(item.chat_id, e))
+                for future in item.futures:
+                    future.set_exception(e)
+            else:
+                self.sent += 1
+                for future in item.futures:
+                    future.set_result(result)
+            self._finish(item)
+
+    def _retry(self, item: _Send, error: RetryAfter) -> None:
+        self.retried += 1
+        item.attempts += 1
+        if item.attempts >= self.MAX_ATTEMPTS:
+            print('Telegram call to chat {0} failed after {1} flood waits: {2}'.format(item.chat_id, item.attempts, error))
+            self.failed += 1
+            for future in item.futures:
+                future.set_exception(error)
+            self._finish(item)
+            return
+        now = time.monotonic()
+        with self._lock:
+            # Calls without a chat can only have hit a limit of the whole bot
+            bucket = self._global if item.chat_id is None else self._bucket(item.chat_id, now)
+            bucket.pause(error.retry_after, now)
+            self._chats[item.key].appendleft(item)
+            self.queued += 1
+        self._finish(item)
+
+    def stats(self) -> dict:
+        return {'queued': self.queued, 'sent': self.sent, 'merged': self.merged, 'retried': self.retried, 'failed': self.failed}
@@ -0,0 +1,457 @@
+import sys
+import time
+import pickle
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+from urllib.parse import urlparse
+from concurrent.futures import Future, ThreadPoolExecutor  # Store calls of asyncio code run in threads of their own
+
+
+class StoreError(ConnectionError):
+    '''Shared store could not be reached or refused a command. Callers fall back to process-local state.'''
+
+
+class SharedStore(object):
+    ''' Client of a Redis compatible server (real Redis, or StoreServer below) for state shared by several bot processes:
+        quotes, maps, fiat rates and credit counters. Speaks plain RESP over one socket per thread, no extra dependency.
+        Every call has a short timeout and raises StoreError on failure -> a store outage never hangs a lookup, callers
+        just use their own process-local data.
+        Values are bytes. *_obj() methods pickle/unpickle Python objects. All keys are prefixed, so a shared Redis is fine.
+        Calls block the calling thread for a round trip. Asyncio code runs them with run_async() (or off_loop() below) in
+        the store's own threads instead -> a slow or unreachable store never stalls the event loop.
+        Example:
+            STORE = SharedStore('redis://127.0.0.1:6379')
+            STORE.set_obj('fiat_map', ['USD', 'EUR'], ttl=3600)
+            fiat_map = STORE.get_obj('fiat_map')
+            crypto_map = STORE.get_or_fill('crypto_map', fetch_crypto_map, ttl=86400)  # only one process calls fetch_crypto_map()
+            fiat_map = await STORE.run_async(STORE.get_obj, 'fiat_map')  # from asyncio code
+    '''
+    TIMEOUT = 0.5  # seconds per command, connecting included
+    PREFIX = 'cryptobot:'
+    LOCK_WAIT = 5  # seconds get_or_fill() waits for the process that holds the fill lock before filling by itself
+    LOCK_POLL = 0.05  # seconds between looks at the store while waiting
+    THREADS = 8  # Threads running store calls for submit()/run_async(), each with its own connection
+
+    def __init__(self, url: str, timeout: float = None):
+        parsed = urlparse(url)
+        assert parsed.scheme in ('redis', 'rediss'), 'Store url must be redis://[:password@]host:port. You provided: "{}"'.format(url)
+        self.url = url
+        self.host, self.port = parsed.hostname or '127.0.0.1', parsed.port or 6379
+        self.password = parsed.password
+        self.use_tls = parsed.scheme == 'rediss'  # Heroku Redis
+        self.timeout = timeout or self.TIMEOUT
+        self._local = threading.local()  # Connection of the current thread
+        self._executor = None  # Started on first submit()
+        self._executor_lock = threading.Lock()
+
+    # --- Protocol ---
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.use_tls:
+            import ssl
+            context = ssl.create_default_context()
+            context.check_hostname, context.verify_mode = False, ssl.CERT_NONE  # Heroku Redis uses self-signed certificates
+            sock = context.wrap_socket(sock, server_hostname=self.host)
+        conn = sock, sock.makefile('rb')
+        if self.password:
+            self._send(conn, [('AUTH', self.password)])
+        return conn
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    @classmethod
+    def _read_reply(cls, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise StoreError('Connection closed by the store')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode('utf-8')
+        if kind == b'-':
+            return StoreError(payload.decode('utf-8'))  # Returned, not raised -> the other replies of a pipeline are still read
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            return None if length < 0 else [cls._read_reply(reader) for _ in range(length)]
+        raise StoreError('Unexpected reply from the store: {!r}'.format(line))
+
+    def _send(self, conn, commands: list) -> list:
+        sock, reader = conn
+        sock.sendall(b''.join(self._encode(command) for command in commands))
+        replies = [self._read_reply(reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StoreError):
+                raise reply
+        return replies
+
+    def execute(self, *commands) -> list:
+        '''Sends commands (tuples like ('GET', key)) in one round trip and returns their replies. Reconnects once if needed.'''
+        for attempt in (1, 2):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = self._connect()
+                return self._send(conn, list(commands))
+            except (OSError, StoreError) as e:
+                self.close()
+                if attempt == 2 or not isinstance(e, OSError):
+                    raise StoreError('Shared store {0}:{1}: {2}'.format(self.host, self.port, e)) from e
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[0].close()
+            except OSError:
+                pass
+
+    def submit(self, fn, *args) -> Future:
+        '''Runs "fn(*args)", a function making store calls, in one of the store's threads. For callers that must not wait.'''
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.THREADS, thread_name_prefix='shared-store')
+        return self._executor.submit(fn, *args)
+
+    def run_async(self, fn, *args) -> asyncio.Future:
+        '''submit() to await from asyncio code.'''
+        return asyncio.wrap_future(self.submit(fn, *args))
+
+    # --- Commands ---
+
+    def key(self, name: str) -> str:
+        return self.PREFIX + name
+
+    def ping(self) -> bool:
+        return self.execute(('PING',))[0] == 'PONG'
+
+    def get(self, name: str) -> bytes or None:
+        return self.execute(('GET', self.key(name)))[0]
+
+    def mget(self, names: list) -> list:
+        if len(names) == 0:
+            return []
+        return self.execute(('MGET',) + tuple(self.key(name) for name in names))[0]
+
+    def set(self, name: str, value: bytes, ttl: float = None, nx: bool = False) -> bool:
+        '''Stores value, for "ttl" seconds if given. "nx" -> only if the key doesn't exist yet. Returns whether it was stored.'''
+        return self.execute(self._set_command(name, value, ttl, nx))[0] == 'OK'
+
+    def set_many(self, items: list, ttl: float = None) -> None:
+        '''Stores [(name, value)] in one round trip.'''
+        if len(items) > 0:
+            self.execute(*[self._set_command(name, value, ttl) for name, value in items])
+
+    def _set_command(self, name: str, value: bytes, ttl: float = None, nx: bool = False) -> tuple:
+        command = ('SET', self.key(name), value)
+        if ttl is not None:
+            command += ('PX', max(1, int(ttl * 1000)))
+        return command + ('NX',) if nx is True else command
+
+    def delete(self, *names) -> int:
+        return self.execute(('DEL',) + tuple(self.key(name) for name in names))[0]
+
+    def incrby_many(self, increments: list) -> list:
+        '''[(name, amount, ttl)] -> new values, in one round trip. "ttl" (seconds, may be None) is renewed on every increment.'''
+        commands = []
+        for name, amount, ttl in increments:
+            commands.append(('INCRBY', self.key(name), int(amount)))
+            if ttl is not None:
+                commands.append(('PEXPIRE', self.key(name), int(ttl * 1000)))
+        replies = self.execute(*commands)
+        return [reply for command, reply in zip(commands, replies) if command[0] == 'INCRBY']
+
+    def push(self, name: str, values: list, max_len: int, ttl: float = None) -> None:
+        '''Appends values to a list, keeping only its last "max_len" items.'''
+        if len(values) == 0:
+            return
+        commands = [('RPUSH', self.key(name)) + tuple(values), ('LTRIM', self.key(name), -max_len, -1)]
+        if ttl is not None:
+            commands.append(('PEXPIRE', self.key(name), int(ttl * 1000)))
+        self.execute(*commands)
+
+    def pop_all(self, name: str) -> list:
+        '''Takes every item of a list at once (MULTI/EXEC -> nothing pushed in between is lost).'''
+        return self.execute(('MULTI',), ('LRANGE', self.key(name), 0, -1), ('DEL', self.key(name)), ('EXEC',))[-1][0]
+
+    def get_obj(self, name: str):
+        data = self.get(name)
+        return pickle.loads(data) if data is not None else None
+
+    def set_obj(self, name: str, value, ttl: float = None) -> bool:
+        return self.set(name, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+
+    # --- Fill once for all processes ---
+
+    def get_or_fill(self, name: str, fill, ttl: float, lock_ttl: float = 30):
+        ''' Object stored under "name". If there is none, exactly one process calls "fill()" (returns the object or None on failure)
+            and stores its result for "ttl" seconds, while the others wait up to LOCK_WAIT seconds for it. Used for things that
+            cost CMC credits: N processes starting at once fetch the crypto map once, not N times.
+            Falls back to "fill()" without the store if the store is unreachable.
+        '''
+        try:
+            value = self.get_obj(name)
+            if value is not None:
+                return value
+            if self.set('lock:' + name, b'1', ttl=lock_ttl, nx=True) is False:
+                deadline = time.monotonic() + self.LOCK_WAIT
+                while time.monotonic() < deadline:
+                    time.sleep(self.LOCK_POLL)
+                    value = self.get_obj(name)
+                    if value is not None:
+                        return value
+                print('Shared store: nobody filled "{}" in time, fetching it here.'.format(name))
+        except StoreError as e:
+            print(e)
+            return fill()
+        value = fill()
+        try:
+            if value is not None:
+                self.set_obj(name, value, ttl)
+            self.delete('lock:' + name)
+        except StoreError as e:
+            print(e)
+        return value
+
+
+async def off_loop(store, fn, *args):
+    ''' "fn(*args)" for asyncio code, where fn may make calls to "store": in a store thread if there is a store, right here
+        if it is None (fn then only touches memory, no point in a thread hop). Example:
+            value = await off_loop(self.SHARED, self._shared_lookup, key)
+    '''
+    if store is None:
+        return fn(*args)
+    return await store.run_async(fn, *args)
+
+
+class StoreServer(object):
+    ''' In-repo stand-in for Redis: the handful of commands SharedStore uses (strings with expiry, counters, lists, MULTI/EXEC),
+        kept in a dict of one asyncio server. No persistence -> state lives as long as the server.
+        Used when the bot runs several processes without a REDIS_URL, and by benchmarks.
+        Example:
+            server = StoreServer().start()  # in a daemon thread of this process
+            STORE = SharedStore(server.url)
+            process, url = StoreServer.spawn()  # or in its own process, so its work doesn't compete for this process' GIL
+    '''
+    SWEEP_SECONDS = 10  # Expired keys are dropped when read, and all of them every this many seconds
+
+    def __init__(self):
+        self._data = {}  # key (bytes) -> value (bytes or list)
+        self._expires = {}  # key -> time.monotonic() deadline
+        self.url = None
+        self.loop = None
+
+    # --- Commands ---
+
+    def _alive(self, key: bytes) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, deadline in self._expires.items() if deadline <= now]:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        self.loop.call_later(self.SWEEP_SECONDS, self._sweep)
+
+    def execute(self, args: list):
+        name = args[0].upper().decode('ascii')
+        handler = getattr(self, '_cmd_' + name.lower(), None)
+        if handler is None:
+            return StoreError("ERR unknown command '{}'".format(name))
+        try:
+            return handler(*args[1:])
+        except (TypeError, ValueError, IndexError):
+            return StoreError("ERR wrong arguments for '{}' command".format(name))
+
+    def _cmd_ping(self, *args):
+        return 'PONG'
+
+    def _cmd_auth(self, *args):
+        return 'OK'
+
+    def _cmd_select(self, *args):
+        return 'OK'
+
+    def _cmd_flushall(self, *args):
+        self._data.clear()
+        self._expires.clear()
+        return 'OK'
+
+    def _cmd_get(self, key):
+        return self._data[key] if self._alive(key) else None
+
+    def _cmd_mget(self, *keys):
+        return [self._cmd_get(key) for key in keys]
+
+    def _cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        if b'NX' in options and self._alive(key):
+            return None
+        self._data[key] = value
+        self._expires.pop(key, None)
+        if b'PX' in options:
+            self._expires[key] = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+        elif b'EX' in options:
+            self._expires[key] = time.monotonic() + int(options[options.index(b'EX') + 1])
+        return 'OK'
+
+    def _cmd_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._alive(key):
+                deleted += 1
+                self._data.pop(key)
+                self._expires.pop(key, None)
+        return deleted
+
+    def _cmd_incrby(self, key, amount):
+        value = int(self._data[key]) + int(amount) if self._alive(key) else int(amount)
+        self._data[key] = str(value).encode('ascii')
+        return value
+
+    def _cmd_pexpire(self, key, milliseconds):
+        if not self._alive(key):
+            return 0
+        self._expires[key] = time.monotonic() + int(milliseconds) / 1000
+        return 1
+
+    def _cmd_rpush(self, key, *values):
+        items = self._data[key] if self._alive(key) else []
+        items.extend(values)
+        self._data[key] = items
+        return len(items)
+
+    def _cmd_lrange(self, key, start, stop):
+        items = self._data[key] if self._alive(key) else []
+        start, stop = int(start), int(stop)  # Both inclusive, negative count from the end
+        start, stop = max(0, start + len(items) if start < 0 else start), stop + len(items) if stop < 0 else stop
+        return items[start:stop + 1]
+
+    def _cmd_ltrim(self, key, start, stop):
+        if self._alive(key):
+            self._data[key] = self._cmd_lrange(key, start, stop)
+        return 'OK'
+
+    # --- Protocol ---
+
+    @staticmethod
+    def _encode(reply) -> bytes:
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, StoreError):
+            return b'-%s\r\n' % str(reply).encode('utf-8')
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode('utf-8')
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, bytes):
+            return b'$%d\r\n%s\r\n' % (len(reply), reply)
+        return b'*%d\r\n' % len(reply) + b''.join(StoreServer._encode(item) for item in reply)
+
+    @staticmethod
+    async def _read_command(reader) -> list or None:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):  # Inline command, e.g. "PING" typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _serve_client(self, reader, writer) -> None:
+        queued = None  # Commands between MULTI and EXEC
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if len(args) == 0:
+                    continue
+                name = args[0].upper()
+                if name == b'MULTI':
+                    queued, reply = [], 'OK'
+                elif name == b'EXEC' and queued is not None:
+                    reply, queued = [self.execute(command) for command in queued], None  # No await in between -> atomic
+                elif queued is not None:
+                    queued.append(args)
+                    reply = 'QUEUED'
+                else:
+                    reply = self.execute(args)
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _start(self, host: str, port: int):
+        server = await asyncio.start_server(self._serve_client, host, port)
+        self.url = 'redis://{0}:{1}'.format(host, server.sockets[0].getsockname()[1])
+        self.loop.call_later(self.SWEEP_SECONDS, self._sweep)
+        return server
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> 'StoreServer':
+        '''Serves in a daemon thread of this process. Returns self once the server accepts connections, see self.url.'''
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._start(host, port))
+            ready.set()
+            self.loop.run_forever()
+        threading.Thread(target=run, name='shared-store', daemon=True).start()
+        ready.wait()
+        return self
+
+    @staticmethod
+    def spawn(host: str = '127.0.0.1', port: int = 0) -> tuple:
+        ''' Serves in a child process ("python shared_store.py"). Returns (subprocess.Popen, url). The child exits when this
+            process closes its stdin, i.e. when this process ends for any reason.
+        '''
+        process = subprocess.Popen([sys.executable, __file__, '--host', host, '--port', str(port)],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        url = process.stdout.readline().decode('utf-8').strip()
+        if not url.startswith('redis://'):
+            process.kill()
+            raise StoreError('Shared store process did not start')
+        return process, url
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Redis compatible stand-in for the shared store of bot processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    store_server = StoreServer().start(args.host, args.port)
+    print(store_server.url, flush=True)
+    try:
+        sys.stdin.read()  # Returns when the parent closes our stdin or exits
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,66 @@
+from collections import namedtuple
+from types import MappingProxyType  # Read-only dict views, so nobody can modify the index after it has been built.
+
+
+# One row of CoinMarketCap /cryptocurrency/map response. Only the fields the bot actually uses are kept.
+CryptoEntry = namedtuple('CryptoEntry', ['id', 'symbol', 'name', 'slug', 'rank'])
+
+UNRANKED = 10 ** 9  # Rank given to tokens CMC has not ranked (rank is None) -> always sorted after ranked ones.
+
+
+def _rank_key(entry: CryptoEntry) -> int:
+    return entry.rank if entry.rank is not None else UNRANKED
+
+
+class SymbolIndex(object):
+    ''' Immutable hashed lookup tables over CoinMarketCap crypto and fiat maps.
+        Built once when the maps are loaded, so every chat message does a single dict lookup instead of rebuilding
+        lower-cased copies of 10k+ element lists and scanning them.
+        Many tickers are shared by several coins on CMC (e.g. multiple "UNI" tokens). All of them are kept, sorted by CMC rank,
+        and lookup() returns the best ranked one -> the coin users most likely mean.
+        Example:
+            index = SymbolIndex(crypto_entries, ['USD', 'EUR'])
+            index.lookup('btc')  -> CryptoEntry(id=1, symbol='BTC', name='Bitcoin', slug='bitcoin', rank=1)
+            index.fiat('eur')    -> 'EUR'
+    '''
+    __slots__ = ('_by_symbol', '_fiats', 'has_crypto_map', 'has_fiat_map', 'crypto_count', 'fiat_count')
+
+    def __init__(self, crypto_entries: list = None, fiat_symbols: list = None):
+        by_symbol = {}
+        for entry in crypto_entries or ():
+            by_symbol.setdefault(entry.symbol.casefold(), []).append(entry)
+        self._by_symbol = MappingProxyType({key: tuple(sorted(entries, key=_rank_key)) for key, entries in by_symbol.items()})
+        self._fiats = MappingProxyType({fiat.casefold(): fiat for fiat in fiat_symbols or ()})
+        # When a map could not be loaded, the bot still does "blind" queries -> callers must be able to tell empty from missing.
+        self.has_crypto_map = crypto_entries is not None
+        self.has_fiat_map = fiat_symbols is not None
+        self.crypto_count = len(crypto_entries) if crypto_entries is not None else 0
+        self.fiat_count = len(self._fiats)
+
+    def with_fiats(self, fiat_symbols: list = None) -> 'SymbolIndex':
+        '''Index of the same crypto map and another fiat map. Crypto tables are read-only -> shared, not rebuilt.'''
+        index = object.__new__(SymbolIndex)
+        index._by_symbol, index.has_crypto_map, index.crypto_count = self._by_symbol, self.has_crypto_map, self.crypto_count
+        index._fiats = MappingProxyType({fiat.casefold(): fiat for fiat in fiat_symbols or ()})
+        index.has_fiat_map = fiat_symbols is not None
+        index.fiat_count = len(index._fiats)
+        return index
+
+    def lookup(self, symbol: str) -> CryptoEntry or None:
+        '''Returns best ranked crypto entry for a symbol (case insensitive) or None if symbol is unknown.'''
+        entries = self._by_symbol.get(symbol.casefold())
+        return entries[0] if entries else None
+
+    def candidates(self, symbol: str) -> tuple:
+        '''Returns all crypto entries sharing the same symbol, best ranked first. Empty tuple if unknown.'''
+        return self._by_symbol.get(symbol.casefold(), ())
+
+    def fiat(self, currency: str) -> str or None:
+        '''Returns fiat symbol in the casing CMC uses (e.g. "eur" -> "EUR") or None if currency is unknown.'''
+        return self._fiats.get(currency.casefold())
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol.casefold() in self._by_symbol
+
+    def __len__(self) -> int:
+        return len(self._by_symbol)
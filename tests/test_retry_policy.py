@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cmc_async import CMCTransportError  # noqa: E402
+from credit_budget import OutOfCreditsError  # noqa: E402
+from retry_policy import CircuitBreaker, CircuitOpenError, RetryPolicy  # noqa: E402
+
+
+class CircuitBreakerProbeTest(unittest.TestCase):
+    '''A half-open probe refused before reaching CMC must not leave the breaker stuck half-open.'''
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        self.policy = RetryPolicy(max_attempts=1, breaker=self.breaker)
+        self.calls = 0
+
+    def run_call(self, error: Exception = None):
+        async def attempt():
+            self.calls += 1
+            if error is not None:
+                raise error
+            return 'ok'
+        return asyncio.run(self.policy.call(attempt))
+
+    def open_circuit(self):
+        with self.assertRaises(CMCTransportError):
+            self.run_call(CMCTransportError('connection refused'))
+        self.assertEqual(self.breaker.state, 'open')
+        time.sleep(0.06)
+        self.assertEqual(self.breaker.state, 'half-open')
+
+    def test_probe_refused_for_credits_then_next_call_probes(self):
+        self.open_circuit()
+        with self.assertRaises(OutOfCreditsError):
+            self.run_call(OutOfCreditsError('no credits left'))
+        self.assertFalse(self.breaker.probe_in_flight)
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertEqual(self.run_call(), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_probe_cancelled_then_next_call_probes(self):
+        self.open_circuit()
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(self.policy.call(cancelled))
+        self.assertFalse(self.breaker.probe_in_flight)
+        self.assertEqual(self.run_call(), 'ok')
+
+    def test_second_call_during_probe_fails_fast(self):
+        self.open_circuit()
+        self.assertTrue(self.breaker.before_call())
+        calls = self.calls
+        with self.assertRaises(CircuitOpenError):
+            self.run_call()
+        self.assertEqual(self.calls, calls)
+        self.assertTrue(self.breaker.probe_in_flight)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credit_budget import OutOfCreditsError, SharedKeyBudget  # noqa: E402
+from quote_cache import QuoteCache  # noqa: E402
+from shared_store import SharedStore, StoreServer  # noqa: E402
+
+KEY = (1, 'USD')
+QUOTE = {'id': 1, 'symbol': 'BTC', 'quote': {'USD': {'price': 1.0}}}
+
+
+def unreachable_url() -> str:
+    '''Url of a port nothing listens on.'''
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return 'redis://127.0.0.1:{}'.format(port)
+
+
+class StoreTestCase(unittest.TestCase):
+    '''One StoreServer on an ephemeral port for the whole class, emptied before every test. Each "process" gets its own client.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StoreServer().start()
+
+    def setUp(self):
+        self.store = SharedStore(self.server.url)
+        self.store.execute(('FLUSHALL',))
+
+
+class SharedQuoteCacheTest(StoreTestCase):
+    '''Two QuoteCache instances standing in for two bot processes.'''
+
+    def setUp(self):
+        super().setUp()
+        self.first = QuoteCache(shared=SharedStore(self.server.url))
+        self.second = QuoteCache(shared=SharedStore(self.server.url))
+
+    def lock_name(self) -> str:
+        return 'lock:' + QuoteCache._shared_name(KEY)
+
+    def test_quote_loaded_by_one_is_a_shared_hit_for_the_other(self):
+        self.first.put(KEY, QUOTE)
+        value, error = self.second.get(KEY, lambda: self.fail('loaded although the other cache has it'))
+        self.assertEqual(value, QUOTE)
+        self.assertIsNone(error)
+        self.assertEqual(self.second.stats()['shared_hits'], 1)
+
+    def test_one_claim_holder_loads_while_the_other_polls(self):
+        loading, release = threading.Event(), threading.Event()
+        second_loads = []
+        results = {}
+
+        def slow_loader():
+            loading.set()
+            release.wait(5)
+            return QUOTE, None
+
+        def second_loader():
+            second_loads.append(1)
+            return None, 'should not load'
+
+        first = threading.Thread(target=lambda: results.setdefault('first', self.first.get(KEY, slow_loader)))
+        first.start()
+        self.assertTrue(loading.wait(5))
+        self.assertIsNotNone(self.store.get(self.lock_name()))
+        second = threading.Thread(target=lambda: results.setdefault('second', self.second.get(KEY, second_loader)))
+        second.start()
+        time.sleep(0.2)  # Second cache polls the store meanwhile
+        self.assertTrue(second.is_alive())
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(results['first'], (QUOTE, None))
+        self.assertEqual(results['second'], (QUOTE, None))
+        self.assertEqual(second_loads, [])
+        self.assertIsNone(self.store.get(self.lock_name()))
+
+    def test_failed_load_gives_up_the_claim(self):
+        self.assertEqual(self.first.get(KEY, lambda: (None, 'CMC down')), (None, 'CMC down'))
+        self.assertIsNone(self.store.get(self.lock_name()))
+        started = time.monotonic()
+        self.assertEqual(self.second.get(KEY, lambda: (QUOTE, None)), (QUOTE, None))
+        self.assertLess(time.monotonic() - started, 1)  # Did not wait for LOAD_LOCK_SECONDS
+
+    def test_failed_async_load_gives_up_the_claim(self):
+        async def failing():
+            return None, 'CMC down'
+
+        self.assertEqual(asyncio.run(self.first.get_async(KEY, failing)), (None, 'CMC down'))
+        deadline = time.monotonic() + 2
+        while self.store.get(self.lock_name()) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)  # Unclaimed from a store thread, without waiting
+        self.assertIsNone(self.store.get(self.lock_name()))
+
+
+class SharedKeyBudgetTest(StoreTestCase):
+    '''Two SharedKeyBudget instances of one API key, standing in for two bot processes.'''
+
+    def setUp(self):
+        super().setUp()
+        if SharedKeyBudget._minute_left() < 2:  # Counters are per clock minute -> don't let a test cross into the next one
+            time.sleep(SharedKeyBudget._minute_left() + 0.05)
+
+    def budgets(self, **limits) -> tuple:
+        return tuple(SharedKeyBudget(SharedStore(self.server.url), 'KEY', reserve=0, **limits) for _ in range(2))
+
+    def used(self, budget: SharedKeyBudget) -> list:
+        return [int(self.store.get(name) or 0) for name, _ in budget._counters()]
+
+    def test_minute_limit_is_shared_and_rolled_back(self):
+        first, second = self.budgets(minute_limit=3)
+        first.admit(1)
+        first.admit(1)
+        second.admit(1)
+        with self.assertRaisesRegex(OutOfCreditsError, 'minute'):
+            second.admit(1)
+        self.assertEqual(self.used(first), [3, 3, 3])  # Refused call took nothing
+        self.assertEqual(second.refused, 1)
+
+    def test_daily_limit_is_shared_and_rolled_back(self):
+        first, second = self.budgets(daily_limit=10)
+        first.admit(6)
+        with self.assertRaisesRegex(OutOfCreditsError, 'Daily'):
+            second.admit(6)
+        self.assertEqual(self.used(first), [1, 6, 6])
+        second.admit(4)
+        self.assertEqual(self.used(first), [2, 10, 10])
+
+    def test_settle_corrects_shared_counters(self):
+        first, second = self.budgets(daily_limit=10)
+        first.admit(3)
+        first.settle(3, 1)
+        self.assertEqual(self.used(second), [1, 1, 1])
+
+    def test_unreachable_store_falls_back_to_local_buckets(self):
+        budget = SharedKeyBudget(SharedStore(unreachable_url(), timeout=0.2), 'KEY', minute_limit=2, reserve=0)
+        budget.admit(1)
+        budget.admit(1)
+        with self.assertRaisesRegex(OutOfCreditsError, 'minute'):
+            budget.admit(1)
+        self.assertFalse(budget.exhausted())  # Snapshot read fails in background, never raises here
+        self.assertEqual(budget.minute_wait(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
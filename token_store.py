@@ -0,0 +1,191 @@
+import os
+import json
+import hashlib
+import pickle
+import sqlite3
+import threading
+
+
+class TokenInfoStore(object):
+    ''' Persistent store for token metadata (CMC cryptocurrency/info replies), one SQLite row per token symbol.
+        Adding a token writes one row instead of rewriting a pickle with every token in it.
+        Full replies (descriptions, logos, tags, platforms ...) stay on disk and are read on demand with get(). The only field
+        a price message shows, project website, is kept in memory as well, in a compact column: one bytes table with all
+        websites back to back, and {symbol: offset and length} -> ~150 bytes per token instead of a parsed reply of several KB.
+        Behaves like the dict it replaces for reads: "BTC" in store, store.get("BTC"), len(store). store.website("BTC") never
+        touches the disk.
+        Thread-safe: one connection shared under a lock (SQLite is fast enough that calls never wait long). Memory column reads
+        take no lock.
+    '''
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS token_info (symbol TEXT PRIMARY KEY, info TEXT NOT NULL, website TEXT);
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+    '''
+    MAX_WEBSITE_BYTES = 0xFFFF  # Length must fit the low 16 bits of a packed column entry. Longer URLs are not real websites.
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')  # Readers never wait for a writer
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        # ({symbol: offset << 16 | length of its website in the table}, bytes table). One attribute -> a reload swaps both at once.
+        # The table is only appended to, a replaced website leaves its old bytes unused (rare, tokens are rarely re-fetched).
+        self._column = ({}, bytearray())
+        with self._lock:
+            if 'website' not in [row[1] for row in self._conn.execute('PRAGMA table_info(token_info)')]:
+                self._conn.execute('ALTER TABLE token_info ADD COLUMN website TEXT')  # Store written by an older version
+            # Covering index -> loading the column never reads the big info texts stored before it in each row
+            self._conn.execute('CREATE INDEX IF NOT EXISTS token_website ON token_info (symbol, website)')
+            self._fill_website_column()
+            self._load_website_column()
+
+    @staticmethod
+    def website_of(info: dict) -> str:
+        '''First project website in a CMC info reply, '' if it has none.'''
+        websites = (info.get('urls') or {}).get('website') or ['']
+        return websites[0] or ''
+
+    def _fill_website_column(self) -> None:
+        '''Extracts websites of rows that have none yet (written by an older version, or merged in from an older snapshot).'''
+        rows = self._conn.execute('SELECT symbol, info FROM token_info WHERE website IS NULL').fetchall()
+        if len(rows) == 0:
+            return
+        self._conn.execute('BEGIN')
+        try:
+            self._conn.executemany('UPDATE token_info SET website = ? WHERE symbol = ?',
+                                   [(self.website_of(json.loads(info)), symbol) for symbol, info in rows])
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+    def _load_website_column(self) -> None:
+        websites, table = {}, bytearray()
+        for symbol, website in self._conn.execute('SELECT symbol, website FROM token_info'):
+            websites[symbol] = self._pack_website(table, website)
+        self._column = websites, table  # One assignment -> readers see the old column or the new one, never a mix
+
+    def _pack_website(self, table: bytearray, website: str) -> int:
+        data = (website or '').encode('utf-8')[:self.MAX_WEBSITE_BYTES]
+        offset = len(table)
+        table += data
+        return offset << 16 | len(data)
+
+    def website(self, symbol: str) -> str or None:
+        '''Project website of a stored token from memory, '' if CMC has none for it. None if the token is not stored.'''
+        websites, table = self._column
+        packed = websites.get(symbol)
+        if packed is None:
+            return None
+        offset = packed >> 16
+        return table[offset:offset + (packed & 0xFFFF)].decode('utf-8', 'replace')
+
+    def get(self, symbol: str) -> dict or None:
+        '''Full CMC info reply of a token, read from disk.'''
+        with self._lock:
+            row = self._conn.execute('SELECT info FROM token_info WHERE symbol = ?', (symbol,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._column[0]
+
+    def __len__(self) -> int:
+        return len(self._column[0])
+
+    def symbols(self) -> list:
+        return list(self._column[0])
+
+    def put_many(self, infos: dict) -> int:
+        ''' Stores {symbol: info} in one transaction. Returns how many symbols were new.
+            CMC v2 info replies hold a list of tokens per symbol (tickers are not unique) -> the first one, best ranked, is kept.
+        '''
+        rows = []
+        for symbol, info in infos.items():
+            if isinstance(info, list):
+                if len(info) == 0:
+                    continue
+                info = info[0]
+            rows.append((symbol.upper(), json.dumps(info, separators=(',', ':')), self.website_of(info)))
+        with self._lock:
+            before = len(self._column[0])
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany('INSERT OR REPLACE INTO token_info (symbol, info, website) VALUES (?, ?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            websites, table = self._column
+            for symbol, _, website in rows:  # Bytes first, then the dict entry pointing to them -> readers never see a half write
+                websites[symbol] = self._pack_website(table, website)
+            return len(self._column[0]) - before
+
+    def migrate_pickle(self, pickle_path: str) -> int:
+        ''' One-shot import of an old crypto_info.pickle ({symbol: info} dict). Remembers which file was imported, so a pickle
+            lying around is never imported twice and never overwrites newer rows. The pickle itself is left untouched.
+            Returns how many tokens were added.
+        '''
+        name = os.path.basename(pickle_path)
+        if self.get_meta('migrated_' + name) is not None or not os.path.exists(pickle_path):
+            return 0
+        try:
+            with open(pickle_path, 'rb') as f:
+                pickle_data = pickle.load(f)
+        except Exception as e:
+            print('PICKLE ERROR: {}'.format(e))
+            return 0
+        new_rows = {symbol: info for symbol, info in pickle_data.items() if symbol.upper() not in self}
+        added = self.put_many(new_rows)
+        self.set_meta('migrated_' + name, str(added))
+        print('Migrated {0} tokens from {1} into {2}.'.format(added, name, os.path.basename(self.path)))
+        return added
+
+    def merge_from(self, other_path: str) -> int:
+        ''' Adds tokens from another store file (e.g. a downloaded snapshot) that are not here yet. Rows already here are kept,
+            they are never older than the other copy. Returns how many tokens were added.
+        '''
+        with self._lock:
+            before = len(self._column[0])
+            self._conn.execute('ATTACH DATABASE ? AS other', (other_path,))
+            try:
+                self._conn.execute('INSERT OR IGNORE INTO token_info (symbol, info) SELECT symbol, info FROM other.token_info')
+            finally:
+                self._conn.execute('DETACH DATABASE other')
+            self._fill_website_column()
+            self._load_website_column()
+            return len(self._column[0]) - before
+
+    def content_hash(self) -> str:
+        '''SHA-256 of all tokens in symbol order. Same tokens -> same hash, no matter how SQLite laid the file out.'''
+        digest = hashlib.sha256()
+        with self._lock:
+            for symbol, info in self._conn.execute('SELECT symbol, info FROM token_info ORDER BY symbol'):
+                digest.update(symbol.encode())
+                digest.update(b'\0')
+                digest.update(info.encode())
+                digest.update(b'\n')
+        return digest.hexdigest()
+
+    def get_meta(self, name: str) -> str or None:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, name: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def snapshot(self, target_path: str) -> None:
+        '''Writes a consistent copy of the whole store into a separate file (e.g. for upload), while the store stays in use.'''
+        target = sqlite3.connect(target_path)
+        try:
+            with self._lock:
+                self._conn.backup(target)
+        finally:
+            target.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,100 @@
+import time
+from collections import deque
+from contextvars import ContextVar  # Current trace follows asyncio tasks on its own, threads get it through bound()
+
+_CURRENT = ContextVar('trace', default=None)
+SLOW_TRACES = deque(maxlen=20)  # Last slow traces, newest last. Shown by /profile.
+
+
+class Trace(object):
+    ''' Timeline of one request (a price lookup, an inline query, a background job): named spans with their offset from the start
+        and duration. Spans are recorded by span() anywhere down the call chain while the trace is active -> handlers, CMCPrices,
+        retries and CMC calls don't pass it around. Cheap: a span is two perf_counter() calls and a list append.
+        A trace crosses into the asyncio loop with bound(), into other threads not at all (spans there are simply not recorded).
+        Example:
+            trace = Trace('price', 'btc eur')
+            with active(trace):
+                with span('quote'):
+                    ...
+            trace.finish(slow_seconds=2)  # prints the breakdown if it took longer
+    '''
+    __slots__ = ('name', 'detail', 'started', 'spans', 'duration')
+
+    def __init__(self, name: str, detail: str = ''):
+        self.name = name
+        self.detail = detail
+        self.started = time.perf_counter()
+        self.spans = []  # (offset from start, duration, name). list.append is atomic -> spans may come from several tasks.
+        self.duration = None
+
+    def add(self, name: str, started: float, duration: float) -> None:
+        self.spans.append((started - self.started, duration, name))
+
+    def finish(self, slow_seconds: float = None) -> float:
+        '''Ends the trace. If it took longer than "slow_seconds", prints its span breakdown and keeps it in SLOW_TRACES.'''
+        self.duration = time.perf_counter() - self.started
+        if slow_seconds is not None and self.duration >= slow_seconds:
+            SLOW_TRACES.append(self)
+            print(self.format())
+        return self.duration
+
+    def format(self) -> str:
+        lines = ['Slow {0} "{1}": {2:.0f} ms'.format(self.name, self.detail, (self.duration or 0) * 1e3)]
+        for offset, duration, name in sorted(self.spans):
+            lines.append('    +{0:7.1f} ms {1:8.1f} ms  {2}'.format(offset * 1e3, duration * 1e3, name))
+        return '\n'.join(lines)
+
+
+class span(object):
+    '''Context manager recording a span into the active trace. Does nothing (except one ContextVar read) when no trace is active.'''
+    __slots__ = ('name', 'trace', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace = _CURRENT.get()
+
+    def __enter__(self):
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.trace is not None:
+            self.trace.add(self.name, self.started, time.perf_counter() - self.started)
+        return False
+
+
+class active(object):
+    '''Makes "trace" the active one in this thread / asyncio task until the block ends. active(None) is allowed and does nothing.'''
+    __slots__ = ('trace', '_token')
+
+    def __init__(self, trace: Trace or None):
+        self.trace = trace
+
+    def __enter__(self):
+        self._token = _CURRENT.set(self.trace) if self.trace is not None else None
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        if self._token is not None:
+            _CURRENT.reset(self._token)
+        return False
+
+
+def current() -> Trace or None:
+    return _CURRENT.get()
+
+
+def bound(coro):
+    ''' Coroutine "coro" running with the trace that is active here. For coroutines handed over to another thread's event loop
+        (AsyncLoop.run/submit), which would start with the loop thread's context otherwise.
+    '''
+    trace = _CURRENT.get()
+    if trace is None:
+        return coro
+    return _run_with(trace, coro)
+
+
+async def _run_with(trace: Trace, coro):
+    with active(trace):
+        return await coro
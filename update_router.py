@@ -0,0 +1,72 @@
+import json
+
+from aiohttp import web  # Webhook endpoint, runs on the bot's asyncio loop
+from telegram.update import Update
+
+
+class UpdateRouter(object):
+    ''' Webhook endpoint of the multi-process mode (see main.py BOT_WORKERS). Takes Telegram updates over HTTP and hands each one
+        to a worker picked by its chat: same chat -> same worker -> updates of a chat are handled in the order they came.
+        Worker 0 is this process: its updates go straight into "local_queue" (dispatcher update queue). Others get the raw JSON
+        through their multiprocessing queue, "worker_queues[i]" for worker i (worker_queues[0] is unused).
+        Telegram gets its 200 as soon as the update is queued, handlers never hold the webhook request.
+        Example:
+            router = UpdateRouter(updater.dispatcher.update_queue, [None, queue_1, queue_2], updater.bot)
+            router.start(CP.ASYNC, '0.0.0.0', 8443, TELEGRAM_TOKEN)
+    '''
+    CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query', 'inline_query',
+                   'chosen_inline_result', 'shipping_query', 'pre_checkout_query', 'my_chat_member', 'chat_member', 'chat_join_request')
+
+    def __init__(self, local_queue, worker_queues: list, bot):
+        self.local_queue = local_queue
+        self.worker_queues = worker_queues
+        self.bot = bot
+        self.routed = [0] * len(worker_queues)  # Updates per worker, for stats
+        self.runner = None
+
+    @classmethod
+    def chat_key(cls, data: dict) -> int:
+        '''Chat (or user, for inline queries and payments) an update belongs to. Update id if it has none.'''
+        for field in cls.CHAT_FIELDS:
+            item = data.get(field)
+            if item is None:
+                continue
+            chat = item.get('chat') or (item.get('message') or {}).get('chat') or item.get('from')
+            if chat is not None:
+                return chat['id']
+        return data.get('update_id', 0)
+
+    def route(self, body: bytes) -> int:
+        '''Hands one update (webhook request body) to its worker. Returns the worker index.'''
+        data = json.loads(body)
+        worker = self.chat_key(data) % len(self.worker_queues)
+        if worker == 0:
+            self.local_queue.put(Update.de_json(data, self.bot))
+        else:
+            self.worker_queues[worker].put(body)
+        self.routed[worker] += 1
+        return worker
+
+    async def _handle(self, request) -> web.Response:
+        try:
+            self.route(await request.read())
+        except (ValueError, KeyError, TypeError) as e:
+            print('Webhook: bad update: {}'.format(e))
+            return web.Response(status=400)
+        return web.Response()
+
+    async def _start(self, listen: str, port: int, url_path: str) -> None:
+        app = web.Application()
+        app.router.add_post('/' + url_path.lstrip('/'), self._handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, listen, port).start()
+
+    def start(self, loop, listen: str, port: int, url_path: str) -> None:
+        '''Starts listening on "loop" (cmc_async.AsyncLoop). Returns once the port is open.'''
+        loop.run(self._start(listen, port, url_path), timeout=10)
+        print('Webhook listening on {0}:{1}, {2} worker(s).'.format(listen, port, len(self.worker_queues)))
+
+    def stop(self, loop) -> None:
+        if self.runner is not None:
+            loop.run(self.runner.cleanup(), timeout=10)